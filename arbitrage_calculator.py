@@ -38,6 +38,9 @@ class ArbitrageCalculator:
     def __init__(self):
         self.config = Config()
         self.open_positions: Dict[str, ArbitragePosition] = {}
+        # Номер версии набора позиций: растет при каждом открытии/закрытии,
+        # по нему потребители понимают, что отрисованную сводку можно переиспользовать
+        self.positions_version = 0
         
     def calculate_spread(self, stock_price: float, futures_price: float, 
                         stock_ticker: str, futures_ticker: str) -> Optional[float]:
@@ -55,11 +58,9 @@ class ArbitrageCalculator:
                 logger.warning(f"Некорректные цены {stock_ticker}/{futures_ticker}: акция {stock_price:.2f}₽, фьючерс {futures_price:.2f}₽")
                 return None
             
-            # ИСПРАВЛЕННЫЙ РАСЧЕТ: Сравниваем цены за одну акцию, а не за лоты
-            # Спред = (цена_фьючерса - цена_акции) / цена_акции * 100%
-            spread_percent = ((futures_price - stock_price) / stock_price) * 100
+            spread_percent = self._spread_percent(stock_price, futures_price)
             
-            logger.debug(f"Спред {stock_ticker}/{futures_ticker}: акция {stock_price:.2f}₽, фьючерс {futures_price:.2f}₽, спред {spread_percent:.4f}%")
+            logger.debug("Спред %s/%s: акция %.2f₽, фьючерс %.2f₽, спред %.4f%%", stock_ticker, futures_ticker, stock_price, futures_price, spread_percent)
             
             return spread_percent
             
@@ -67,6 +68,27 @@ class ArbitrageCalculator:
             logger.error(f"Ошибка расчета спреда для {stock_ticker}/{futures_ticker}: {e}")
             return None
     
+    @staticmethod
+    def _spread_percent(stock_price: float, futures_price: float) -> float:
+        """Спред в процентах по ценам за одну акцию (цены должны быть положительными)"""
+        # ИСПРАВЛЕННЫЙ РАСЧЕТ: Сравниваем цены за одну акцию, а не за лоты
+        # Спред = (цена_фьючерса - цена_акции) / цена_акции * 100%
+        return ((futures_price - stock_price) / stock_price) * 100
+    
+    def below_threshold(self, stock_ticker: str, futures_ticker: str,
+                        stock_price: float, futures_price: float, threshold: float) -> bool:
+        """Быстрый отсев до analyze_arbitrage_opportunity: спред ниже порога, сигнала не будет
+        
+        Пары с открытой позицией не отсеиваются - для них сигнал на закрытие приходит
+        как раз при малом спреде. Некорректные цены тоже пропускаются дальше,
+        их залогирует calculate_spread
+        """
+        if stock_price <= 0 or futures_price <= 0:
+            return False
+        if f"{stock_ticker}_{futures_ticker}" in self.open_positions:
+            return False
+        return abs(self._spread_percent(stock_price, futures_price)) < threshold
+    
     def calculate_position_sizes(self, stock_ticker: str, futures_ticker: str, 
                                investment_amount: float = 100000) -> Tuple[int, int]:
         """Расчет размеров позиций для арбитража с учетом лотности"""
@@ -92,7 +114,8 @@ class ArbitrageCalculator:
                 stock_lots = ratio
                 futures_lots = 1
             
-            logger.debug(f"Позиции {stock_ticker}/{futures_ticker}: {stock_lots} лотов акций ({stock_lot_size} акций/лот), {futures_lots} лотов фьючерса ({futures_lot_value} акций/контракт)")
+            logger.debug("Позиции %s/%s: %s лотов акций (%s акций/лот), %s лотов фьючерса (%s акций/контракт)",
+                         stock_ticker, futures_ticker, stock_lots, stock_lot_size, futures_lots, futures_lot_value)
             
             return int(stock_lots), int(futures_lots)
             
@@ -225,6 +248,7 @@ class ArbitrageCalculator:
             )
             
             self.open_positions[position_key] = position
+            self.positions_version += 1
             logger.info(f"Зарегистрирована позиция: {position_key}")
     
     def close_position(self, signal: ArbitrageSignal):
@@ -234,6 +258,7 @@ class ArbitrageCalculator:
             
             if position_key in self.open_positions:
                 position = self.open_positions.pop(position_key)
+                self.positions_version += 1
                 logger.info(f"Закрыта позиция: {position_key}")
                 return position
         
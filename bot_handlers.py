@@ -20,11 +20,18 @@ class BotHandlers:
         self.status_manager = PairStatusManager()
         self.subscribers: set = set()
         self.application = None
+        self.monitor = None  # ArbitrageMonitor для команды /refresh
+        # Отрисованный ответ /positions и версия позиций, для которой он построен
+        self._positions_cache = ("", -1)
         
     def set_application(self, application):
         """Установка экземпляра Application"""
         self.application = application
     
+    def set_monitor(self, monitor):
+        """Установка монитора арбитража"""
+        self.monitor = monitor
+    
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /start"""
         user_id = update.effective_user.id
@@ -158,25 +165,11 @@ class BotHandlers:
     async def positions_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /positions"""
         try:
-            positions = self.calculator.get_open_positions_summary()
-            
-            if not positions:
-                await update.message.reply_text(
-                    "📋 *Открытые позиции:*\n\nНет открытых арбитражных позиций",
-                    parse_mode=ParseMode.MARKDOWN
-                )
-                return
-            
-            message = "📋 *Открытые арбитражные позиции:*\n\n"
-            
-            for i, position in enumerate(positions, 1):
-                entry_time = position["entry_timestamp"]
-                
-                message += f"*{i}. {position['stock_ticker']}/{position['futures_ticker']}*\n"
-                message += f"📈 Акции: {position['stock_position']} {position['stock_lots']} лотов\n"
-                message += f"📊 Фьючерс: {position['futures_position']} {position['futures_lots']} лотов\n"
-                message += f"📊 Входной спред: {position['entry_spread']:.2f}%\n"
-                message += f"⏰ Время входа: {entry_time}\n\n"
+            # Позиции не менялись с прошлого запроса - отдаем готовый текст
+            message, version = self._positions_cache
+            if version != self.calculator.positions_version:
+                message = self._render_positions()
+                self._positions_cache = (message, self.calculator.positions_version)
             
             await update.message.reply_text(
                 message,
@@ -189,6 +182,28 @@ class BotHandlers:
                 "❌ Ошибка при получении списка позиций"
             )
     
+    def _render_positions(self) -> str:
+        """Текст ответа /positions по текущим открытым позициям"""
+        positions = self.calculator.get_open_positions_summary()
+        
+        if not positions:
+            return "📋 *Открытые позиции:*\n\nНет открытых арбитражных позиций"
+        
+        parts = ["📋 *Открытые арбитражные позиции:*\n\n"]
+        
+        for i, position in enumerate(positions, 1):
+            entry_time = position["entry_timestamp"]
+            
+            parts.append(
+                f"*{i}. {position['stock_ticker']}/{position['futures_ticker']}*\n"
+                f"📈 Акции: {position['stock_position']} {position['stock_lots']} лотов\n"
+                f"📊 Фьючерс: {position['futures_position']} {position['futures_lots']} лотов\n"
+                f"📊 Входной спред: {position['entry_spread']:.2f}%\n"
+                f"⏰ Время входа: {entry_time}\n\n"
+            )
+        
+        return "".join(parts)
+    
     async def instruments_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /instruments"""
         try:
@@ -213,6 +228,19 @@ class BotHandlers:
                 "❌ Ошибка при получении списка инструментов"
             )
     
+    async def refresh_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработчик команды /refresh - внеочередной цикл мониторинга (только для админов)"""
+        if not self.config.is_admin(update.effective_user.id):
+            await update.message.reply_text("❌ Команда доступна только администратору")
+            return
+        
+        if not self.monitor or not self.monitor.is_running:
+            await update.message.reply_text("ℹ️ Мониторинг не запущен")
+            return
+        
+        self.monitor.request_refresh()
+        await update.message.reply_text("🔄 Внеочередная проверка спредов запущена")
+    
     async def subscribe_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /subscribe"""
         user_id = update.effective_user.id
@@ -1,5 +1,6 @@
 import os
 import random
+import time as _time
 from dataclasses import dataclass, field
 from typing import List, Dict, Optional
 from datetime import datetime, time, timezone, timedelta
@@ -7,6 +8,14 @@ from datetime import datetime, time, timezone, timedelta
 # Версия бота  
 BOT_VERSION = "0.2.0"
 
+# Московское время (без переходов на летнее время)
+MOSCOW_TZ = timezone(timedelta(hours=3))
+
+# Шаг кеширования статуса торгов в секундах. Границы торговой сессии (09:00, 18:45)
+# кратны шагу, поэтому статус всего интервала совпадает со статусом любого его момента:
+# биржа открыта с 09:00:00 и закрыта с 18:45:00
+TRADING_HOURS_CACHE_STEP = 30
+
 @dataclass
 class Config:
     """Конфигурация бота"""
@@ -39,6 +48,18 @@ class Config:
     CLOSE_SPREAD_MIN: float = 0.0  # Минимальный спред для закрытия (%)
     CLOSE_SPREAD_MAX: float = 0.5  # Максимальный спред для закрытия (%)
     
+    # Пауза между запросами getUpdates в секундах. 0 - чистый long polling:
+    # Telegram сам держит запрос до появления обновлений, так что пауза только добавляет
+    # задержку каждому сообщению и ограничивает пропускную способность одной пачкой за паузу.
+    # Имеет смысл лишь для разгрузки Telegram при отключенном long polling
+    POLLING_INTERVAL: float = 0.0
+    
+    # Webhook вместо long polling: Telegram сам присылает обновления POST-запросом на
+    # TELEGRAM_WEBHOOK_URL (публичный https-адрес бота). Без него бот опрашивает getUpdates
+    WEBHOOK_URL: str = field(default_factory=lambda: os.getenv("TELEGRAM_WEBHOOK_URL", ""))
+    WEBHOOK_HOST: str = "0.0.0.0"
+    WEBHOOK_PORT: int = field(default_factory=lambda: int(os.getenv("PORT", "8080")))
+    
     # Настройки истории спредов
     MAX_SPREAD_HISTORY: int = 10  # Максимум записей в истории спредов
     
@@ -126,6 +147,11 @@ class Config:
                 "TRNFP": "TRZ5",  # Транснефть-П
                 "YAKG": "YAZ5"    # Якутскэнерго
             }
+        
+        # Кеш is_trading_hours(): (номер интервала, результат)
+        self._trading_hours_memo = (-1, False)
+        # Кеш get_trading_status_message(): (секунда unix-времени, текст)
+        self._status_message_memo = (-1, "")
     
     @classmethod
     def get_admin_users(cls) -> List[int]:
@@ -179,24 +205,54 @@ class Config:
     def is_trading_hours(self, current_time: datetime = None) -> bool:
         """Проверка, находимся ли мы в торговых часах"""
         if current_time is None:
-            # Используем московское время
-            moscow_tz = timezone(timedelta(hours=3))
-            current_time = datetime.now(moscow_tz)
+            # Без явного времени ответ кешируется на TRADING_HOURS_CACHE_STEP секунд:
+            # метод вызывается из цикла мониторинга и почти всех команд
+            bucket = int(_time.time()) // TRADING_HOURS_CACHE_STEP
+            memo_bucket, memo_value = self._trading_hours_memo
+            if memo_bucket != bucket:
+                # Считаем по последнему моменту интервала: результат не зависит от момента
+                # первого вызова
+                bucket_last = datetime.fromtimestamp((bucket + 1) * TRADING_HOURS_CACHE_STEP - 1e-6, MOSCOW_TZ)
+                memo_value = self.is_trading_hours(bucket_last)
+                self._trading_hours_memo = (bucket, memo_value)
+            return memo_value
         
         # Проверяем день недели (0=понедельник, 6=воскресенье)
         weekday = current_time.weekday()
         if weekday not in self.TRADING_DAYS:
             return False
         
-        # Проверяем время
+        # Проверяем время (в TRADING_END_TIME торги уже закрыты)
         current_time_only = current_time.time()
-        return self.TRADING_START_TIME <= current_time_only <= self.TRADING_END_TIME
+        return self.TRADING_START_TIME <= current_time_only < self.TRADING_END_TIME
     
-    def get_trading_status_message(self) -> str:
-        """Получение сообщения о статусе торгов"""
-        moscow_tz = timezone(timedelta(hours=3))
-        now = datetime.now(moscow_tz)
+    def seconds_until_market_open(self, current_time: datetime = None) -> float:
+        """Сколько секунд осталось до ближайшего открытия торгов (0 - биржа уже работает)"""
+        now = current_time or datetime.now(MOSCOW_TZ)
+        if self.is_trading_hours(now):
+            return 0.0
         
+        # Ближайший торговый день, начало торгов в который еще впереди
+        for days_ahead in range(8):
+            day = now + timedelta(days=days_ahead)
+            if day.weekday() not in self.TRADING_DAYS:
+                continue
+            open_at = datetime.combine(day.date(), self.TRADING_START_TIME, tzinfo=now.tzinfo)
+            if open_at > now:
+                return (open_at - now).total_seconds()
+        return 0.0
+    
+    def get_trading_status_message(self) -> str:
+        """Получение сообщения о статусе торгов (кешируется на секунду)"""
+        second = int(_time.time())
+        memo_second, memo_text = self._status_message_memo
+        if memo_second != second:
+            memo_text = self._build_trading_status_message(datetime.fromtimestamp(second, MOSCOW_TZ))
+            self._status_message_memo = (second, memo_text)
+        return memo_text
+    
+    def _build_trading_status_message(self, now: datetime) -> str:
+        """Сообщение о статусе торгов на момент now (московское время)"""
         if self.is_trading_hours(now):
             return f"🟢 Биржа работает\n📅 Торги до {self.TRADING_END_TIME.strftime('%H:%M')} МСК"
         
@@ -2,7 +2,7 @@ import os
 import logging
 import asyncpg
 import asyncio
-from typing import Optional, Dict, List, Any
+from typing import Optional, Dict, List, Any, Set, Tuple
 from dataclasses import dataclass
 from datetime import datetime
 
@@ -80,7 +80,8 @@ class Database:
                     subscription_crypto_address TEXT DEFAULT '',
                     trial_start TIMESTAMP NULL,
                     trial_end TIMESTAMP NULL,
-                    username VARCHAR(100) DEFAULT ''
+                    username VARCHAR(100) DEFAULT '',
+                    subscribed BOOLEAN DEFAULT FALSE
                 )
             """)
             
@@ -94,7 +95,8 @@ class Database:
                 ("subscription_crypto_address", "TEXT DEFAULT ''"),
                 ("trial_start", "TIMESTAMP NULL"),
                 ("trial_end", "TIMESTAMP NULL"),
-                ("username", "VARCHAR(100) DEFAULT ''")
+                ("username", "VARCHAR(100) DEFAULT ''"),
+                ("subscribed", "BOOLEAN DEFAULT FALSE")
             ]
             
             for column_name, column_definition in columns_to_add:
@@ -160,12 +162,13 @@ class Database:
                     VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14, CURRENT_TIMESTAMP)
                     ON CONFLICT (user_id) 
                     DO UPDATE SET 
+                        -- signals_sent не перезаписываем: счетчик растет только через increment_signals_bulk,
+                        -- иначе сохранение прочитанной ранее строки затрет записанные за это время увеличения
                         monitoring_interval = EXCLUDED.monitoring_interval,
                         spread_threshold = EXCLUDED.spread_threshold,
                         max_signals = EXCLUDED.max_signals,
                         is_monitoring = EXCLUDED.is_monitoring,
                         selected_instruments = EXCLUDED.selected_instruments,
-                        signals_sent = EXCLUDED.signals_sent,
                         subscription_active = EXCLUDED.subscription_active,
                         subscription_start = EXCLUDED.subscription_start,
                         subscription_end = EXCLUDED.subscription_end,
@@ -223,6 +226,25 @@ class Database:
             logger.error(f"❌ Ошибка загрузки настроек: {e}")
             return None
     
+    async def increment_signals_bulk(self, increments: List[Tuple[int, int]]) -> bool:
+        """Атомарно увеличить счетчики сигналов нескольких пользователей: [(user_id, delta), ...]"""
+        try:
+            async with self.pool.acquire() as conn:
+                async with conn.transaction():
+                    await conn.executemany("""
+                        INSERT INTO user_settings (user_id, signals_sent, updated_at)
+                        VALUES ($1, $2, CURRENT_TIMESTAMP)
+                        ON CONFLICT (user_id)
+                        DO UPDATE SET
+                            signals_sent = user_settings.signals_sent + EXCLUDED.signals_sent,
+                            updated_at = CURRENT_TIMESTAMP
+                    """, increments)
+                return True
+                
+        except Exception as e:
+            logger.error(f"❌ Ошибка увеличения счетчиков сигналов: {e}")
+            return False
+    
     async def get_all_monitoring_users(self) -> List[UserSettings]:
         """Получение всех пользователей с активным мониторингом"""
         try:
@@ -250,6 +272,33 @@ class Database:
             logger.error(f"❌ Ошибка получения активных пользователей: {e}")
             return []
     
+    async def load_all_subscribers(self) -> Set[int]:
+        """Загрузка ID всех подписчиков на уведомления одним запросом"""
+        try:
+            async with self.pool.acquire() as conn:
+                rows = await conn.fetch("SELECT user_id FROM user_settings WHERE subscribed = TRUE")
+                return {row['user_id'] for row in rows}
+                
+        except Exception as e:
+            logger.error(f"❌ Ошибка загрузки подписчиков: {e}")
+            return set()
+    
+    async def set_subscribed(self, user_ids: List[int], subscribed: bool) -> bool:
+        """Сохранение признака подписки на уведомления для одного или нескольких пользователей"""
+        try:
+            async with self.pool.acquire() as conn:
+                await conn.execute("""
+                    INSERT INTO user_settings (user_id, subscribed)
+                    SELECT unnest($1::BIGINT[]), $2
+                    ON CONFLICT (user_id)
+                    DO UPDATE SET subscribed = EXCLUDED.subscribed
+                """, list(user_ids), subscribed)
+                return True
+                
+        except Exception as e:
+            logger.error(f"❌ Ошибка сохранения подписки на уведомления: {e}")
+            return False
+    
     async def get_all_users(self) -> List[UserSettings]:
         """Получение всех пользователей (независимо от статуса мониторинга)"""
         try:
@@ -298,7 +347,34 @@ class Database:
                 
         except Exception as e:
             logger.debug(f"❌ Ошибка обновления статуса источника: {e}")
-    
+
+    async def update_source_statuses_bulk(self, updates: List[Tuple[str, str, Optional[str]]]):
+        """Пакетное обновление статусов источников данных одной транзакцией"""
+        if not updates:
+            return
+
+        try:
+            async with self.pool.acquire() as conn:
+                async with conn.transaction():
+                    await conn.executemany("""
+                        INSERT INTO data_sources_status
+                        (source_name, status, last_check, error_count, last_error)
+                        VALUES ($1, $2, CURRENT_TIMESTAMP,
+                                CASE WHEN $2 = 'error' THEN 1 ELSE 0 END, $3)
+                        ON CONFLICT (source_name)
+                        DO UPDATE SET
+                            status = EXCLUDED.status,
+                            last_check = CURRENT_TIMESTAMP,
+                            error_count = CASE
+                                WHEN EXCLUDED.status = 'error' THEN data_sources_status.error_count + 1
+                                ELSE 0
+                            END,
+                            last_error = EXCLUDED.last_error
+                    """, updates)
+
+        except Exception as e:
+            logger.debug(f"❌ Ошибка пакетного обновления статусов источников: {e}")
+
     async def get_failed_sources(self) -> List[str]:
         """Получение списка неисправных источников"""
         try:
@@ -3,6 +3,7 @@ import asyncio
 import logging
 from telegram.ext import Application, CommandHandler, MessageHandler, filters
 from config import Config
+from utils import run_async
 from bot_handlers import BotHandlers
 from monitoring import ArbitrageMonitor
 
@@ -33,6 +34,7 @@ class ArbitrageBotApp:
         # Передаем application в handlers и monitor
         self.handlers.set_application(self.application)
         self.monitor.set_application(self.application)
+        self.handlers.set_monitor(self.monitor)
         
         # Регистрируем команды
         self.application.add_handler(CommandHandler("start", self.handlers.start_command))
@@ -42,6 +44,7 @@ class ArbitrageBotApp:
         self.application.add_handler(CommandHandler("instruments", self.handlers.instruments_command))
         self.application.add_handler(CommandHandler("subscribe", self.handlers.subscribe_command))
         self.application.add_handler(CommandHandler("unsubscribe", self.handlers.unsubscribe_command))
+        self.application.add_handler(CommandHandler("refresh", self.handlers.refresh_command))
         
         # Обработчик сообщений
         self.application.add_handler(
@@ -102,4 +105,4 @@ async def main():
         logger.info("Бот остановлен")
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    run_async(main())
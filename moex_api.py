@@ -7,14 +7,22 @@ from datetime import datetime
 import json
 from config import Config
 
+# Ответы ISS занимают десятки килобайт - разбираем их orjson, если он установлен
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
 logger = logging.getLogger(__name__)
 
 class MOEXAPIClient:
     """Клиент для работы с MOEX ISS API с соблюдением всех правил"""
     
-    def __init__(self):
+    def __init__(self, connector: Optional[aiohttp.BaseConnector] = None):
         self.config = Config()
         self.session = None
+        self.connector = connector  # внешний пул соединений (закрывает его владелец)
         self.last_request_time = 0
         self.request_times = []  # История времен запросов для контроля частоты
         self.failed_requests = {}  # Счетчик неудачных запросов по URL
@@ -31,7 +39,9 @@ class MOEXAPIClient:
         }
         self.session = aiohttp.ClientSession(
             timeout=aiohttp.ClientTimeout(total=self.config.REQUEST_TIMEOUT),
-            headers=headers
+            headers=headers,
+            connector=self.connector,
+            connector_owner=self.connector is None
         )
         return self
         
@@ -93,10 +103,10 @@ class MOEXAPIClient:
             try:
                 await self._rate_limit()
                 
-                logger.debug(f"Запрос к MOEX API (попытка {attempt + 1}): {url}")
+                logger.debug("Запрос к MOEX API (попытка %d): %s", attempt + 1, url)
                 async with self.session.get(url, params=params) as response:
                     if response.status == 200:
-                        data = await response.json()
+                        data = json_loads(await response.read())
                         # Сбрасываем счетчик неудачных попыток при успехе
                         self.failed_requests.pop(request_key, None)
                         return data
@@ -182,7 +192,7 @@ class MOEXAPIClient:
                         if len(row) > prev_index and row[prev_index] is not None:
                             price_per_share = float(row[prev_index])
                             # Возвращаем цену за акцию (не за лот) для корректного отображения спредов
-                            logger.debug(f"✅ Цена акции {ticker}: {price_per_share}₽/акция")
+                            logger.debug("✅ Цена акции %s: %s₽/акция", ticker, price_per_share)
                             return price_per_share
                             
             return None
@@ -230,7 +240,7 @@ class MOEXAPIClient:
                             price_in_rubles = self._convert_futures_price_to_rubles(ticker, price_in_points)
                             
                             # Возвращаем цену за акцию (не за лот) для корректного отображения спредов
-                            logger.debug(f"✅ Цена фьючерса {ticker}: {price_in_points} -> {price_in_rubles}₽/акция")
+                            logger.debug("✅ Цена фьючерса %s: %s -> %s₽/акция", ticker, price_in_points, price_in_rubles)
                             return price_in_rubles
                             
             return None
@@ -245,7 +255,7 @@ class MOEXAPIClient:
         # Сбер и Газпром котируются в рублях (размер контракта 100 акций)
         if ticker in ['SBERF', 'GAZPF']:
             converted_price = price
-            logger.debug(f"Конверсия {ticker}: {price}₽ (котируется в рублях)")
+            logger.debug("Конверсия %s: %s₽ (котируется в рублях)", ticker, price)
             return converted_price
         
         # СМЕШАННАЯ СИСТЕМА: некоторые фьючерсы котируются как цена контракта, другие уже за акцию
@@ -288,23 +298,23 @@ class MOEXAPIClient:
             # Цена контракта / количество акций
             contract_size = contract_based[ticker]
             converted_price = price / contract_size
-            logger.debug(f"Конверсия {ticker}: {price}₽ контракт / {contract_size} акций = {converted_price}₽/акция")
+            logger.debug("Конверсия %s: %s₽ контракт / %s акций = %s₽/акция", ticker, price, contract_size, converted_price)
             
         elif ticker in point_based:
             # Цена в пунктах за акцию (1 пункт = 0.01 рубля)
             converted_price = price / 100
-            logger.debug(f"Конверсия {ticker}: {price} пунктов / 100 = {converted_price}₽/акция")
+            logger.debug("Конверсия %s: %s пунктов / 100 = %s₽/акция", ticker, price, converted_price)
             
         elif ticker in ruble_based:
             # Цена уже в рублях за акцию
             converted_price = price
-            logger.debug(f"Конверсия {ticker}: {price}₽ (уже в рублях за акцию)")
+            logger.debug("Конверсия %s: %s₽ (уже в рублях за акцию)", ticker, price)
             
         elif ticker in special_conversions:
             # Специальные коэффициенты конверсии
             coef = special_conversions[ticker]
             converted_price = price / coef
-            logger.debug(f"Конверсия {ticker}: {price} / {coef} = {converted_price}₽/акция (спецкоэффициент)")
+            logger.debug("Конверсия %s: %s / %s = %s₽/акция (спецкоэффициент)", ticker, price, coef, converted_price)
             
         elif ticker in blocked_tickers:
             # Фьючерсы с проблемными данными
@@ -314,7 +324,7 @@ class MOEXAPIClient:
         else:
             # Неизвестный фьючерс - используем пункты по умолчанию
             converted_price = price / 100
-            logger.debug(f"Конверсия {ticker}: {price} пунктов / 100 = {converted_price}₽/акция (по умолчанию)")
+            logger.debug("Конверсия %s: %s пунктов / 100 = %s₽/акция (по умолчанию)", ticker, price, converted_price)
         
         return converted_price
     
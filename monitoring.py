@@ -1,10 +1,11 @@
 import asyncio
 import logging
+from collections import deque
 from datetime import datetime, timezone
 from typing import List, Dict, Optional
 from telegram.constants import ParseMode
 from telegram.error import TelegramError
-from config import Config
+from config import Config, MOSCOW_TZ
 from moex_api import MOEXAPIClient
 from arbitrage_calculator import ArbitrageCalculator, ArbitrageSignal
 
@@ -15,12 +16,17 @@ class SpreadHistory:
     
     def __init__(self, max_records: int = 10):
         self.max_records = max_records
-        self.records = []  # Список записей [{timestamp, stock_ticker, futures_ticker, spread, signal_type}]
+        # Кольцевой буфер записей [{timestamp, ts_str, stock_ticker, futures_ticker, spread, signal_type}]:
+        # при переполнении самая старая запись вытесняется без копирования списка
+        self.records = deque(maxlen=max_records)
     
     def add_record(self, stock_ticker: str, futures_ticker: str, spread: float, signal_type: str):
         """Добавление записи в историю"""
+        # Время по Москве; строка для вывода готовится один раз при добавлении записи
+        timestamp = datetime.now(MOSCOW_TZ)
         record = {
-            'timestamp': datetime.now(),
+            'timestamp': timestamp,
+            'ts_str': timestamp.strftime('%d.%m %H:%M'),
             'stock_ticker': stock_ticker,
             'futures_ticker': futures_ticker,
             'spread': spread,
@@ -28,32 +34,29 @@ class SpreadHistory:
         }
         
         self.records.append(record)
-        
-        # Ограничиваем количество записей
-        if len(self.records) > self.max_records:
-            self.records = self.records[-self.max_records:]
     
     def get_recent_records(self, limit: int = None) -> List[Dict]:
         """Получение последних записей"""
         if limit is None:
-            return self.records.copy()
-        return self.records[-limit:] if self.records else []
+            return list(self.records)
+        return list(self.records)[-limit:] if self.records else []
     
     def format_history(self) -> str:
         """Форматирование истории для вывода"""
         if not self.records:
             return "📊 История пуста"
         
-        message = "📊 История найденных спредов:\n\n"
+        parts = ["📊 История найденных спредов:\n\n"]
         
         for i, record in enumerate(reversed(self.records)):
-            timestamp = record['timestamp'].strftime('%d.%m %H:%M')
-            message += f"{i+1}. {record['stock_ticker']}/{record['futures_ticker']}\n"
-            message += f"   📈 Спред: {record['spread']:.2f}%\n"
-            message += f"   🎯 Тип: {record['signal_type']}\n"
-            message += f"   ⏰ {timestamp}\n\n"
+            parts.append(
+                f"{i+1}. {record['stock_ticker']}/{record['futures_ticker']}\n"
+                f"   📈 Спред: {record['spread']:.2f}%\n"
+                f"   🎯 Тип: {record['signal_type']}\n"
+                f"   ⏰ {record['ts_str']}\n\n"
+            )
         
-        return message
+        return "".join(parts)
 
 class ArbitrageMonitor:
     """Монитор арбитражных возможностей"""
@@ -65,6 +68,16 @@ class ArbitrageMonitor:
         self.subscribers = set()
         self.is_running = False
         self.spread_history = SpreadHistory(self.config.MAX_SPREAD_HISTORY)
+        # Добавляем трекер для умной ротации
+        self.current_batch_index = 0
+        self.instruments_processed_in_cycle = set()
+        # Ограничение числа одновременных отправок при рассылке сигнала
+        self._send_semaphore = asyncio.Semaphore(25)
+        # Клиент MOEX API открывается один раз на весь мониторинг: keep-alive соединения
+        # и DNS переиспользуются между циклами вместо новой сессии каждые 5-7 минут
+        self.moex_client: Optional[MOEXAPIClient] = None
+        # Прерывает паузу между циклами: внеочередная проверка по команде /refresh и остановка
+        self._refresh_event = asyncio.Event()
         
     def set_application(self, application):
         """Установка экземпляра Application"""
@@ -79,39 +92,49 @@ class ArbitrageMonitor:
         self.is_running = True
         logger.info("Запуск мониторинга арбитражных возможностей...")
         
+        self.moex_client = await MOEXAPIClient().__aenter__()
+        try:
+            await self._monitoring_loop()
+        finally:
+            await self.moex_client.__aexit__(None, None, None)
+            self.moex_client = None
+    
+    async def _monitoring_loop(self):
+        """Циклы мониторинга с паузами, пока мониторинг не остановлен"""
         while self.is_running:
             try:
                 # Проверяем, открыта ли биржа
                 if not self.config.is_trading_hours():
                     logger.info("Биржа закрыта. Ожидание открытия...")
-                    await asyncio.sleep(300)  # Проверяем каждые 5 минут
+                    await self._wait_next_cycle(300)  # Проверяем каждые 5 минут
                     continue
                 
                 await self._monitoring_cycle()
                 
                 # Рандомизированный интервал между 5-7 минутами
                 interval = self.config.get_random_monitoring_interval()
-                logger.info(f"Следующая проверка через {interval // 60} мин {interval % 60} сек")
-                await asyncio.sleep(interval)
+                logger.info("Следующая проверка через %d мин %d сек", *divmod(interval, 60))
+                await self._wait_next_cycle(interval)
                 
             except asyncio.CancelledError:
                 logger.info("Мониторинг остановлен")
                 break
             except Exception as e:
-                logger.error(f"Ошибка в цикле мониторинга: {e}")
+                logger.error("Ошибка в цикле мониторинга: %s", e)
                 await asyncio.sleep(60)  # Пауза при ошибке
     
-    def __init__(self):
-        self.config = Config()
-        self.calculator = ArbitrageCalculator()
-        self.application = None
-        self.subscribers = set()
-        self.is_running = False
-        self.spread_history = SpreadHistory(self.config.MAX_SPREAD_HISTORY)
-        # Добавляем трекер для умной ротации
-        self.current_batch_index = 0
-        self.instruments_processed_in_cycle = set()
-
+    async def _wait_next_cycle(self, timeout: float):
+        """Пауза до следующего цикла; request_refresh() и stop_monitoring() прерывают ее"""
+        try:
+            await asyncio.wait_for(self._refresh_event.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._refresh_event.clear()
+    
+    def request_refresh(self):
+        """Запустить следующий цикл мониторинга, не дожидаясь конца паузы"""
+        self._refresh_event.set()
+    
     async def _monitoring_cycle(self):
         """Интеллектуальный цикл мониторинга с равномерным покрытием"""
         logger.info("Начало интеллектуального цикла мониторинга...")
@@ -130,7 +153,7 @@ class ArbitrageMonitor:
                 # Если прошли полный цикл, сбрасываем счетчик обработанных инструментов
                 if self.current_batch_index == 0:
                     self.instruments_processed_in_cycle.clear()
-                    logger.info(f"🔄 Завершен полный цикл сканирования всех {len(all_instruments)} пар")
+                    logger.info("🔄 Завершен полный цикл сканирования всех %d пар", len(all_instruments))
             else:
                 # Случайный выбор (старая логика)
                 import random
@@ -148,18 +171,19 @@ class ArbitrageMonitor:
             
             progress_percent = (len(self.instruments_processed_in_cycle) / len(all_instruments)) * 100
             
-            logger.info(f"📦 Консервативный батч {batch_index + 1}/{total_batches}: {len(batch_instruments)} пар | Покрытие: {progress_percent:.1f}%")
+            logger.info("📦 Консервативный батч %d/%d: %d пар | Покрытие: %.1f%%",
+                        batch_index + 1, total_batches, len(batch_instruments), progress_percent)
             
             # Получаем котировки только для текущего батча с очисткой кеша
-            async with MOEXAPIClient() as moex_client:
-                # Принудительно очищаем кеш перед запросом
-                try:
-                    if hasattr(moex_client, 'clear_cache'):
-                        await moex_client.clear_cache()
-                except Exception:
-                    pass  # Игнорируем ошибки очистки кеша
-                    
-                quotes = await moex_client.get_multiple_quotes(batch_instruments)
+            moex_client = self.moex_client
+            # Принудительно очищаем кеш перед запросом
+            try:
+                if hasattr(moex_client, 'clear_cache'):
+                    await moex_client.clear_cache()
+            except Exception:
+                pass  # Игнорируем ошибки очистки кеша
+                
+            quotes = await moex_client.get_multiple_quotes(batch_instruments)
             
             if not quotes:
                 logger.warning("Не удалось получить котировки")
@@ -172,16 +196,21 @@ class ArbitrageMonitor:
             if signals:
                 await self._send_signals(signals)
             
-            logger.info(f"Цикл завершен. Сигналов: {len(signals)} | Обработано пар: {len(self.instruments_processed_in_cycle)}/{len(all_instruments)}")
+            logger.info("Цикл завершен. Сигналов: %d | Обработано пар: %d/%d",
+                        len(signals), len(self.instruments_processed_in_cycle), len(all_instruments))
             
         except Exception as e:
-            logger.error(f"Ошибка в цикле мониторинга: {e}")
+            logger.error("Ошибка в цикле мониторинга: %s", e)
     
     async def _analyze_quotes(self, quotes: Dict) -> List[ArbitrageSignal]:
         """Анализ котировок и поиск сигналов"""
         signals = []
         current_time = datetime.now(timezone.utc).strftime("%H:%M:%S")
         
+        # Минимальный порог спреда от всех активных пользователей - один раз на цикл,
+        # а не на каждый инструмент (это проход по всем настройкам пользователей)
+        min_threshold = self._get_minimum_spread_threshold()
+        
         for stock_ticker, (stock_price, futures_price) in quotes.items():
             try:
                 if stock_price is None or futures_price is None:
@@ -190,10 +219,11 @@ class ArbitrageMonitor:
                 
                 futures_ticker = self.config.MONITORED_INSTRUMENTS[stock_ticker]
                 
-                # Анализируем арбитражную возможность
-                # Получаем минимальный порог спреда от всех активных пользователей
-                min_threshold = self._get_minimum_spread_threshold()
+                # Быстрый отсев: спред ниже порога - анализатор все равно вернет None
+                if self.calculator.below_threshold(stock_ticker, futures_ticker, stock_price, futures_price, min_threshold):
+                    continue
                 
+                # Анализируем арбитражную возможность
                 signal = self.calculator.analyze_arbitrage_opportunity(
                     stock_ticker=stock_ticker,
                     futures_ticker=futures_ticker,
@@ -236,32 +266,42 @@ class ArbitrageMonitor:
         # Предполагаем, что у нас есть доступ к экземпляру BotHandlers
         # В реальной реализации это должно быть передано через dependency injection
         
+        # Один неизменяемый снимок подписчиков на все сигналы цикла
+        # вместо копии множества на каждый сигнал
+        subscribers_snapshot = tuple(self.subscribers)
+        
         for signal in signals:
             message = self._format_signal_message(signal)
             
-            # Отправляем сообщение всем подписчикам
-            failed_subscribers = []
-            
-            for subscriber_id in self.subscribers.copy():
-                try:
-                    await self.application.bot.send_message(
-                        chat_id=subscriber_id,
-                        text=message,
-                        parse_mode=ParseMode.MARKDOWN
-                    )
-                    
-                except TelegramError as e:
-                    logger.error(f"Ошибка отправки сообщения пользователю {subscriber_id}: {e}")
-                    failed_subscribers.append(subscriber_id)
-                except Exception as e:
-                    logger.error(f"Неожиданная ошибка при отправке сообщения {subscriber_id}: {e}")
-                    failed_subscribers.append(subscriber_id)
+            # Отправляем сообщение всем подписчикам параллельно (не больше 25 запросов сразу)
+            # Удаленные как неактивные на предыдущем сигнале пропускаем
+            recipients = [sid for sid in subscribers_snapshot if sid in self.subscribers]
+            results = await asyncio.gather(
+                *(self._send_one(subscriber_id, message) for subscriber_id in recipients)
+            )
             
-            # Удаляем неактивных подписчиков
+            # Удаляем неактивных подписчиков одним проходом
+            failed_subscribers = [sid for sid, ok in zip(recipients, results) if not ok]
+            self.subscribers.difference_update(failed_subscribers)
             for failed_id in failed_subscribers:
-                self.subscribers.discard(failed_id)
                 logger.info(f"Удален неактивный подписчик: {failed_id}")
     
+    async def _send_one(self, subscriber_id: int, message: str) -> bool:
+        """Отправка сигнала одному подписчику; False - подписчик недоступен"""
+        async with self._send_semaphore:
+            try:
+                await self.application.bot.send_message(
+                    chat_id=subscriber_id,
+                    text=message,
+                    parse_mode=ParseMode.MARKDOWN
+                )
+                return True
+            except TelegramError as e:
+                logger.error(f"Ошибка отправки сообщения пользователю {subscriber_id}: {e}")
+            except Exception as e:
+                logger.error(f"Неожиданная ошибка при отправке сообщения {subscriber_id}: {e}")
+            return False
+    
     def _format_signal_message(self, signal: ArbitrageSignal) -> str:
         """Форматирование сигнала для отправки"""
         
@@ -293,26 +333,27 @@ class ArbitrageMonitor:
         stock_arrow = "↗️" if signal.stock_position == "BUY" else "↘️"
         futures_arrow = "↗️" if signal.futures_position == "BUY" else "↘️"
         
-        message = f"{emoji} {format_start}АРБИТРАЖ СИГНАЛ{format_end}\n\n"
-        message += f"🎯 *{signal.stock_ticker}/{signal.futures_ticker}*\n"
-        message += f"📊 Спред: *{signal.spread_percent:.2f}%*\n\n"
-        
-        message += f"💼 *Позиции:*\n"
-        message += f"{stock_arrow} Акции {signal.stock_ticker}: *{signal.stock_position}* {self._format_lots(signal.stock_lots)}\n"
-        message += f"{futures_arrow} Фьючерс {signal.futures_ticker}: *{signal.futures_position}* {self._format_lots(signal.futures_lots)}\n\n"
-        
-        message += f"💰 *Цены:*\n"
-        message += f"📈 {signal.stock_ticker}: {signal.stock_price:.2f} ₽\n"
-        message += f"📊 {signal.futures_ticker}: {signal.futures_price:.2f} ₽\n\n"
+        # Части сообщения собираются в список и склеиваются один раз
+        parts = [
+            f"{emoji} {format_start}АРБИТРАЖ СИГНАЛ{format_end}\n\n"
+            f"🎯 *{signal.stock_ticker}/{signal.futures_ticker}*\n"
+            f"📊 Спред: *{signal.spread_percent:.2f}%*\n\n"
+            "💼 *Позиции:*\n"
+            f"{stock_arrow} Акции {signal.stock_ticker}: *{signal.stock_position}* {self._format_lots(signal.stock_lots)}\n"
+            f"{futures_arrow} Фьючерс {signal.futures_ticker}: *{signal.futures_position}* {self._format_lots(signal.futures_lots)}\n\n"
+            "💰 *Цены:*\n"
+            f"📈 {signal.stock_ticker}: {signal.stock_price:.2f} ₽\n"
+            f"📊 {signal.futures_ticker}: {signal.futures_price:.2f} ₽\n\n"
+        ]
         
         # Расчет потенциальной прибыли
         potential_profit = self.calculator.calculate_potential_profit(signal)
         if potential_profit > 0:
-            message += f"💵 Потенциальная прибыль: ~{potential_profit:.0f} ₽\n\n"
+            parts.append(f"💵 Потенциальная прибыль: ~{potential_profit:.0f} ₽\n\n")
         
-        message += f"⏰ Время: {signal.timestamp}"
+        parts.append(f"⏰ Время: {signal.timestamp}")
         
-        return message
+        return "".join(parts)
     
     def _format_lots(self, count: int) -> str:
         """Правильное склонение слова 'лот' в русском языке"""
@@ -328,22 +369,21 @@ class ArbitrageMonitor:
     def _format_close_signal(self, signal: ArbitrageSignal) -> str:
         """Форматирование сигнала на закрытие"""
         
-        message = "🔄 *СИГНАЛ НА ЗАКРЫТИЕ*\n\n"
-        message += f"👋 Дружище, пора закрывать позицию по *{signal.stock_ticker}/{signal.futures_ticker}*!\n\n"
-        
-        message += f"📉 Спред снизился до: *{signal.spread_percent:.2f}%*\n\n"
-        
-        message += f"🔚 *Закрываем позицию:*\n"
-        message += f"• Акции {signal.stock_ticker}: *{signal.stock_position}* {self._format_lots(signal.stock_lots)}\n"
-        message += f"• Фьючерс {signal.futures_ticker}: *{signal.futures_position}* {self._format_lots(signal.futures_lots)}\n\n"
-        
-        message += f"⏰ Время: {signal.timestamp}"
-        
-        return message
+        # Одна f-строка: литеральные части склеиваются при компиляции
+        return (
+            "🔄 *СИГНАЛ НА ЗАКРЫТИЕ*\n\n"
+            f"👋 Дружище, пора закрывать позицию по *{signal.stock_ticker}/{signal.futures_ticker}*!\n\n"
+            f"📉 Спред снизился до: *{signal.spread_percent:.2f}%*\n\n"
+            "🔚 *Закрываем позицию:*\n"
+            f"• Акции {signal.stock_ticker}: *{signal.stock_position}* {self._format_lots(signal.stock_lots)}\n"
+            f"• Фьючерс {signal.futures_ticker}: *{signal.futures_position}* {self._format_lots(signal.futures_lots)}\n\n"
+            f"⏰ Время: {signal.timestamp}"
+        )
     
     def stop_monitoring(self):
         """Остановка мониторинга"""
         self.is_running = False
+        self._refresh_event.set()  # цикл выходит сразу, не досыпая паузу
         logger.info("Получен сигнал остановки мониторинга")
     
     def get_monitoring_stats(self) -> Dict:
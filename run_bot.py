@@ -5,9 +5,10 @@
 import asyncio
 import logging
 import os
-from telegram_bot import SimpleTelegramBot
+from telegram_bot import SimpleTelegramBot, UPDATE_QUEUE_SIZE, UPDATE_WORKERS
 from config import Config
-from monitoring_controller import MonitoringController
+from utils import run_async
+from database import db
 from subscription_manager import SubscriptionManager
 
 # Настройка логирования
@@ -25,7 +26,6 @@ async def main():
         # Инициализация компонентов
         config = Config()
         subscription_manager = SubscriptionManager()
-        monitoring_controller = MonitoringController()
         
         # Создание и запуск бота  
         bot_token = os.getenv("TELEGRAM_BOT_TOKEN")
@@ -35,37 +35,48 @@ async def main():
         async with SimpleTelegramBot(bot_token) as bot:
             logger.info("✅ Бот успешно запущен и готов к работе")
             
-            # Основной цикл работы
-            while True:
+            # Уже сохраненные username: запись в базу только при изменении
+            known_usernames = {}
+            
+            async def remember_username(update):
+                """Сохранение username отправителя (остальная обработка - в обработчиках бота)"""
+                if update.message:
+                    sender = update.message["from"]
+                    user_id = sender["id"]
+                    username = sender.get("username", "")
+                    if username and user_id and known_usernames.get(user_id) != username:
+                        if await db.update_user_username(user_id, username):
+                            known_usernames[user_id] = username
+            
+            async def forward_updates():
+                """Передача принятых обновлений обработчикам бота после сохранения username"""
+                while True:
+                    update = await incoming_queue.get()
+                    try:
+                        await remember_username(update)
+                    except Exception as e:
+                        logger.error(f"Ошибка сохранения username: {e}")
+                    # Очередь заполнена - ждем обработчиков (обратное давление на прием)
+                    await update_queue.put(update)
+            
+            # Прием обновлений отделен от их обработки очередями
+            incoming_queue: asyncio.Queue = asyncio.Queue(maxsize=UPDATE_QUEUE_SIZE)
+            update_queue: asyncio.Queue = asyncio.Queue(maxsize=UPDATE_QUEUE_SIZE)
+            
+            async with asyncio.TaskGroup() as task_group:
+                background_tasks = [
+                    task_group.create_task(forward_updates()),
+                    *(task_group.create_task(bot._update_worker(update_queue)) for _ in range(UPDATE_WORKERS)),
+                ]
                 try:
-                    updates = await bot.get_updates()
-                    
-                    for update in updates:
-                        # Обработка сообщений
-                        if update.message:
-                            message = update.message
-                            chat_id = message["chat"]["id"]
-                            user_id = message["from"]["id"]
-                            text = message.get("text", "")
-                            
-                            # Сохранение username пользователя
-                            username = message["from"].get("username", "")
-                            if username and user_id:
-                                await monitoring_controller.update_user_username(user_id, username)
-                            
-                            # Обработка команд
-                            await bot.handle_command(chat_id, text, user_id)
-                        
-                        # Обработка callback query (кнопки)  
-                        if update.callback_query:
-                            await bot.handle_callback_query(update.callback_query)
-                
-                except Exception as e:
-                    logger.error(f"Ошибка в основном цикле: {e}")
-                    await asyncio.sleep(1)
-                
-                # Небольшая пауза между циклами
-                await asyncio.sleep(0.1)
+                    # Webhook, если задан TELEGRAM_WEBHOOK_URL, иначе опрос getUpdates
+                    if bot.config.WEBHOOK_URL:
+                        await bot._serve_webhook(incoming_queue)
+                    else:
+                        await bot._poll_updates(incoming_queue)
+                finally:
+                    for task in background_tasks:
+                        task.cancel()
                 
     except KeyboardInterrupt:
         logger.info("👋 Остановка бота по Ctrl+C")
@@ -74,4 +85,4 @@ async def main():
         raise
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    run_async(main())
\ No newline at end of file
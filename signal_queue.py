@@ -4,6 +4,7 @@
 
 import asyncio
 import logging
+from collections import deque
 from typing import List, Dict, Set
 from datetime import datetime, timedelta
 from dataclasses import dataclass
@@ -23,7 +24,7 @@ class SignalQueue:
     def __init__(self, max_signals_per_batch: int = 3, signal_interval: float = 3.0):
         self.max_signals_per_batch = max_signals_per_batch
         self.signal_interval = signal_interval
-        self.queue: List[QueuedSignal] = []
+        self.queue: deque = deque()  # очередь QueuedSignal, извлечение из начала за O(1)
         self.processing = False
         self.last_batch_time = datetime.now()
         
@@ -56,7 +57,7 @@ class SignalQueue:
         try:
             # Обрабатываем сигналы с интервалом
             while self.queue:
-                queued_signal = self.queue.pop(0)
+                queued_signal = self.queue.popleft()
                 
                 # Отправляем сигнал
                 await send_callback(queued_signal.signal, queued_signal.target_users)
@@ -8,6 +8,7 @@ import aiohttp
 import logging
 from typing import Dict, List, Optional, Tuple
 from datetime import datetime, timedelta
+from urllib.parse import urlparse
 from database import db
 
 logger = logging.getLogger(__name__)
@@ -274,30 +275,71 @@ class SourcesLibrary:
             }
         }
         
+        # Ключи источников, отсортированные по надежности (библиотека не меняется во время работы)
+        self._keys_by_reliability = sorted(
+            self.all_sources,
+            key=lambda k: -self.all_sources[k]["reliability"]
+        )
+        
+        # Распределение по типам не меняется во время работы - считаем один раз
+        self._type_counts: Dict[str, int] = {}
+        for source in self.all_sources.values():
+            source_type = source["type"]
+            self._type_counts[source_type] = self._type_counts.get(source_type, 0) + 1
+        
         # Активные источники (используемые в данный момент)
         self.active_sources = []
+        self._sum_reliability_active = 0  # сумма надежности активных источников
+        self._active_pos: Dict[str, int] = {}  # source_name -> индекс в active_sources
+        self._active_lock = asyncio.Lock()  # защищает замену активных источников
         self.failed_attempts = {}  # source_name -> attempts count
         self.replacement_history = {}  # source_name -> replaced_by
         
+        # Общая HTTP-сессия для проверки источников (создается при первом запросе)
+        self._session: Optional[aiohttp.ClientSession] = None
+        
+        # Ограничение одновременных запросов к одному хосту (вместо общей паузы между проверками)
+        self._host_buckets: Dict[str, asyncio.Semaphore] = {}
+        
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Получение общей HTTP-сессии с настроенным пулом соединений и DNS-кешем"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=20,
+                limit_per_host=2,
+                ttl_dns_cache=600,
+                enable_cleanup_closed=True
+            )
+            timeout = aiohttp.ClientTimeout(total=10, connect=3, sock_read=5)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self._session
+    
+    async def close(self):
+        """Закрытие общей HTTP-сессии"""
+        if self._session and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        
     async def test_source_connection(self, source_key: str) -> Tuple[bool, Optional[str]]:
         """Тестирование подключения к источнику"""
         if source_key not in self.all_sources:
             return False, "Источник не найден в библиотеке"
             
         source = self.all_sources[source_key]
+        host = urlparse(source["url"]).netloc
+        host_bucket = self._host_buckets.setdefault(host, asyncio.Semaphore(2))
         
         try:
-            timeout = aiohttp.ClientTimeout(total=10)
-            async with aiohttp.ClientSession(timeout=timeout) as session:
-                async with session.get(source["url"]) as response:
-                    if response.status == 200:
-                        return True, None
-                    elif response.status == 403:
-                        return False, "Доступ запрещен (возможно требуется API ключ)"
-                    elif response.status == 429:
-                        return False, "Превышен лимит запросов"
-                    else:
-                        return False, f"HTTP {response.status}"
+            session = self._get_session()
+            async with host_bucket, session.get(source["url"]) as response:
+                if response.status == 200:
+                    return True, None
+                elif response.status == 403:
+                    return False, "Доступ запрещен (возможно требуется API ключ)"
+                elif response.status == 429:
+                    return False, "Превышен лимит запросов"
+                else:
+                    return False, f"HTTP {response.status}"
                         
         except asyncio.TimeoutError:
             return False, "Таймаут подключения"
@@ -309,53 +351,55 @@ class SourcesLibrary:
     async def find_working_sources(self, count: int = 10) -> List[str]:
         """Поиск работающих источников"""
         working_sources = []
+        status_updates: List[Tuple[str, str, Optional[str]]] = []
+        failed_pairs: List[Tuple[str, Optional[str]]] = []
         
-        # Сортируем источники по надежности
-        sorted_sources = sorted(
-            self.all_sources.items(),
-            key=lambda x: x[1]["reliability"],
-            reverse=True
-        )
+        # Источники, заранее отсортированные по надежности
+        sorted_sources = [(key, self.all_sources[key]) for key in self._keys_by_reliability]
         
         logger.info(f"🔍 Поиск {count} лучших источников из {len(sorted_sources)} доступных...")
         
-        # Тестируем источники параллельно группами по 5
-        for i in range(0, len(sorted_sources), 5):
-            batch = sorted_sources[i:i+5]
-            
-            # Создаем задачи для параллельного тестирования
-            tasks = []
-            for source_key, source_info in batch:
-                task = self.test_source_connection(source_key)
-                tasks.append((source_key, source_info, task))
-            
-            # Ждем результаты
-            for source_key, source_info, task in tasks:
-                try:
-                    is_working, error = await task
+        async def probe(source_key: str) -> Tuple[str, bool, Optional[str]]:
+            try:
+                is_working, error = await self.test_source_connection(source_key)
+                return source_key, is_working, error
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка тестирования {source_key}: {e}")
+                return source_key, False, str(e)
+        
+        # Тестируем все источники параллельно и прекращаем, как только найдено нужное количество
+        tasks = [asyncio.create_task(probe(key)) for key, _ in sorted_sources]
+        try:
+            for next_result in asyncio.as_completed(tasks):
+                source_key, is_working, error = await next_result
+                
+                # Статусы запишем в базу одним пакетом, а в лог - одной сводкой после проверки
+                if is_working:
+                    working_sources.append(source_key)
+                    status_updates.append((source_key, "working", None))
                     
-                    if is_working:
-                        working_sources.append(source_key)
-                        logger.debug(f"✅ {source_info['name']}: работает")
-                        
-                        # Обновляем статус в базе данных
-                        await db.update_source_status(source_key, "working")
-                        
-                        if len(working_sources) >= count:
-                            break
-                    else:
-                        logger.debug(f"❌ {source_info['name']}: {error}")
-                        await db.update_source_status(source_key, "error", error)
-                        
-                except Exception as e:
-                    logger.error(f"Ошибка тестирования {source_key}: {e}")
-                    await db.update_source_status(source_key, "error", str(e))
-            
-            if len(working_sources) >= count:
-                break
-            
-            # Небольшая пауза между группами
-            await asyncio.sleep(1)
+                    if len(working_sources) >= count:
+                        break
+                else:
+                    failed_pairs.append((source_key, error))
+                    status_updates.append((source_key, "error", error))
+        finally:
+            # Оставшиеся (обычно медленные) проверки больше не нужны
+            for task in tasks:
+                task.cancel()
+        
+        logger.info("🔎 Проверка источников: %d работают, %d с ошибками", len(working_sources), len(failed_pairs))
+        if failed_pairs:
+            logger.debug("❌ Неисправные источники: %s", failed_pairs)
+        
+        # Сохраняем порядок по надежности независимо от порядка завершения проверок
+        working_set = set(working_sources)
+        working_sources = [key for key in self._keys_by_reliability if key in working_set]
+        
+        # Обновляем статусы в базе данных одной транзакцией
+        await db.update_source_statuses_bulk(status_updates)
         
         if len(working_sources) >= count:
             logger.info(f"🎯 Успешно найдено {len(working_sources[:count])} источников")
@@ -366,7 +410,7 @@ class SourcesLibrary:
         if len(working_sources) < count:
             remaining_sources = [
                 key for key in sorted_sources 
-                if key[0] not in working_sources
+                if key[0] not in working_set
             ][:count - len(working_sources)]
             
             for source_key, source_info in remaining_sources:
@@ -377,47 +421,64 @@ class SourcesLibrary:
     
     async def replace_failed_source(self, failed_source: str) -> Optional[str]:
         """Замена неисправного источника на рабочий"""
-        if failed_source not in self.active_sources:
+        if failed_source not in self._active_pos:
             return None
             
         logger.info(f"🔄 Поиск замены для неисправного источника: {failed_source}")
         
-        # Ищем источники, которые еще не использовались
+        # Ищем источники, которые еще не использовались (уже отсортированы по надежности)
         unused_sources = [
-            key for key in self.all_sources.keys() 
-            if key not in self.active_sources
+            key for key in self._keys_by_reliability
+            if key not in self._active_pos
         ]
         
-        # Сортируем по надежности
-        unused_sources.sort(
-            key=lambda x: self.all_sources[x]["reliability"],
-            reverse=True
-        )
-        
         # Тестируем источники по очереди
         for source_key in unused_sources:
             is_working, error = await self.test_source_connection(source_key)
             
             if is_working:
-                # Заменяем источник
-                index = self.active_sources.index(failed_source)
-                self.active_sources[index] = source_key
-                
-                # Записываем историю замены
-                self.replacement_history[failed_source] = source_key
+                async with self._active_lock:
+                    # Пока шла проверка, источник мог заменить параллельный вызов
+                    if failed_source not in self._active_pos:
+                        return None
+                    # Кандидат мог уже занять место другого источника
+                    if source_key in self._active_pos:
+                        continue
+                    
+                    # Заменяем источник
+                    index = self._active_pos.pop(failed_source)
+                    self.active_sources[index] = source_key
+                    self._active_pos[source_key] = index
+                    self._sum_reliability_active += (
+                        self.all_sources[source_key]["reliability"]
+                        - self.all_sources[failed_source]["reliability"]
+                    )
+                    
+                    # Записываем историю замены
+                    self.replacement_history[failed_source] = source_key
                 
                 logger.info(f"✅ Источник {failed_source} заменен на {source_key}")
                 logger.info(f"📝 {self.all_sources[source_key]['name']}")
                 
                 # Обновляем статусы в базе данных
-                await db.update_source_status(failed_source, "replaced", f"Заменен на {source_key}")
-                await db.update_source_status(source_key, "working")
+                await db.update_source_statuses_bulk([
+                    (failed_source, "replaced", f"Заменен на {source_key}"),
+                    (source_key, "working", None)
+                ])
                 
                 return source_key
         
         logger.warning(f"⚠️ Не найдена замена для источника {failed_source}")
         return None
     
+    def _set_active_sources(self, source_keys: List[str]):
+        """Установка списка активных источников с перестроением индекса позиций"""
+        self.active_sources = list(source_keys)
+        self._active_pos = {key: index for index, key in enumerate(self.active_sources)}
+        self._sum_reliability_active = sum(
+            self.all_sources[key]["reliability"] for key in self.active_sources
+        )
+    
     async def initialize_active_sources(self, count: int = 10) -> List[str]:
         """Инициализация активных источников при запуске"""
         logger.info(f"🚀 Инициализация {count} активных источников данных...")
@@ -426,7 +487,7 @@ class SourcesLibrary:
         self.failed_attempts = {}
         
         # Ищем работающие источники
-        self.active_sources = await self.find_working_sources(count)
+        self._set_active_sources(await self.find_working_sources(count))
         
         if len(self.active_sources) < count:
             logger.warning(f"⚠️ Найдено только {len(self.active_sources)} источников из {count} требуемых")
@@ -451,7 +512,7 @@ class SourcesLibrary:
         logger.info(f"🔧 Обнаружено {len(failed_sources)} неисправных источников")
         
         for failed_source in failed_sources:
-            if failed_source in self.active_sources:
+            if failed_source in self._active_pos:
                 # Увеличиваем счетчик попыток
                 self.failed_attempts[failed_source] = self.failed_attempts.get(failed_source, 0) + 1
                 
@@ -477,25 +538,13 @@ class SourcesLibrary:
         total_sources = len(self.all_sources)
         active_count = len(self.active_sources)
         
-        # Группировка по типам
-        type_counts = {}
-        for source in self.all_sources.values():
-            source_type = source["type"]
-            type_counts[source_type] = type_counts.get(source_type, 0) + 1
-        
         # Средняя надежность активных источников
-        if self.active_sources:
-            avg_reliability = sum(
-                self.all_sources[key]["reliability"] 
-                for key in self.active_sources
-            ) / len(self.active_sources)
-        else:
-            avg_reliability = 0
+        avg_reliability = self._sum_reliability_active / max(1, active_count)
         
         return {
             "total_sources": total_sources,
             "active_sources": active_count,
-            "type_distribution": type_counts,
+            "type_distribution": dict(self._type_counts),
             "average_reliability": round(avg_reliability, 1),
             "replacement_count": len(self.replacement_history),
             "failed_attempts": dict(self.failed_attempts)
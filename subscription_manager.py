@@ -2,13 +2,68 @@
 Система управления подписками пользователей
 """
 
+import asyncio
 import logging
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from typing import Optional, Dict
+from typing import Optional, Dict, Set, Tuple
 from database import db, UserSettings
 
 logger = logging.getLogger(__name__)
 
+# Шаблоны сообщений о подписке (значения подставляются один раз при импорте)
+_OFFER_TEMPLATE = """💎 **ПРЕМИУМ ПОДПИСКА**
+
+⏰ **Ваш пробный период истек**
+
+🚀 **Преимущества Premium:**
+• Безлимитные сигналы арбитража
+• Приоритетная поддержка
+• Эксклюзивная аналитика
+• Персональные настройки
+
+💰 **Стоимость:** {price} USDT/месяц
+
+🎯 **Интересно?** Мы расскажем как оплатить"""
+
+_PAYMENT_TEMPLATE = """💳 **ИНСТРУКЦИИ ПО ОПЛАТЕ**
+
+💰 **Сумма:** {price} USDT
+📋 **Сеть:** TRC-20 (Tron)
+🏦 **Адрес:** `{addr}`
+
+📱 **Как оплатить:**
+1. Откройте кошелек (Trust Wallet, Binance и др.)
+2. Выберите USDT (TRC-20)
+3. Отправьте {price} USDT на указанный адрес
+4. Сделайте скриншот транзакции
+5. Нажмите кнопку ниже
+
+⚡ **Активация:** До 2 часов после подтверждения
+🔔 **Поддержка:** Администратор ответит в Telegram
+
+💡 Подписка активируется автоматически после проверки платежа"""
+
+# Шаблоны сообщений со значениями, известными только во время вызова
+_STATUS_ACTIVE_TEMPLATE = "💎 **Подписка активна** - осталось {remaining}\n\n✅ Безлимитные сигналы арбитража"
+_STATUS_TRIAL_TEMPLATE = "🆓 **Пробный период активен** - осталось {remaining}\n\n💡 Затем потребуется подписка за {price} USDT/месяц"
+_STATUS_EXPIRED_MSG = "⏰ **Пробный период истек**\n\n💎 Оформите подписку для получения сигналов"
+
+_TRIAL_INFO_TEMPLATE = """🆓 **Пробный период активен**
+
+📅 **Осталось дней:** {remaining_days}/{trial_days}
+🚀 **Сигналы:** Безлимитно до окончания
+⚠️ **После окончания:** Потребуется подписка
+
+💎 **Премиум подписка:**
+• Безлимитные сигналы навсегда
+• Приоритетная поддержка
+• Расширенная аналитика
+• Персональные настройки
+
+💰 **Стоимость:** {price} USDT/месяц"""
+
 class SubscriptionManager:
     """Менеджер подписок пользователей"""
     
@@ -20,25 +75,182 @@ class SubscriptionManager:
     SUBSCRIPTION_DURATION_DAYS = 30
     CRYPTO_ADDRESS = ""  # Адрес будет указан позже
     
+    # Экраны подписки без переменных частей - формируются один раз при создании класса
+    SUBSCRIPTION_ACTIVE_TEXT = """💎 **Премиум подписка**
+
+✅ **Статус:** Активна
+🚀 **Сигналы:** Безлимитно
+⭐ **Приоритет:** Высокий
+🎯 **Поддержка:** Персональная
+
+Вы получаете максимум возможностей бота!"""
+    
+    SUBSCRIPTION_EXPIRED_TEXT = f"""⏰ **Пробный период истек**
+
+❌ **Статус:** Доступ ограничен
+🚫 **Сигналы:** Недоступны
+💡 **Решение:** Оформить подписку
+
+💎 **Премиум подписка:**
+• Безлимитные сигналы арбитража
+• Приоритетный доступ к новым возможностям
+• Расширенная аналитика и статистика
+• Персональная поддержка 24/7
+
+💰 **Стоимость:** {SUBSCRIPTION_PRICE_USDT} USDT/месяц"""
+    
+    # Кеш настроек пользователей: время жизни записи (секунды) и максимальный размер
+    CACHE_TTL_SECONDS = 30
+    CACHE_MAX_SIZE = 1000
+    
+    # Период сброса накопленных счетчиков сигналов в базу (секунды)
+    SIGNAL_FLUSH_INTERVAL = 0.5
+    
     def __init__(self):
-        self.subscription_cache = {}  # Кеш состояния подписок
+        # Кеш настроек: user_id -> (UserSettings, expires_at по time.monotonic,
+        # subscription_until и trial_until в секундах unix-времени), порядок - LRU
+        self.subscription_cache: OrderedDict[int, Tuple[UserSettings, float, float, float]] = OrderedDict()
+        # Загрузки из базы, которые выполняются прямо сейчас (одна на пользователя)
+        self._inflight: Dict[int, asyncio.Future] = {}
+        # Закешированное текущее время для проверок на горячем пути (обновляется раз в секунду)
+        self._now_cached: datetime = datetime.now()
+        self._now_refreshed_at: float = time.monotonic()
+        # Фоновые задачи записи истории (храним ссылки, чтобы их не собрал GC)
+        self._background_tasks: Set[asyncio.Task] = set()
+        # Отложенная запись счетчиков сигналов: user_id -> сколько еще не записано в базу
+        self._pending_incr: Dict[int, int] = {}
+        # Быстрый положительный кеш платящих пользователей: user_id -> конец подписки (unix-время)
+        self._active_subs: Dict[int, float] = {}
+        self._flush_event: Optional[asyncio.Event] = None
+        self._flush_task: Optional[asyncio.Task] = None
+    
+    def _now(self) -> datetime:
+        """Текущее время с точностью до секунды без системного вызова на каждую проверку"""
+        mono = time.monotonic()
+        if mono - self._now_refreshed_at >= 1.0:
+            self._now_cached = datetime.now()
+            self._now_refreshed_at = mono
+        return self._now_cached
+    
+    async def _load_cached(self, user_id: int) -> Optional[UserSettings]:
+        """Загрузить настройки пользователя для чтения (из кеша, если запись свежая)"""
+        cached = self.subscription_cache.get(user_id)
+        if cached and time.monotonic() < cached[1]:
+            self.subscription_cache.move_to_end(user_id)
+            return cached[0]
+        
+        # Если загрузка уже идет - дожидаемся ее вместо повторного запроса к базе
+        inflight = self._inflight.get(user_id)
+        if inflight:
+            return await asyncio.shield(inflight)
+        
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[user_id] = future
+        try:
+            user_settings = await db.load_user_settings(user_id)
+            # Если кеш сбросили во время загрузки (invalidate_cache), строка могла устареть - в кеш не кладем
+            if user_settings and self._inflight.get(user_id) is future:
+                self.subscription_cache[user_id] = (
+                    user_settings, time.monotonic() + self.CACHE_TTL_SECONDS
+                ) + self._deadlines(user_settings)
+                self.subscription_cache.move_to_end(user_id)
+                if len(self.subscription_cache) > self.CACHE_MAX_SIZE:
+                    self.subscription_cache.popitem(last=False)
+        except asyncio.CancelledError:
+            # Ожидающие получают отмену, а не None ("пользователь не найден")
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # ожидающих может не быть - без предупреждения о непрочитанной ошибке
+            raise
+        finally:
+            if self._inflight.get(user_id) is future:
+                del self._inflight[user_id]
+        
+        future.set_result(user_settings)
+        return user_settings
+    
+    @staticmethod
+    def _deadlines(user_settings: UserSettings) -> Tuple[float, float]:
+        """Сроки подписки и пробного периода в секундах unix-времени (0 - нет срока)"""
+        subscription_until = 0.0
+        if user_settings.subscription_active and user_settings.subscription_end:
+            subscription_until = user_settings.subscription_end.timestamp()
+        trial_until = user_settings.trial_end.timestamp() if user_settings.trial_end else 0.0
+        return subscription_until, trial_until
+    
+    async def _load_deadlines(self, user_id: int) -> Optional[Tuple[float, float]]:
+        """Сроки подписки и пробного периода пользователя (из кеша, если запись свежая)"""
+        user_settings = await self._load_cached(user_id)
+        if not user_settings:
+            return None
+        cached = self.subscription_cache.get(user_id)
+        if cached and cached[0] is user_settings:
+            return cached[2], cached[3]
+        return self._deadlines(user_settings)
+    
+    @staticmethod
+    def _sub_active(user_settings: UserSettings, now: datetime) -> bool:
+        """Активна ли подписка по загруженным настройкам"""
+        return bool(
+            user_settings.subscription_active
+            and user_settings.subscription_end
+            and now < user_settings.subscription_end
+        )
+    
+    @staticmethod
+    def _trial_active(user_settings: UserSettings, now: datetime) -> bool:
+        """Активен ли пробный период по загруженным настройкам"""
+        return bool(user_settings.trial_end and now < user_settings.trial_end)
+    
+    def invalidate_cache(self, user_id: int):
+        """Сбросить закешированное состояние подписки пользователя"""
+        self.subscription_cache.pop(user_id, None)
+        # Незавершенная загрузка прочитала строку до изменения - ее результат не попадет в кеш
+        self._inflight.pop(user_id, None)
+        self._active_subs.pop(user_id, None)
+    
+    def _add_history_in_background(self, **history):
+        """Записать историю подписки в фоне, не задерживая ответ администратору"""
+        task = asyncio.create_task(db.add_subscription_history(**history))
+        self._background_tasks.add(task)
+        task.add_done_callback(self._on_history_task_done)
+    
+    def _on_history_task_done(self, task: asyncio.Task):
+        """Обработка завершения фоновой записи истории"""
+        self._background_tasks.discard(task)
+        if task.cancelled():
+            return
+        exc = task.exception()
+        if exc:
+            logger.error(f"Ошибка фоновой записи истории подписки: {exc}")
     
     async def check_signal_limit(self, user_id: int) -> bool:
         """Проверить, может ли пользователь получить еще сигналы"""
         try:
-            # Получаем данные из базы
-            user_settings = await db.load_user_settings(user_id)
-            if not user_settings:
+            # Платящий пользователь с непросроченной подпиской - без обращения к кешу настроек и базе
+            subscription_until = self._active_subs.get(user_id)
+            if subscription_until and time.time() < subscription_until:
+                return True
+            
+            # Получаем сроки один раз и дальше сравниваем числа, а не datetime
+            deadlines = await self._load_deadlines(user_id)
+            if not deadlines:
                 # Новый пользователь - активируем 7-дневный пробный период
                 await self.activate_trial_period(user_id)
                 return True
             
+            subscription_until, trial_until = deadlines
+            now_ts = time.time()
+            
             # Если подписка активна - лимита нет
-            if await self.is_subscription_active(user_id):
+            if now_ts < subscription_until:
+                self._active_subs[user_id] = subscription_until
                 return True
             
             # Проверяем пробный период
-            if await self.is_trial_active(user_id):
+            if now_ts < trial_until:
                 return True
             
             # Пробный период истек, подписки нет
@@ -48,39 +260,69 @@ class SubscriptionManager:
             logger.error(f"Ошибка проверки лимита сигналов для {user_id}: {e}")
             return True  # В случае ошибки разрешаем
     
-    async def increment_signal_count(self, user_id: int) -> int:
-        """Увеличить счетчик отправленных сигналов"""
+    async def increment_signal_count(self, user_id: int):
+        """Увеличить счетчик отправленных сигналов (запись в базу выполняется в фоне пачками)
+        
+        Закешированные настройки не меняются: они общие для всех читателей,
+        свежий счетчик придет со следующей загрузкой после записи.
+        """
         try:
-            user_settings = await db.load_user_settings(user_id)
-            if not user_settings:
-                # Создаем новую запись
-                user_settings = UserSettings(user_id=user_id, signals_sent=1)
-            else:
-                user_settings.signals_sent += 1
-            
-            await db.save_user_settings(user_settings)
-            return user_settings.signals_sent
+            self._pending_incr[user_id] = self._pending_incr.get(user_id, 0) + 1
+            self._ensure_flush_task()
+            self._flush_event.set()
             
         except Exception as e:
             logger.error(f"Ошибка обновления счетчика сигналов для {user_id}: {e}")
-            return 0
     
-    async def is_subscription_active(self, user_id: int) -> bool:
+    def _ensure_flush_task(self):
+        """Запустить фоновую задачу записи счетчиков, если она еще не запущена"""
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_event = asyncio.Event()
+            self._flush_task = asyncio.create_task(self._flush_loop())
+    
+    async def _flush_loop(self):
+        """Фоновая запись накопленных счетчиков сигналов"""
+        while True:
+            await self._flush_event.wait()
+            # Даем накопиться увеличениям от текущей рассылки
+            await asyncio.sleep(self.SIGNAL_FLUSH_INTERVAL)
+            self._flush_event.clear()
+            await self.flush_signal_counts()
+    
+    async def flush_signal_counts(self):
+        """Записать накопленные счетчики сигналов одной пачкой"""
+        if not self._pending_incr:
+            return
+        pending, self._pending_incr = self._pending_incr, {}
+        
+        if not await db.increment_signals_bulk([(user_id, delta) for user_id, delta in pending.items()]):
+            # Не удалось записать - вернем увеличения в очередь до следующей попытки
+            for user_id, delta in pending.items():
+                self._pending_incr[user_id] = self._pending_incr.get(user_id, 0) + delta
+    
+    async def close(self):
+        """Остановить фоновую запись и сбросить оставшиеся счетчики"""
+        if self._flush_task and not self._flush_task.done():
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+        await self.flush_signal_counts()
+    
+    async def is_subscription_active(self, user_id: int, now: Optional[datetime] = None) -> bool:
         """Проверить активность подписки"""
         try:
-            user_settings = await db.load_user_settings(user_id)
+            if now is None:
+                deadlines = await self._load_deadlines(user_id)
+                return bool(deadlines) and time.time() < deadlines[0]
+            
+            user_settings = await self._load_cached(user_id)
             if not user_settings:
                 return False
             
             # Проверяем флаг и срок действия
-            if not user_settings.subscription_active:
-                return False
-            
-            if not user_settings.subscription_end:
-                return False
-            
-            # Проверяем срок действия
-            return datetime.now() < user_settings.subscription_end
+            return self._sub_active(user_settings, now)
             
         except Exception as e:
             logger.error(f"Ошибка проверки подписки для {user_id}: {e}")
@@ -125,7 +367,7 @@ class SubscriptionManager:
     async def get_remaining_trial_time_formatted(self, user_id: int) -> str:
         """Получить оставшееся время пробного периода в читаемом формате"""
         try:
-            user_settings = await db.load_user_settings(user_id)
+            user_settings = await self._load_cached(user_id)
             if not user_settings or not user_settings.trial_end:
                 return "не активен"
             
@@ -143,7 +385,7 @@ class SubscriptionManager:
     async def get_remaining_subscription_time_formatted(self, user_id: int) -> str:
         """Получить оставшееся время подписки в читаемом формате"""
         try:
-            user_settings = await db.load_user_settings(user_id)
+            user_settings = await self._load_cached(user_id)
             if not user_settings or not user_settings.subscription_end:
                 return "не активна"
             
@@ -158,18 +400,19 @@ class SubscriptionManager:
             logger.error(f"Ошибка получения времени подписки для {user_id}: {e}")
             return "ошибка"
     
-    async def get_remaining_trial_days(self, user_id: int) -> Optional[int]:
+    async def get_remaining_trial_days(self, user_id: int, now: Optional[datetime] = None) -> Optional[int]:
         """Получить количество оставшихся дней пробного периода"""
         try:
-            if await self.is_subscription_active(user_id):
+            now = now or self._now()
+            user_settings = await self._load_cached(user_id)
+            if user_settings and self._sub_active(user_settings, now):
                 return None  # Безлимитно
             
-            user_settings = await db.load_user_settings(user_id)
             if not user_settings or not user_settings.trial_end:
                 return self.FREE_TRIAL_DAYS  # Новый пользователь
             
             # Вычисляем оставшиеся дни
-            remaining = (user_settings.trial_end - datetime.now()).days
+            remaining = (user_settings.trial_end - now).days
             return max(0, remaining)
             
         except Exception as e:
@@ -195,6 +438,8 @@ class SubscriptionManager:
             user_settings.subscription_end = end_date
             
             await db.save_user_settings(user_settings)
+            self.invalidate_cache(user_id)
+            self._active_subs[user_id] = end_date.timestamp()
             
             logger.info(f"Подписка активирована для пользователя {user_id} до {end_date}")
             return True
@@ -226,9 +471,11 @@ class SubscriptionManager:
             user_settings.subscription_end = end_date
             
             await db.save_user_settings(user_settings)
+            self.invalidate_cache(user_id)
+            self._active_subs[user_id] = end_date.timestamp()
             
-            # Записываем в историю
-            await db.add_subscription_history(
+            # Записываем в историю в фоне
+            self._add_history_in_background(
                 user_id=user_id,
                 username=username,
                 action="activate",
@@ -261,9 +508,10 @@ class SubscriptionManager:
             user_settings.subscription_end = datetime.now()  # Завершаем подписку сейчас
             
             await db.save_user_settings(user_settings)
+            self.invalidate_cache(user_id)
             
-            # Записываем в историю
-            await db.add_subscription_history(
+            # Записываем в историю в фоне
+            self._add_history_in_background(
                 user_id=user_id,
                 username=username,
                 action="deactivate",
@@ -299,6 +547,7 @@ class SubscriptionManager:
             user_settings.trial_end = end_date
             
             await db.save_user_settings(user_settings)
+            self.invalidate_cache(user_id)
             
             logger.info(f"Пробный период активирован для пользователя {user_id} до {end_date}")
             return True
@@ -307,15 +556,19 @@ class SubscriptionManager:
             logger.error(f"Ошибка активации пробного периода для {user_id}: {e}")
             return False
     
-    async def is_trial_active(self, user_id: int) -> bool:
+    async def is_trial_active(self, user_id: int, now: Optional[datetime] = None) -> bool:
         """Проверить активность пробного периода"""
         try:
-            user_settings = await db.load_user_settings(user_id)
-            if not user_settings or not user_settings.trial_end:
+            if now is None:
+                deadlines = await self._load_deadlines(user_id)
+                return bool(deadlines) and time.time() < deadlines[1]
+            
+            user_settings = await self._load_cached(user_id)
+            if not user_settings:
                 return False
             
             # Проверяем срок действия пробного периода
-            return datetime.now() < user_settings.trial_end
+            return self._trial_active(user_settings, now)
             
         except Exception as e:
             logger.error(f"Ошибка проверки пробного периода для {user_id}: {e}")
@@ -323,39 +576,27 @@ class SubscriptionManager:
     
     def get_subscription_offer_message(self) -> str:
         """Сообщение с предложением подписки"""
-        return f"""💎 **ПРЕМИУМ ПОДПИСКА**
-
-⏰ **Ваш пробный период истек**
-
-🚀 **Преимущества Premium:**
-• Безлимитные сигналы арбитража
-• Приоритетная поддержка
-• Эксклюзивная аналитика
-• Персональные настройки
-
-💰 **Стоимость:** {self.SUBSCRIPTION_PRICE_USDT} USDT/месяц
-
-🎯 **Интересно?** Мы расскажем как оплатить"""
+        return _OFFER_MSG
     
     def get_payment_instructions(self) -> str:
         """Инструкции по оплате подписки"""
-        return f"""💳 **ИНСТРУКЦИИ ПО ОПЛАТЕ**
-
-💰 **Сумма:** {self.SUBSCRIPTION_PRICE_USDT} USDT
-📋 **Сеть:** TRC-20 (Tron)
-🏦 **Адрес:** `{self.CRYPTO_ADDRESS or 'Будет предоставлен'}`
-
-📱 **Как оплатить:**
-1. Откройте кошелек (Trust Wallet, Binance и др.)
-2. Выберите USDT (TRC-20)
-3. Отправьте {self.SUBSCRIPTION_PRICE_USDT} USDT на указанный адрес
-4. Сделайте скриншот транзакции
-5. Нажмите кнопку ниже
-
-⚡ **Активация:** До 2 часов после подтверждения
-🔔 **Поддержка:** Администратор ответит в Telegram
-
-💡 Подписка активируется автоматически после проверки платежа"""
+        return _PAYMENT_MSG
+    
+    def get_status_message(self, is_active: bool, is_trial: bool, remaining_time: str = "") -> str:
+        """Краткое сообщение о статусе подписки"""
+        if is_active:
+            return _STATUS_ACTIVE_TEMPLATE.format(remaining=remaining_time)
+        if is_trial:
+            return _STATUS_TRIAL_TEMPLATE.format(remaining=remaining_time, price=self.SUBSCRIPTION_PRICE_USDT)
+        return _STATUS_EXPIRED_MSG
+    
+    def get_trial_info_message(self, remaining_days: int) -> str:
+        """Подробное сообщение о пробном периоде"""
+        return _TRIAL_INFO_TEMPLATE.format(
+            remaining_days=remaining_days,
+            trial_days=self.FREE_TRIAL_DAYS,
+            price=self.SUBSCRIPTION_PRICE_USDT
+        )
     
     async def deactivate_subscription(self, user_id: int) -> bool:
         """Деактивировать подписку"""
@@ -366,6 +607,7 @@ class SubscriptionManager:
             
             user_settings.subscription_active = False
             await db.save_user_settings(user_settings)
+            self.invalidate_cache(user_id)
             
             logger.info(f"Подписка деактивирована для пользователя {user_id}")
             return True
@@ -375,6 +617,12 @@ class SubscriptionManager:
             return False
     
 
+# Готовые тексты сообщений - цена и адрес являются константами класса
+_OFFER_MSG = _OFFER_TEMPLATE.format(price=SubscriptionManager.SUBSCRIPTION_PRICE_USDT)
+_PAYMENT_MSG = _PAYMENT_TEMPLATE.format(
+    price=SubscriptionManager.SUBSCRIPTION_PRICE_USDT,
+    addr=SubscriptionManager.CRYPTO_ADDRESS or 'Будет предоставлен'
+)
 
 # Глобальный экземпляр менеджера подписок
 subscription_manager = SubscriptionManager()
\ No newline at end of file
@@ -10,11 +10,17 @@ import aiohttp
 import json
 import logging
 import random
+import secrets
+import time
 import pytz
+from collections import deque
 from datetime import datetime, timezone
-from typing import Dict, List, Optional, Set
+from functools import lru_cache
+from typing import Dict, List, Optional, Set, Union
 from dataclasses import dataclass
-from config import Config
+from aiohttp import web
+from config import Config, MOSCOW_TZ
+from utils import run_async
 from moex_api import MOEXAPIClient
 from arbitrage_calculator import ArbitrageCalculator
 from monitoring_controller import MonitoringController
@@ -29,42 +35,368 @@ from bot_ui_restrictions import ui_restrictions
 from sector_ui import sector_ui
 from subscription_manager import subscription_manager
 
+# orjson быстрее стандартного json и сразу выдает bytes; если пакет не установлен - работаем на json
+try:
+    import orjson
+    
+    def json_dumps(obj) -> bytes:
+        return orjson.dumps(obj)
+    
+    json_loads = orjson.loads
+except ImportError:
+    def json_dumps(obj) -> bytes:
+        return json.dumps(obj, ensure_ascii=False).encode()
+    
+    json_loads = json.loads
+
+# Кеш отформатированного текущего времени: strftime пересчитывается не чаще раза в секунду
+_ts_cache = [0, ""]
+
+def _now_str() -> str:
+    """Текущее локальное время в формате ЧЧ:ММ:СС ДД.ММ.ГГГГ"""
+    t = int(time.time())
+    if t != _ts_cache[0]:
+        _ts_cache[0] = t
+        _ts_cache[1] = time.strftime('%H:%M:%S %d.%m.%Y', time.localtime(t))
+    return _ts_cache[1]
+
 # Класс для хранения истории спредов  
 class SpreadHistory:
     def __init__(self, max_records: int = 10):
         self.max_records = max_records
-        self.records = []
+        # Кольцевой буфер: при переполнении самая старая запись вытесняется сама
+        self.records = deque(maxlen=max_records)
+        # Версия истории и отрисованный для нее текст: /history без новых записей
+        # не пересобирает сообщение
+        self._version = 0
+        self._rendered = ("", -1)
     
     def add_record(self, stock_ticker: str, futures_ticker: str, spread: float, signal_type: str):
         record = {
-            'timestamp': datetime.now(),
+            # Время сигнала по Москве форматируется один раз при добавлении, а не на каждый /history
+            'ts_str': datetime.now(MOSCOW_TZ).strftime('%d.%m %H:%M'),
             'stock_ticker': stock_ticker,
             'futures_ticker': futures_ticker,
             'spread': spread,
             'signal_type': signal_type
         }
         self.records.append(record)
-        if len(self.records) > self.max_records:
-            self.records = self.records[-self.max_records:]
+        self._version += 1
     
     def format_history(self) -> str:
         if not self.records:
             return "📊 История пуста"
         
-        message = "📊 История найденных спредов:\n\n"
+        text, version = self._rendered
+        if version == self._version:
+            return text
+        
+        # Собираем части в список и склеиваем один раз
+        parts = ["📊 История найденных спредов:\n\n"]
         for i, record in enumerate(reversed(self.records)):
-            timestamp = record['timestamp'].strftime('%d.%m %H:%M')
-            message += f"{i+1}. {record['stock_ticker']}/{record['futures_ticker']}\n"
-            message += f"   📈 Спред: {record['spread']:.2f}%\n"
-            message += f"   🎯 {record['signal_type']}\n"
-            message += f"   ⏰ {timestamp}\n\n"
-        return message
+            parts.append(
+                f"{i+1}. {record['stock_ticker']}/{record['futures_ticker']}\n"
+                f"   📈 Спред: {record['spread']:.2f}%\n"
+                f"   🎯 {record['signal_type']}\n"
+                f"   ⏰ {record['ts_str']}\n\n"
+            )
+        text = "".join(parts)
+        self._rendered = (text, self._version)
+        return text
 
 logger = logging.getLogger(__name__)
 
-@dataclass
+# Общие заголовки для запросов с заранее сериализованным телом
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+# Long polling: сколько Telegram держит getUpdates (максимум, который он допускает), и общий
+# бюджет HTTP-запроса (с запасом 10 секунд, чтобы обрыв по таймауту клиента не опережал ответ сервера)
+LONG_POLL_TIMEOUT = 50
+LONG_POLL_REQUEST_TIMEOUT = aiohttp.ClientTimeout(total=LONG_POLL_TIMEOUT + 10)
+
+# Таймаут обычных запросов к Bot API: быстрый отказ при недоступном api.telegram.org
+# вместо стандартных 5 минут aiohttp
+BOT_API_TIMEOUT = aiohttp.ClientTimeout(total=15, sock_connect=3)
+
+# Ответ getUpdates без новых обновлений - самый частый при long polling
+EMPTY_UPDATES_RESPONSE = b'{"ok":true,"result":[]}'
+
+# Лимиты Telegram на отправку: не больше 30 сообщений в секунду на бота
+# и не чаще одного сообщения в секунду в один чат
+GLOBAL_SEND_RATE = 30
+PER_CHAT_SEND_INTERVAL = 1.0
+
+# Telegram принимает не больше 4096 символов текста; длинные сообщения режем
+# по абзацам с запасом на разметку
+MAX_MESSAGE_LENGTH = 4000
+
+def _split_message(text: str) -> List[str]:
+    """Разбиение длинного текста на части не длиннее MAX_MESSAGE_LENGTH по границам абзацев"""
+    chunks = []
+    current = ""
+    for paragraph in text.split("\n\n"):
+        # Абзац длиннее лимита режем как есть
+        while len(paragraph) > MAX_MESSAGE_LENGTH:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(paragraph[:MAX_MESSAGE_LENGTH])
+            paragraph = paragraph[MAX_MESSAGE_LENGTH:]
+        if current and len(current) + 2 + len(paragraph) > MAX_MESSAGE_LENGTH:
+            chunks.append(current)
+            current = paragraph
+        else:
+            current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        chunks.append(current)
+    return chunks
+
+def _is_parse_error(response_text: str) -> bool:
+    """Ответ 400 вызван ошибкой разметки (а не, например, несуществующим чатом)"""
+    return "can't parse entities" in response_text
+
+# Очередь входящих обновлений и число обработчиков, разбирающих ее параллельно
+UPDATE_QUEUE_SIZE = 1000
+UPDATE_WORKERS = 8
+
+# Пауза после ошибок цикла мониторинга подряд: 60, 120, 240 ... секунд, не больше часа
+# (плюс случайная добавка до базовой паузы). Администратор получает только первые уведомления серии
+MONITORING_ERROR_BACKOFF_BASE = 60
+MONITORING_ERROR_BACKOFF_MAX = 3600
+MONITORING_ERROR_NOTIFY_LIMIT = 3
+
+# Как часто изменения подписок на уведомления сбрасываются в базу (секунды)
+SUBSCRIBERS_FLUSH_INTERVAL = 30
+
+# Таблица экранирования спецсимволов Markdown (parse_mode="Markdown") для подстановки
+# внешних строк в размеченный текст - одна C-операция str.translate на строку
+_MD_ESCAPE = str.maketrans({c: "\\" + c for c in "_*`["})
+
+# Кнопки меню, которые просто выполняют команду: callback_data -> (команда, ответ на нажатие)
+CALLBACK_COMMANDS = {
+    "cmd_start_monitoring": ("/start_monitoring", "Запуск мониторинга"),
+    "cmd_stop_monitoring": ("/stop_monitoring", "Остановка мониторинга"),
+    "cmd_status": ("/status", "Статус"),
+    "cmd_history": ("/history", "История"),
+    "cmd_schedule": ("/schedule", "Расписание"),
+    "cmd_demo": ("/demo", "Демо"),
+    "cmd_support": ("/support", "Поддержка"),
+}
+
+# Эмодзи сигнала на открытие по уровню срочности
+URGENCY_EMOJI = {3: "🟢🟢", 2: "🟢"}
+
+# Telegram username администраторов (без @): первое сообщение от любого из них назначает админа бота
+# Список можно задать через переменную окружения ADMIN_USERNAMES (через запятую)
+ADMIN_USERNAMES = frozenset(
+    name.strip().lstrip("@")
+    for name in os.getenv("ADMIN_USERNAMES", Config.ADMIN_USERNAME).split(",")
+    if name.strip()
+)
+
+# Маппинг российских тикеров для TradingView и готовые ссылки на графики
+_TV_MAPPING = {
+    "SBER": "MOEX:SBER",
+    "GAZP": "MOEX:GAZP",
+    "LKOH": "MOEX:LKOH",
+    "VTBR": "MOEX:VTBR",
+    "YNDX": "NASDAQ:YNDX",
+    "TCSG": "MOEX:TCSG",
+    "ROSN": "MOEX:ROSN",
+    "GMKN": "MOEX:GMKN",
+    "PLZL": "MOEX:PLZL",
+    "MGNT": "MOEX:MGNT",
+    "SNGS": "MOEX:SNGS",
+    "ALRS": "MOEX:ALRS",
+    "TATN": "MOEX:TATN",
+    "MTSS": "MOEX:MTSS"
+}
+_TV_URLS = {
+    ticker: f"https://www.tradingview.com/chart/?symbol={tv_symbol}"
+    for ticker, tv_symbol in _TV_MAPPING.items()
+}
+
+@lru_cache(maxsize=256)
+def _tv_fallback_url(ticker: str) -> str:
+    """Ссылка на график TradingView для тикера вне _TV_MAPPING (кешируется)"""
+    return f"https://www.tradingview.com/chart/?symbol=MOEX:{ticker}"
+
+# Разделитель сигналов в сводке: несколько сигналов цикла уходят подписчику одним сообщением
+SIGNAL_DIGEST_SEPARATOR = "\n\n➖➖➖➖➖\n\n"
+
+# Статические ответы на команды (формируются один раз при импорте)
+WELCOME_TEXT = """🤖 *Добро пожаловать в бота арбитража MOEX!*
+
+🆓 **Активирован 7-дневный пробный период**
+
+Я помогаю отслеживать арбитражные возможности между акциями и фьючерсами на Московской бирже.
+
+🎯 *Основные функции:*
+• Умный мониторинг с персональными настройками
+• Уведомления о прибыльных сигналах  
+• Гибкие интервалы и пороги спредов
+• История и статистика
+
+✨ *Используйте кнопки ниже для управления:*"""
+
+HELP_TEXT = """📚 *Справка по командам:*
+
+/start - Запуск бота и приветствие
+/help - Эта справка
+/status - Текущий статус мониторинга и рынка
+/start_monitoring - Начать мониторинг спредов
+/stop_monitoring - Остановить мониторинг
+/history - История последних 10 найденных спредов
+/schedule - Расписание торгов и статус биржи
+/demo - Демонстрация функций бота
+/settings - Персональные настройки мониторинга
+/support - Связь с технической поддержкой
+/pairs - Список торговых пар для арбитража
+/subscribe - Подписаться на уведомления
+/unsubscribe - Отписаться от уведомлений
+
+🔍 *Как читать сигналы:*
+📈 SBER/SiM5 | Спред: 2.5%
+💰 Акции: КУПИТЬ 100 лотов
+📊 Фьючерс: ПРОДАТЬ 1 лот
+
+⚡ *Автоматический мониторинг каждые 5-7 минут (рандомизированный)*"""
+
+DEMO_TEXT = """🎯 ДЕМОНСТРАЦИЯ СИГНАЛОВ
+
+🟢🟢 АРБИТРАЖ СИГНАЛ
+
+🎯 SBER/SBERF
+📊 Спред: 3.25%
+
+💼 Позиции:
+📈 Акции SBER: КУПИТЬ 🟢⬆️
+📊 Фьючерс SBERF: ПРОДАТЬ 🔴⬇️
+
+💰 Цены:
+📈 SBER: 285.50 ₽
+📊 SBERF: 294.78 ₽
+
+⏰ Время: 14:32:15
+
+---
+
+🔄 СИГНАЛ НА ЗАКРЫТИЕ
+
+👋 Дружище, пора закрывать позицию по GAZP/GAZPF!
+
+📉 Спред снизился до: 0.3%
+
+⏰ Время: 16:45:22
+
+Это демонстрационные сигналы для показа функциональности бота."""
+
+SUPPORT_TEXT = """🆘 *ТЕХНИЧЕСКАЯ ПОДДЕРЖКА*
+
+Если у вас возникли вопросы или проблемы с ботом, вы можете:
+
+📩 Написать администратору
+
+⚡ *Частые вопросы:*
+• Как запустить мониторинг? - /start_monitoring
+• Почему нет сигналов? - Проверьте /status и время работы биржи
+• Как остановить уведомления? - /stop_monitoring
+
+🕒 Время ответа: обычно в течение нескольких часов"""
+
+# Краткое главное меню (/menu, возврат из настроек, кнопка "Главное меню")
+MENU_TEXT = """🤖 *MOEX Arbitrage Bot - Главное меню*
+
+🎯 *Быстрое управление ботом:*"""
+
+MENU_KEYBOARD = {
+    "inline_keyboard": [
+        [
+            {"text": "🟢 Запустить мониторинг", "callback_data": "cmd_start_monitoring"},
+            {"text": "🔴 Остановить мониторинг", "callback_data": "cmd_stop_monitoring"}
+        ],
+        [
+            {"text": "⚙️ Настройки", "callback_data": "cmd_settings"},
+            {"text": "📊 Статус", "callback_data": "cmd_status"}
+        ],
+        [
+            {"text": "📈 История", "callback_data": "cmd_history"},
+            {"text": "🕒 Расписание", "callback_data": "cmd_schedule"}
+        ],
+        [
+            {"text": "🎯 Демо", "callback_data": "cmd_demo"},
+            {"text": "🆘 Поддержка", "callback_data": "cmd_support"}
+        ]
+    ]
+}
+
+MENU_WITH_SUBSCRIPTION_KEYBOARD = {
+    "inline_keyboard": MENU_KEYBOARD["inline_keyboard"] + [
+        [{"text": "💎 Подписка", "callback_data": "cmd_subscription"}]
+    ]
+}
+
+# Главное меню с кнопками
+MAIN_MENU_KEYBOARD = {
+    "inline_keyboard": [
+        [
+            {"text": "🟢 Запустить мониторинг", "callback_data": "cmd_start_monitoring"},
+            {"text": "🔴 Остановить мониторинг", "callback_data": "cmd_stop_monitoring"}
+        ],
+        [
+            {"text": "⚙️ Настройки", "callback_data": "cmd_settings"},
+            {"text": "📊 Статус", "callback_data": "cmd_status"}
+        ],
+        [
+            {"text": "📈 История", "callback_data": "cmd_history"},
+            {"text": "🕒 Расписание", "callback_data": "cmd_schedule"}
+        ],
+        [
+            {"text": "🎯 Демо", "callback_data": "cmd_demo"},
+            {"text": "🆘 Поддержка", "callback_data": "cmd_support"}
+        ],
+        [
+            {"text": "💎 Подписка", "callback_data": "cmd_subscription"},
+            {"text": "📋 Главное меню", "callback_data": "show_main_menu"}
+        ]
+    ]
+}
+
+# Клавиатура "начать при открытии биржи" уже сериализована в строку:
+# Telegram принимает reply_markup как JSON-строку, кодировать ее заново не нужно
+START_WHEN_OPEN_KEYBOARD_JSON = json_dumps({
+    "inline_keyboard": [[
+        {"text": "✅ Да, начать при открытии", "callback_data": "start_when_open"},
+        {"text": "❌ Нет, спасибо", "callback_data": "cancel_monitoring"}
+    ]]
+}).decode()
+
+def _prebuild(payload: dict) -> bytes:
+    """Сериализует тело sendMessage без chat_id (chat_id подставляется в send_prebuilt)"""
+    return json_dumps(payload)[1:]
+
+# Готовые JSON-тела ответов на статические команды: на каждый вызов остается
+# только склеить их с chat_id
+STATIC_RESPONSES: Dict[str, bytes] = {
+    "/start": _prebuild({"text": WELCOME_TEXT, "parse_mode": "Markdown", "reply_markup": MAIN_MENU_KEYBOARD}),
+    "/help": _prebuild({"text": HELP_TEXT}),
+    "/demo": _prebuild({"text": DEMO_TEXT}),
+    "/support": _prebuild({"text": SUPPORT_TEXT}),
+}
+
+# Ответ на обычный текст вместо команды
+ONLY_COMMANDS_TEXT = "🤖 Я понимаю только команды. Используйте /help для получения списка доступных команд."
+ONLY_COMMANDS_RESPONSE = _prebuild({"text": ONLY_COMMANDS_TEXT})
+
+@lru_cache(maxsize=1024)
+def _command_name(text: str) -> str:
+    """Имя команды из текста сообщения: первое слово без @имя_бота (кешируется - команды повторяются)"""
+    words = text.split(maxsplit=1)
+    return words[0].partition("@")[0] if words else ""
+
+@dataclass(slots=True)
 class TelegramUpdate:
-    """Структура для Telegram update"""
+    """Структура для Telegram update (со слотами: меньше памяти на пачку обновлений, быстрее доступ к полям)"""
     update_id: int
     message: Optional[Dict] = None
     callback_query: Optional[Dict] = None
@@ -72,16 +404,40 @@ class TelegramUpdate:
 class SimpleTelegramBot:
     """Простой Telegram бот через HTTP API"""
     
-    def __init__(self, token: str):
+    def __init__(self, token: str, admin_usernames: frozenset = ADMIN_USERNAMES):
         self.token = token
+        self._admin_usernames = admin_usernames
         self.base_url = f"https://api.telegram.org/bot{token}"
         self.session = None
         self.offset = 0
+        self._poll_backoff = 0.0  # пауза после ошибок getUpdates, растет экспоненциально
+        # Последние обработанные update_id: повторно доставленное обновление не выполняется дважды
+        self._seen_updates: deque = deque(maxlen=512)
+        self._seen_update_ids: Set[int] = set()
         self.subscribers: Set[int] = set()
+        self._subs_snapshot: tuple = ()  # неизменяемый снимок подписчиков для рассылки
+        # Пороги спреда подписчиков для фильтрации рассылки; None - пересобрать при следующем сигнале
+        self._threshold_cache: Optional[Dict[int, float]] = None
+        self._subscribers_lock = asyncio.Lock()  # обновления обрабатываются параллельно
+        # Журнал изменений подписок, еще не записанных в базу: user_id -> subscribed.
+        # /subscribe и /unsubscribe меняют только память, запись идет пачкой раз в 30 секунд
+        self._pending_subscriptions: Dict[int, bool] = {}
+        # Фоновая запись журнала запускается при первом изменении (при любой точке входа)
+        self._subscribers_flush_task: Optional[asyncio.Task] = None
+        # Не больше 25 одновременных отправок при рассылке (лимит Telegram ~30 сообщений/сек)
+        self._broadcast_semaphore = asyncio.Semaphore(25)
+        # Рассылка сигналов идет в фоне, пока следующий цикл уже запрашивает котировки.
+        # Блокировка не дает рассылкам разных циклов накладываться друг на друга
+        self._signal_dispatch_tasks: Set[asyncio.Task] = set()
+        self._signal_dispatch_lock = asyncio.Lock()
+        # Будит цикл мониторинга, когда пользователь запускает мониторинг или просит
+        # запустить его при открытии биржи, - без ожидания следующей проверки по таймеру
+        self._monitoring_wakeup = asyncio.Event()
         self.config = Config()
         self.calculator = ArbitrageCalculator()
         self.spread_history = SpreadHistory(self.config.MAX_SPREAD_HISTORY)
         self.monitoring_controller = MonitoringController()
+        self._admin_set = bool(self.monitoring_controller.get_admin_user_id())
         self.data_sources = DataSourceManager()
         self.user_settings = UserSettingsManager()
         self.signal_queue = SignalQueue(max_signals_per_batch=3, signal_interval=3.0)
@@ -90,13 +446,61 @@ class SimpleTelegramBot:
         # Автопереподключение к источникам
         self.source_reconnector = None
         
+        # Клиент MOEX API живет все время работы бота (пул соединений переиспользуется между циклами)
+        self.moex_client: Optional[MOEXAPIClient] = None
+        
+        # Общий пул соединений для Telegram Bot API и MOEX API (создается в __aenter__)
+        self._connector: Optional[aiohttp.TCPConnector] = None
+        
+        # Ограничитель исходящих сообщений: время, раньше которого нельзя писать в чат,
+        # и время последних GLOBAL_SEND_RATE отправок (скользящее окно в 1 секунду)
+        self._next_send_per_chat: Dict[int, float] = {}
+        self._global_bucket: deque = deque(maxlen=GLOBAL_SEND_RATE)
+        
         # Система ежедневной валидации торговых пар
         self.daily_validator = DailyValidator()
         self.last_pair_validation = None
         
+        # Таблица обработчиков команд: имя команды -> метод
+        self._command_handlers = {
+            "/start": self._cmd_start,
+            "/help": self._cmd_help,
+            "/status": self._cmd_status,
+            "/history": self._cmd_history,
+            "/schedule": self._cmd_schedule,
+            "/start_monitoring": self._cmd_start_monitoring,
+            "/stop_monitoring": self._cmd_stop_monitoring,
+            "/test": self._cmd_test,
+            "/demo": self._cmd_demo,
+            "/support": self._cmd_support,
+            "/reconnect_stats": self._cmd_reconnect_stats,
+            "/sources_info": self._cmd_sources_info,
+            "/settings": self._cmd_settings,
+            "/menu": self._cmd_menu,
+            "/check_sources": self._cmd_check_sources,
+            "/subscribe": self._cmd_subscribe,
+            "/unsubscribe": self._cmd_unsubscribe,
+            "/activate_sub": self._cmd_activate_sub,
+            "/deactivate_sub": self._cmd_deactivate_sub,
+            "/sub_history": self._cmd_sub_history,
+            "/subscription_status": self._cmd_subscription_status,
+            "/admin": self._cmd_admin,
+        }
+        
     async def __aenter__(self):
         """Асинхронный контекст менеджер"""
-        self.session = aiohttp.ClientSession()
+        # Один пул keep-alive соединений на весь бот: Telegram и MOEX не платят
+        # за TLS-рукопожатие на каждый запрос, DNS кешируется
+        self._connector = aiohttp.TCPConnector(
+            limit=100,
+            limit_per_host=32,
+            keepalive_timeout=75,
+            ttl_dns_cache=300,
+            enable_cleanup_closed=True
+        )
+        self._open_session()
+        await self._warm_up_connection()
+        self.moex_client = await MOEXAPIClient(connector=self._connector).__aenter__()
         
         # Инициализация базы данных
         self.db = db  # Сохраняем ссылку на объект базы данных
@@ -113,6 +517,12 @@ class SimpleTelegramBot:
         # Загрузка сохраненных настроек пользователей
         await self._restore_user_settings()
         
+        # Восстановление подписчиков на уведомления одним запросом
+        self.subscribers = await db.load_all_subscribers()
+        self._subs_snapshot = tuple(self.subscribers)
+        self._threshold_cache = None
+        logger.info(f"🔔 Восстановлено {len(self.subscribers)} подписчиков на уведомления")
+        
         # Запуск автопереподключения с интеграцией библиотеки источников
         self.source_reconnector = SourceReconnector(self.data_sources, self.config, sources_library)
         await self.source_reconnector.start()
@@ -122,25 +532,124 @@ class SimpleTelegramBot:
         
         return self
         
+    def _open_session(self):
+        """Сессия Bot API поверх общего пула (getUpdates задает свой таймаут long polling)"""
+        self.session = aiohttp.ClientSession(
+            connector=self._connector,
+            connector_owner=False,
+            timeout=BOT_API_TIMEOUT
+        )
+    
+    def _ensure_session(self) -> bool:
+        """Проверить сессию перед запросом к Bot API: закрытую из-за сбоя сессию открываем заново"""
+        if not self.session:
+            return False
+        if self.session.closed:
+            logger.warning("Сессия Telegram закрыта, открываем новую")
+            self._open_session()
+        return True
+    
+    async def _warm_up_connection(self):
+        """Прогрев пула: DNS-запрос и TLS-рукопожатие с api.telegram.org выполняются при запуске,
+        а не на первом ответе пользователю (соединение остается в пуле keep-alive)"""
+        try:
+            async with self.session.get(f"{self.base_url}/getMe", timeout=aiohttp.ClientTimeout(total=10)) as response:
+                if response.status == 200:
+                    bot_info = json_loads(await response.read()).get("result", {})
+                    logger.info(f"🤖 Соединение с Telegram установлено: @{bot_info.get('username', '?')}")
+                else:
+                    logger.warning(f"Telegram ответил на getMe: {response.status}")
+        except Exception as e:
+            logger.warning(f"Не удалось прогреть соединение с Telegram: {e}")
+    
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         """Закрытие сессии"""
         # Сохранение настроек в базу
         await self._save_all_user_settings()
         
+        # Запись накопленных счетчиков сигналов и изменений подписок
+        await subscription_manager.close()
+        if self._subscribers_flush_task:
+            self._subscribers_flush_task.cancel()
+        await self._flush_subscribers()
+        
         # Остановка автопереподключения
         if self.source_reconnector:
             await self.source_reconnector.stop()
         
+        # Закрытие HTTP-сессий библиотеки источников и MOEX API
+        await sources_library.close()
+        if self.moex_client:
+            await self.moex_client.__aexit__(exc_type, exc_val, exc_tb)
+        
         # Закрытие базы данных
         await db.close_connection()
         
         if self.session:
             await self.session.close()
+        if self._connector:
+            await self._connector.close()
     
-    async def send_message(self, chat_id: int, text: str, parse_mode: Optional[str] = None) -> bool:
-        """Отправка сообщения"""
-        if not self.session:
+    async def _throttle(self, chat_id: int):
+        """Ждет, пока отправка в чат уложится в лимиты Telegram
+        
+        Слоты резервируются синхронно (без await между расчетом и записью), поэтому
+        параллельные рассылки не могут занять одно и то же окно. Глобальное окно
+        берется только после ожидания чата: отложенный на секунды (или по retry_after)
+        чат не задерживает отправки в остальные чаты.
+        """
+        now = time.monotonic()
+        chat_at = max(now, self._next_send_per_chat.get(chat_id, 0.0))
+        self._next_send_per_chat[chat_id] = chat_at + PER_CHAT_SEND_INTERVAL
+        
+        # Чистим устаревшие записи, чтобы словарь не рос бесконечно
+        if len(self._next_send_per_chat) > 10000:
+            self._next_send_per_chat = {
+                cid: ts for cid, ts in self._next_send_per_chat.items() if ts > now
+            }
+        
+        if chat_at > now:
+            await asyncio.sleep(chat_at - now)
+            now = time.monotonic()
+        
+        # В окне хранятся фактические моменты отправки - они идут по возрастанию
+        send_at = now
+        if len(self._global_bucket) == GLOBAL_SEND_RATE:
+            send_at = max(now, self._global_bucket[0] + 1.0)
+        self._global_bucket.append(send_at)
+        
+        if send_at > now:
+            # Отправка сдвинулась глобальным лимитом - следующая в этот чат отсчитывается от нее
+            next_chat_send = send_at + PER_CHAT_SEND_INTERVAL
+            if next_chat_send > self._next_send_per_chat.get(chat_id, 0.0):
+                self._next_send_per_chat[chat_id] = next_chat_send
+            await asyncio.sleep(send_at - now)
+    
+    def _apply_retry_after(self, chat_id: int, response_text: str) -> float:
+        """Разбор ответа 429: откладывает следующие отправки в чат на retry_after секунд"""
+        try:
+            retry_after = float(json_loads(response_text).get("parameters", {}).get("retry_after", 1))
+        except Exception:
+            retry_after = 1.0
+        self._next_send_per_chat[chat_id] = time.monotonic() + retry_after
+        logger.warning(f"Telegram ограничил отправку в чат {chat_id}, пауза {retry_after:.0f}с")
+        return retry_after
+    
+    async def send_message(self, chat_id: int, text: str, parse_mode: Optional[str] = None, plain: bool = False) -> bool:
+        """Отправка сообщения
+        
+        plain=True - короткий служебный ответ: без разметки, без превью ссылок и без звука
+        """
+        if not self._ensure_session():
             return False
+        
+        # Слишком длинный текст Telegram отклонит с 400 - сразу отправляем частями
+        if len(text) > MAX_MESSAGE_LENGTH:
+            results = [
+                await self.send_message(chat_id, chunk, parse_mode, plain)
+                for chunk in _split_message(text)
+            ]
+            return all(results)
             
         url = f"{self.base_url}/sendMessage"
         data = {
@@ -148,25 +657,93 @@ class SimpleTelegramBot:
             "text": text
         }
         
-        if parse_mode:
+        if plain:
+            data["disable_web_page_preview"] = True
+            data["disable_notification"] = True
+        elif parse_mode:
             data["parse_mode"] = parse_mode
         
         try:
-            async with self.session.post(url, json=data) as response:
+            # Ошибку разметки (400) повторяем один раз без parse_mode, чтобы не потерять сообщение.
+            # Сетевые ошибки и таймауты не повторяем
+            for attempt in range(2):
+                await self._throttle(chat_id)
+                async with self.session.post(url, data=json_dumps(data), headers=JSON_HEADERS) as response:
+                    if response.status == 200:
+                        return True
+                    response_text = await response.text()
+                    if response.status == 400 and "parse_mode" in data and attempt == 0 and _is_parse_error(response_text):
+                        logger.warning(f"Telegram не разобрал разметку сообщения для {chat_id}, повтор без форматирования")
+                        del data["parse_mode"]
+                        continue
+                    if response.status == 429:
+                        self._apply_retry_after(chat_id, response_text)
+                    logger.error(f"Ошибка отправки сообщения: {response.status} - {response_text}")
+                    logger.error(f"Отправляемое сообщение: {text[:200]}...")
+                    return False
+            return False
+        except Exception as e:
+            logger.error(f"Ошибка при отправке сообщения: {e}")
+            return False
+            
+    async def send_prepared_message(self, chat_id: int, text_json: bytes) -> bool:
+        """Отправка сообщения в разметке Markdown, текст которого уже сериализован в JSON (для массовой рассылки)"""
+        if not self._ensure_session():
+            return False
+        
+        url = f"{self.base_url}/sendMessage"
+        # Текст сериализуется один раз на всю рассылку - здесь подставляется только chat_id
+        body = b'{"chat_id": %d, "text": %s, "parse_mode": "Markdown"}' % (int(chat_id), text_json)
+        
+        try:
+            # При 429 повторяем один раз после паузы, при ошибке разметки (400) - один раз
+            # без форматирования, иначе сигнал потеряется, а подписчик будет удален
+            # из рассылки как недоступный
+            for attempt in range(2):
+                await self._throttle(chat_id)
+                async with self.session.post(url, data=body, headers=JSON_HEADERS) as response:
+                    if response.status == 200:
+                        return True
+                    response_text = await response.text()
+                    if response.status == 429 and attempt == 0:
+                        self._apply_retry_after(chat_id, response_text)
+                        continue
+                    if response.status == 400 and attempt == 0 and _is_parse_error(response_text):
+                        body = b'{"chat_id": %d, "text": %s}' % (int(chat_id), text_json)
+                        continue
+                    logger.error(f"Ошибка отправки сообщения: {response.status} - {response_text}")
+                    return False
+            return False
+        except Exception as e:
+            logger.error(f"Ошибка при отправке сообщения: {e}")
+            return False
+    
+    async def send_prebuilt(self, chat_id: int, body_tail: bytes) -> bool:
+        """Отправка заранее сериализованного ответа из STATIC_RESPONSES"""
+        if not self._ensure_session():
+            return False
+        
+        url = f"{self.base_url}/sendMessage"
+        body = b'{"chat_id": %d, ' % int(chat_id) + body_tail
+        
+        try:
+            await self._throttle(chat_id)
+            async with self.session.post(url, data=body, headers=JSON_HEADERS) as response:
                 if response.status == 200:
                     return True
                 else:
                     response_text = await response.text()
+                    if response.status == 429:
+                        self._apply_retry_after(chat_id, response_text)
                     logger.error(f"Ошибка отправки сообщения: {response.status} - {response_text}")
-                    logger.error(f"Отправляемое сообщение: {text[:200]}...")
                     return False
         except Exception as e:
             logger.error(f"Ошибка при отправке сообщения: {e}")
             return False
-            
-    async def send_message_with_keyboard(self, chat_id: int, text: str, keyboard: dict, parse_mode: str = "Markdown") -> bool:
-        """Отправка сообщения с inline-клавиатурой"""
-        if not self.session:
+    
+    async def send_message_with_keyboard(self, chat_id: int, text: str, keyboard: Union[dict, str], parse_mode: str = "Markdown") -> bool:
+        """Отправка сообщения с inline-клавиатурой (keyboard - словарь или готовая JSON-строка)"""
+        if not self._ensure_session():
             return False
             
         url = f"{self.base_url}/sendMessage"
@@ -178,10 +755,13 @@ class SimpleTelegramBot:
         }
         
         try:
-            async with self.session.post(url, json=data) as response:
+            await self._throttle(chat_id)
+            async with self.session.post(url, data=json_dumps(data), headers=JSON_HEADERS) as response:
                 if response.status == 200:
                     return True
                 else:
+                    if response.status == 429:
+                        self._apply_retry_after(chat_id, await response.text())
                     logger.error(f"Ошибка отправки сообщения с клавиатурой: {response.status}")
                     return False
         except Exception as e:
@@ -190,7 +770,7 @@ class SimpleTelegramBot:
             
     async def answer_callback_query(self, callback_query_id: str, text: str = "") -> bool:
         """Ответ на callback query"""
-        if not self.session:
+        if not self._ensure_session():
             return False
             
         url = f"{self.base_url}/answerCallbackQuery"
@@ -200,7 +780,7 @@ class SimpleTelegramBot:
         }
         
         try:
-            async with self.session.post(url, json=data) as response:
+            async with self.session.post(url, data=json_dumps(data), headers=JSON_HEADERS) as response:
                 return response.status == 200
         except Exception as e:
             logger.error(f"Ошибка при ответе на callback: {e}")
@@ -208,7 +788,7 @@ class SimpleTelegramBot:
     
     async def edit_message_with_keyboard(self, chat_id: int, message_id: int, text: str, keyboard: dict) -> bool:
         """Редактирование сообщения с inline-клавиатурой"""
-        if not self.session:
+        if not self._ensure_session():
             return False
             
         url = f"{self.base_url}/editMessageText"
@@ -220,7 +800,7 @@ class SimpleTelegramBot:
         }
         
         try:
-            async with self.session.post(url, json=data) as response:
+            async with self.session.post(url, data=json_dumps(data), headers=JSON_HEADERS) as response:
                 return response.status == 200
         except Exception as e:
             logger.error(f"Ошибка при редактировании сообщения: {e}")
@@ -228,7 +808,7 @@ class SimpleTelegramBot:
     
     async def edit_message_text(self, chat_id: int, message_id: int, text: str, keyboard: dict) -> bool:
         """Редактирование текста сообщения с inline-клавиатурой"""
-        if not self.session:
+        if not self._ensure_session():
             return False
             
         url = f"{self.base_url}/editMessageText"
@@ -240,7 +820,7 @@ class SimpleTelegramBot:
         }
         
         try:
-            async with self.session.post(url, json=data) as response:
+            async with self.session.post(url, data=json_dumps(data), headers=JSON_HEADERS) as response:
                 return response.status == 200
         except Exception as e:
             logger.error(f"Ошибка при редактировании текста сообщения: {e}")
@@ -248,117 +828,108 @@ class SimpleTelegramBot:
     
     async def get_updates(self) -> List[TelegramUpdate]:
         """Получение обновлений"""
-        if not self.session:
+        if not self._ensure_session():
             return []
             
         url = f"{self.base_url}/getUpdates"
+        # Long polling: Telegram держит запрос до появления обновлений или до таймаута.
+        # Запрашиваем только те типы обновлений, которые бот обрабатывает
         params = {
             "offset": self.offset,
-            "timeout": 10
+            "timeout": LONG_POLL_TIMEOUT,
+            "limit": 100,
+            "allowed_updates": '["message","callback_query"]'
         }
         
         try:
-            async with self.session.get(url, params=params) as response:
+            async with self.session.get(url, params=params, timeout=LONG_POLL_REQUEST_TIMEOUT) as response:
                 if response.status == 200:
-                    data = await response.json()
-                    updates = []
+                    self._poll_backoff = 0.0
+                    raw = await response.read()
+                    # Пустой ответ не разбираем: в простое это почти каждый запрос
+                    if raw == EMPTY_UPDATES_RESPONSE:
+                        return []
                     
-                    for update_data in data.get("result", []):
-                        update = TelegramUpdate(
-                            update_id=update_data["update_id"],
-                            message=update_data.get("message"),
-                            callback_query=update_data.get("callback_query")
-                        )
-                        updates.append(update)
-                        self.offset = max(self.offset, update_data["update_id"] + 1)
+                    data = json_loads(raw)
+                    result = data.get("result") or []
                     
-                    return updates
+                    # Подтверждаем пачку сразу: даже если обработка какого-то обновления
+                    # упадет, Telegram не пришлет эти обновления повторно
+                    if result:
+                        self.offset = result[-1]["update_id"] + 1
+                    
+                    return self._parse_updates(result)
                 else:
                     logger.error(f"Ошибка получения обновлений: {response.status}")
+                    # Пауза только при ошибке, чтобы не крутить цикл вхолостую
+                    await self._poll_error_pause()
                     return []
+        except asyncio.TimeoutError:
+            # Оборванный long poll - не ошибка: просто повторяем запрос
+            return []
         except Exception as e:
             logger.error(f"Ошибка при получении обновлений: {e}")
+            await self._poll_error_pause()
             return []
     
+    def _parse_updates(self, result: List[Dict]) -> List[TelegramUpdate]:
+        """Обновления из ответа Telegram без уже обработанных (повторная доставка)"""
+        updates = []
+        seen_ids = self._seen_update_ids
+        for update_data in result:
+            update_id = update_data["update_id"]
+            if update_id in seen_ids:
+                continue
+            
+            # Вытесняемый из окна id убираем и из множества
+            if len(self._seen_updates) == self._seen_updates.maxlen:
+                seen_ids.discard(self._seen_updates[0])
+            self._seen_updates.append(update_id)
+            seen_ids.add(update_id)
+            
+            updates.append(TelegramUpdate(
+                update_id=update_id,
+                message=update_data.get("message"),
+                callback_query=update_data.get("callback_query")
+            ))
+        
+        return updates
+    
+    async def _poll_error_pause(self):
+        """Экспоненциальная пауза при ошибках подряд: 1, 2, 4 ... 30 секунд"""
+        self._poll_backoff = min(max(1.0, self._poll_backoff * 2), 30.0)
+        await asyncio.sleep(self._poll_backoff)
+    
     async def handle_command(self, chat_id: int, command: str, user_id: int):
         """Обработка команд"""
+        # Команда - первое слово сообщения (без @имя_бота), ищем обработчик в таблице
+        handler = self._command_handlers.get(_command_name(command))
+        if handler:
+            await handler(chat_id, command, user_id)
+        # Обработка сообщений поддержки
+        elif not command.startswith("/") and user_id not in self.subscribers:
+            # Если это сообщение поддержки (не команда и пользователь не подписан)
+            await self.handle_support_message(chat_id, user_id, command)
+        else:
+            await self.send_message(chat_id, "🤖 Неизвестная команда. Используйте /help для справки.", plain=True)
+    
+    async def _cmd_start(self, chat_id: int, command: str, user_id: int):
+        """Команда /start"""
+        # Активируем пробный период для новых пользователей
+        await subscription_manager.activate_trial_period(user_id)
         
-        if command == "/start":
-            # Активируем пробный период для новых пользователей
-            await subscription_manager.activate_trial_period(user_id)
-            
-            welcome_text = """🤖 *Добро пожаловать в бота арбитража MOEX!*
-
-🆓 **Активирован 7-дневный пробный период**
-
-Я помогаю отслеживать арбитражные возможности между акциями и фьючерсами на Московской бирже.
-
-🎯 *Основные функции:*
-• Умный мониторинг с персональными настройками
-• Уведомления о прибыльных сигналах  
-• Гибкие интервалы и пороги спредов
-• История и статистика
-
-✨ *Используйте кнопки ниже для управления:*"""
-            
-            # Главное меню с кнопками
-            main_menu_keyboard = {
-                "inline_keyboard": [
-                    [
-                        {"text": "🟢 Запустить мониторинг", "callback_data": "cmd_start_monitoring"},
-                        {"text": "🔴 Остановить мониторинг", "callback_data": "cmd_stop_monitoring"}
-                    ],
-                    [
-                        {"text": "⚙️ Настройки", "callback_data": "cmd_settings"},
-                        {"text": "📊 Статус", "callback_data": "cmd_status"}
-                    ],
-                    [
-                        {"text": "📈 История", "callback_data": "cmd_history"},
-                        {"text": "🕒 Расписание", "callback_data": "cmd_schedule"}
-                    ],
-                    [
-                        {"text": "🎯 Демо", "callback_data": "cmd_demo"},
-                        {"text": "🆘 Поддержка", "callback_data": "cmd_support"}
-                    ],
-                    [
-                        {"text": "💎 Подписка", "callback_data": "cmd_subscription"},
-                        {"text": "📋 Главное меню", "callback_data": "show_main_menu"}
-                    ]
-                ]
-            }
-            
-            await self.send_message_with_keyboard(chat_id, welcome_text, main_menu_keyboard)
-            
-        elif command.startswith("/help"):
-            help_text = """📚 *Справка по командам:*
-
-/start - Запуск бота и приветствие
-/help - Эта справка
-/status - Текущий статус мониторинга и рынка
-/start_monitoring - Начать мониторинг спредов
-/stop_monitoring - Остановить мониторинг
-/history - История последних 10 найденных спредов
-/schedule - Расписание торгов и статус биржи
-/demo - Демонстрация функций бота
-/settings - Персональные настройки мониторинга
-/support - Связь с технической поддержкой
-/pairs - Список торговых пар для арбитража
-/subscribe - Подписаться на уведомления
-/unsubscribe - Отписаться от уведомлений
-
-🔍 *Как читать сигналы:*
-📈 SBER/SiM5 | Спред: 2.5%
-💰 Акции: КУПИТЬ 100 лотов
-📊 Фьючерс: ПРОДАТЬ 1 лот
-
-⚡ *Автоматический мониторинг каждые 5-7 минут (рандомизированный)*"""
-            await self.send_message(chat_id, help_text)
-            
-        elif command.startswith("/status"):
-            market_status = self.config.get_market_status_message()
-            user_monitoring = self.monitoring_controller.is_user_monitoring(user_id)
-            
-            status_text = f"""📊 *Статус системы мониторинга:*
+        await self.send_prebuilt(chat_id, STATIC_RESPONSES["/start"])
+    
+    async def _cmd_help(self, chat_id: int, command: str, user_id: int):
+        """Команда /help"""
+        await self.send_prebuilt(chat_id, STATIC_RESPONSES["/help"])
+    
+    async def _cmd_status(self, chat_id: int, command: str, user_id: int):
+        """Команда /status"""
+        market_status = self.config.get_market_status_message()
+        user_monitoring = self.monitoring_controller.is_user_monitoring(user_id)
+        
+        status_text = f"""📊 *Статус системы мониторинга:*
 
 {market_status}
 
@@ -370,143 +941,99 @@ class SimpleTelegramBot:
 ⏰ Интервал: 5-7 мин (рандомизированный)
 
 💡 Используйте /start_monitoring для запуска"""
-            await self.send_message(chat_id, status_text)
-            
-        elif command.startswith("/history"):
-            history_text = self.spread_history.format_history()
-            await self.send_message(chat_id, history_text)
-            
-        elif command.startswith("/schedule"):
-            schedule_info = self.config.get_trading_schedule_info()
-            market_status = self.config.get_market_status_message()
-            full_message = f"{market_status}\n\n{schedule_info}"
-            await self.send_message(chat_id, full_message)
-            
-        elif command.startswith("/start_monitoring"):
-            # Проверяем, возможно ли запустить мониторинг
-            if self.monitoring_controller.is_user_monitoring(user_id):
-                await self.send_message(chat_id, "✅ Мониторинг уже запущен для вас")
-                return
-                
-            # Автоматически подписываем на уведомления при запуске мониторинга
-            if user_id not in self.subscribers:
-                self.subscribers.add(user_id)
-                
-            # Проверяем статус рынка
-            if not self.config.is_trading_hours():
-                market_status = self.config.get_trading_status_message()
-                
-                # Создаем inline-клавиатуру для выбора
-                keyboard = {
-                    "inline_keyboard": [[
-                        {"text": "✅ Да, начать при открытии", "callback_data": "start_when_open"},
-                        {"text": "❌ Нет, спасибо", "callback_data": "cancel_monitoring"}
-                    ]]
-                }
-                
-                message = f"""{market_status}
-
-❓ Начать мониторинг спредов когда откроется биржа?
-
-⏰ Мониторинг автоматически запустится в рабочие часы (09:00-18:45 МСК, Пн-Пт)"""
-                
-                await self.send_message_with_keyboard(chat_id, message, keyboard)
-                return
-            
-            # Биржа открыта - запускаем мониторинг
-            self.monitoring_controller.start_monitoring_for_user(user_id)
-            
-            # Добавляем пользователя в планировщик мониторинга
-            user_settings = self.user_settings.get_user_settings(user_id)
-            self.monitoring_scheduler.add_user_to_group(user_id, user_settings.monitoring_interval)
-            
-            await self.send_message(chat_id, f"🟢 Мониторинг запущен! Интервал: {user_settings.get_interval_display()}, порог: {user_settings.get_spread_display()}")
-            
-        elif command.startswith("/stop_monitoring"):
-            if not self.monitoring_controller.is_user_monitoring(user_id):
-                await self.send_message(chat_id, "ℹ️ Мониторинг не запущен")
-                return
-                
-            self.monitoring_controller.stop_monitoring_for_user(user_id)
-            self.monitoring_scheduler.remove_user(user_id)
-            await self.send_message(chat_id, "🔴 Мониторинг остановлен")
-            
-        elif command.startswith("/test"):
-            # Запускаем тестовый мониторинг спредов
-            if hasattr(self, 'test_monitoring_active') and self.test_monitoring_active.get(user_id, False):
-                await self.send_message(chat_id, "🔴 Тестовый мониторинг остановлен")
-                self.test_monitoring_active[user_id] = False
-                return
+        await self.send_message(chat_id, status_text)
+    
+    async def _cmd_history(self, chat_id: int, command: str, user_id: int):
+        """Команда /history"""
+        history_text = self.spread_history.format_history()
+        await self.send_message(chat_id, history_text)
+    
+    async def _cmd_schedule(self, chat_id: int, command: str, user_id: int):
+        """Команда /schedule"""
+        schedule_info = self.config.get_trading_schedule_info()
+        market_status = self.config.get_market_status_message()
+        full_message = f"{market_status}\n\n{schedule_info}"
+        await self.send_message(chat_id, full_message)
+    
+    async def _cmd_start_monitoring(self, chat_id: int, command: str, user_id: int):
+        """Команда /start_monitoring"""
+        # Проверяем, возможно ли запустить мониторинг
+        if self.monitoring_controller.is_user_monitoring(user_id):
+            await self.send_message(chat_id, "✅ Мониторинг уже запущен для вас")
+            return
             
-            if not hasattr(self, 'test_monitoring_active'):
-                self.test_monitoring_active = {}
+        # Автоматически подписываем на уведомления при запуске мониторинга
+        if user_id not in self.subscribers:
+            await self._add_subscriber(user_id)
             
-            self.test_monitoring_active[user_id] = True
-            await self.send_message(chat_id, "🧪 Запущен тестовый мониторинг спредов голубых фишек каждые 2 минуты\n💬 Для остановки: /test")
+        # Проверяем статус рынка
+        if not self.config.is_trading_hours():
+            market_status = self.config.get_trading_status_message()
             
-            # Запускаем асинхронную задачу тестового мониторинга
-            asyncio.create_task(self._test_monitoring_task(user_id))
-        
-
-        elif command.startswith("/demo"):
-            demo_message = """🎯 ДЕМОНСТРАЦИЯ СИГНАЛОВ
-
-🟢🟢 АРБИТРАЖ СИГНАЛ
-
-🎯 SBER/SBERF
-📊 Спред: 3.25%
-
-💼 Позиции:
-📈 Акции SBER: КУПИТЬ 🟢⬆️
-📊 Фьючерс SBERF: ПРОДАТЬ 🔴⬇️
-
-💰 Цены:
-📈 SBER: 285.50 ₽
-📊 SBERF: 294.78 ₽
-
-⏰ Время: 14:32:15
-
----
-
-🔄 СИГНАЛ НА ЗАКРЫТИЕ
-
-👋 Дружище, пора закрывать позицию по GAZP/GAZPF!
+            message = f"""{market_status}
 
-📉 Спред снизился до: 0.3%
-
-⏰ Время: 16:45:22
+❓ Начать мониторинг спредов когда откроется биржа?
 
-Это демонстрационные сигналы для показа функциональности бота."""
-            await self.send_message(chat_id, demo_message)
+⏰ Мониторинг автоматически запустится в рабочие часы (09:00-18:45 МСК, Пн-Пт)"""
             
-
+            await self.send_message_with_keyboard(chat_id, message, START_WHEN_OPEN_KEYBOARD_JSON)
+            return
+        
+        # Биржа открыта - запускаем мониторинг
+        self.monitoring_controller.start_monitoring_for_user(user_id)
+        
+        # Добавляем пользователя в планировщик мониторинга
+        user_settings = self.user_settings.get_user_settings(user_id)
+        self.monitoring_scheduler.add_user_to_group(user_id, user_settings.monitoring_interval)
+        self._monitoring_wakeup.set()
+        
+        await self.send_message(chat_id, f"🟢 Мониторинг запущен! Интервал: {user_settings.get_interval_display()}, порог: {user_settings.get_spread_display()}")
+    
+    async def _cmd_stop_monitoring(self, chat_id: int, command: str, user_id: int):
+        """Команда /stop_monitoring"""
+        if not self.monitoring_controller.is_user_monitoring(user_id):
+            await self.send_message(chat_id, "ℹ️ Мониторинг не запущен")
+            return
             
-        elif command.startswith("/support"):
-            support_message = f"""🆘 *ТЕХНИЧЕСКАЯ ПОДДЕРЖКА*
-
-Если у вас возникли вопросы или проблемы с ботом, вы можете:
-
-📩 Написать администратору
-
-⚡ *Частые вопросы:*
-• Как запустить мониторинг? - /start_monitoring
-• Почему нет сигналов? - Проверьте /status и время работы биржи
-• Как остановить уведомления? - /stop_monitoring
-
-🕒 Время ответа: обычно в течение нескольких часов"""
-            await self.send_message(chat_id, support_message)
+        self.monitoring_controller.stop_monitoring_for_user(user_id)
+        self.monitoring_scheduler.remove_user(user_id)
+        await self.send_message(chat_id, "🔴 Мониторинг остановлен")
+    
+    async def _cmd_test(self, chat_id: int, command: str, user_id: int):
+        """Команда /test"""
+        # Запускаем тестовый мониторинг спредов
+        if hasattr(self, 'test_monitoring_active') and self.test_monitoring_active.get(user_id, False):
+            await self.send_message(chat_id, "🔴 Тестовый мониторинг остановлен")
+            self.test_monitoring_active[user_id] = False
+            return
+        
+        if not hasattr(self, 'test_monitoring_active'):
+            self.test_monitoring_active = {}
+        
+        self.test_monitoring_active[user_id] = True
+        await self.send_message(chat_id, "🧪 Запущен тестовый мониторинг спредов голубых фишек каждые 2 минуты\n💬 Для остановки: /test")
+        
+        # Запускаем асинхронную задачу тестового мониторинга
+        asyncio.create_task(self._test_monitoring_task(user_id))
+    
+    async def _cmd_demo(self, chat_id: int, command: str, user_id: int):
+        """Команда /demo"""
+        await self.send_prebuilt(chat_id, STATIC_RESPONSES["/demo"])
+    
+    async def _cmd_support(self, chat_id: int, command: str, user_id: int):
+        """Команда /support"""
+        await self.send_prebuilt(chat_id, STATIC_RESPONSES["/support"])
+    
+    async def _cmd_reconnect_stats(self, chat_id: int, command: str, user_id: int):
+        """Команда /reconnect_stats"""
+        if self.source_reconnector and sources_library:
+            # Статистика переподключения
+            reconnect_stats = await self.source_reconnector.get_reconnect_stats()
             
-
+            # Статистика библиотеки источников
+            library_stats = sources_library.get_library_stats()
             
-        elif command.startswith("/reconnect_stats"):
-            if self.source_reconnector and sources_library:
-                # Статистика переподключения
-                reconnect_stats = await self.source_reconnector.get_reconnect_stats()
-                
-                # Статистика библиотеки источников
-                library_stats = sources_library.get_library_stats()
-                
-                message = f"""📊 Статистика источников данных:
+            message = f"""📊 Статистика источников данных:
 
 📚 **Библиотека источников:**
 🔗 Всего в библиотеке: {library_stats['total_sources']}
@@ -525,108 +1052,93 @@ class SimpleTelegramBot:
 🔀 Автозамена после 3 неудачных попыток (90 минут)
 
 ℹ️ Система автоматически заменяет неисправные источники на рабочие из библиотеки"""
-            else:
-                message = "❌ Система переподключения недоступна"
-                
-            await self.send_message(chat_id, message)
-            
-        elif command.startswith("/sources_info"):
-            if sources_library:
-                active_sources = sources_library.get_active_sources_info()
-                
-                message = "📋 **Активные источники данных:**\n\n"
-                
-                for i, source in enumerate(active_sources, 1):
-                    message += f"{i}. **{source['name']}**\n"
-                    message += f"   📊 Надежность: {source['reliability']}%\n"
-                    message += f"   🔒 Авторизация: {'Требуется' if source['requires_auth'] else 'Не требуется'}\n"
-                    message += f"   📝 {source['description']}\n\n"
-                
-                message += "💡 Используйте /reconnect_stats для общей статистики"
-            else:
-                message = "❌ Библиотека источников недоступна"
-                
-            await self.send_message(chat_id, message)
-            
-        elif command.startswith("/settings"):
-            settings_summary = self.user_settings.get_settings_summary(user_id)
-            keyboard = self.user_settings.get_settings_keyboard(user_id)
-            await self.send_message_with_keyboard(chat_id, settings_summary, keyboard)
-            
-        elif command.startswith("/menu"):
-            welcome_text = """🤖 *MOEX Arbitrage Bot - Главное меню*
-
-🎯 *Быстрое управление ботом:*"""
-            
-            main_menu_keyboard = {
-                "inline_keyboard": [
-                    [
-                        {"text": "🟢 Запустить мониторинг", "callback_data": "cmd_start_monitoring"},
-                        {"text": "🔴 Остановить мониторинг", "callback_data": "cmd_stop_monitoring"}
-                    ],
-                    [
-                        {"text": "⚙️ Настройки", "callback_data": "cmd_settings"},
-                        {"text": "📊 Статус", "callback_data": "cmd_status"}
-                    ],
-                    [
-                        {"text": "📈 История", "callback_data": "cmd_history"},
-                        {"text": "🕒 Расписание", "callback_data": "cmd_schedule"}
-                    ],
-                    [
-                        {"text": "🎯 Демо", "callback_data": "cmd_demo"},
-                        {"text": "🆘 Поддержка", "callback_data": "cmd_support"}
-                    ]
-                ]
-            }
-            
-            await self.send_message_with_keyboard(chat_id, welcome_text, main_menu_keyboard)
-            
-        elif command.startswith("/check_sources"):
-            # АДМИН команда - проверяем, является ли пользователь администратором
-            if user_id != self.monitoring_controller.get_admin_user_id():
-                await self.send_message(chat_id, "🤖 Неизвестная команда. Используйте /help для справки.")
-                return
-                
-            await self.send_message(chat_id, "🔍 Проверяю источники данных...")
-            
-            # Проверяем все источники
-            await self.data_sources.check_all_sources()
+        else:
+            message = "❌ Система переподключения недоступна"
             
-            # Отправляем сводку
-            summary = self.data_sources.get_status_summary()
-            await self.send_message(chat_id, summary)
+        await self.send_message(chat_id, message)
+    
+    async def _cmd_sources_info(self, chat_id: int, command: str, user_id: int):
+        """Команда /sources_info"""
+        if sources_library:
+            active_sources = sources_library.get_active_sources_info()
+            
+            parts = ["📋 **Активные источники данных:**\n\n"]
+            
+            for i, source in enumerate(active_sources, 1):
+                parts.append(
+                    f"{i}. **{source['name']}**\n"
+                    f"   📊 Надежность: {source['reliability']}%\n"
+                    f"   🔒 Авторизация: {'Требуется' if source['requires_auth'] else 'Не требуется'}\n"
+                    f"   📝 {source['description']}\n\n"
+                )
             
-            # Предлагаем перезапуск для проблемных источников
-            for source_key, source in self.data_sources.sources.items():
-                if source["status"] in ["blocked", "error", "unreachable"]:
-                    keyboard = self.data_sources.get_restart_keyboard(source_key)
-                    restart_message = f"🔄 Перезапустить {source['name']}?"
-                    await self.send_message_with_keyboard(chat_id, restart_message, keyboard)
+            parts.append("💡 Используйте /reconnect_stats для общей статистики")
+            message = "".join(parts)
+        else:
+            message = "❌ Библиотека источников недоступна"
             
-        elif command.startswith("/subscribe"):
-            if user_id in self.subscribers:
-                await self.send_message(chat_id, "✅ Вы уже подписаны на уведомления")
-            else:
-                self.subscribers.add(user_id)
-                await self.send_message(chat_id, "🔔 Вы успешно подписались на уведомления!")
-                
-        elif command.startswith("/unsubscribe"):
-            if user_id in self.subscribers:
-                self.subscribers.remove(user_id)
-                await self.send_message(chat_id, "🔕 Вы отписались от уведомлений")
-            else:
-                await self.send_message(chat_id, "❌ Вы не были подписаны на уведомления")
-                
-        elif command.startswith("/activate_sub"):
-            # Активация подписки по username (только для админов)
-            if user_id != self.monitoring_controller.get_admin_user_id():
-                await self.send_message(chat_id, "🤖 Неизвестная команда. Используйте /help для справки.")
-                return
+        await self.send_message(chat_id, message)
+    
+    async def _cmd_settings(self, chat_id: int, command: str, user_id: int):
+        """Команда /settings"""
+        settings_summary = self.user_settings.get_settings_summary(user_id)
+        keyboard = self.user_settings.get_settings_keyboard(user_id)
+        await self.send_message_with_keyboard(chat_id, settings_summary, keyboard)
+    
+    async def _cmd_menu(self, chat_id: int, command: str, user_id: int):
+        """Команда /menu"""
+        await self.send_message_with_keyboard(chat_id, MENU_TEXT, MENU_KEYBOARD)
+    
+    async def _cmd_check_sources(self, chat_id: int, command: str, user_id: int):
+        """Команда /check_sources"""
+        # АДМИН команда - проверяем, является ли пользователь администратором
+        if user_id != self.monitoring_controller.get_admin_user_id():
+            await self.send_message(chat_id, "🤖 Неизвестная команда. Используйте /help для справки.")
+            return
             
-            # Парсим команду: /activate_sub USERNAME МЕСЯЦЫ [КОММЕНТАРИЙ]
-            parts = command.split()
-            if len(parts) < 3:
-                await self.send_message(chat_id, """❌ Неправильный формат команды
+        await self.send_message(chat_id, "🔍 Проверяю источники данных...")
+        
+        # Проверяем все источники
+        await self.data_sources.check_all_sources()
+        
+        # Отправляем сводку
+        summary = self.data_sources.get_status_summary()
+        await self.send_message(chat_id, summary)
+        
+        # Предлагаем перезапуск для проблемных источников
+        for source_key, source in self.data_sources.sources.items():
+            if source["status"] in ["blocked", "error", "unreachable"]:
+                keyboard = self.data_sources.get_restart_keyboard(source_key)
+                restart_message = f"🔄 Перезапустить {source['name']}?"
+                await self.send_message_with_keyboard(chat_id, restart_message, keyboard)
+    
+    async def _cmd_subscribe(self, chat_id: int, command: str, user_id: int):
+        """Команда /subscribe"""
+        if user_id in self.subscribers:
+            await self.send_message(chat_id, "✅ Вы уже подписаны на уведомления", plain=True)
+        else:
+            await self._add_subscriber(user_id)
+            await self.send_message(chat_id, "🔔 Вы успешно подписались на уведомления!", plain=True)
+    
+    async def _cmd_unsubscribe(self, chat_id: int, command: str, user_id: int):
+        """Команда /unsubscribe"""
+        if user_id in self.subscribers:
+            await self._remove_subscribers([user_id])
+            await self.send_message(chat_id, "🔕 Вы отписались от уведомлений", plain=True)
+        else:
+            await self.send_message(chat_id, "❌ Вы не были подписаны на уведомления", plain=True)
+    
+    async def _cmd_activate_sub(self, chat_id: int, command: str, user_id: int):
+        """Команда /activate_sub"""
+        # Активация подписки по username (только для админов)
+        if user_id != self.monitoring_controller.get_admin_user_id():
+            await self.send_message(chat_id, "🤖 Неизвестная команда. Используйте /help для справки.")
+            return
+        
+        # Парсим команду: /activate_sub USERNAME МЕСЯЦЫ [КОММЕНТАРИЙ]
+        parts = command.split()
+        if len(parts) < 3:
+            await self.send_message(chat_id, """❌ Неправильный формат команды
 
 **Правильный формат:**
 /activate_sub USERNAME МЕСЯЦЫ [КОММЕНТАРИЙ]
@@ -635,37 +1147,38 @@ class SimpleTelegramBot:
 • /activate_sub ildaryakupovv 1
 • /activate_sub john_doe 12 VIP клиент
 • /activate_sub user123 3 Промо акция""")
-                return
+            return
+        
+        username = parts[1]
+        try:
+            duration_months = int(parts[2])
+            comment = " ".join(parts[3:]) if len(parts) > 3 else ""
             
-            username = parts[1]
-            try:
-                duration_months = int(parts[2])
-                comment = " ".join(parts[3:]) if len(parts) > 3 else ""
-                
-                # Получаем информацию об админе  
-                admin_username = "admin"  # Заглушка, можно доработать
-                
-                success, message = await subscription_manager.activate_subscription_by_username(
-                    username, duration_months, user_id, admin_username, comment
-                )
-                
-                await self.send_message(chat_id, message)
-                
-            except ValueError:
-                await self.send_message(chat_id, "❌ Количество месяцев должно быть числом")
-            except Exception as e:
-                await self.send_message(chat_id, f"❌ Ошибка: {e}")
-                
-        elif command.startswith("/deactivate_sub"):
-            # Деактивация подписки по username (только для админов)  
-            if user_id != self.monitoring_controller.get_admin_user_id():
-                await self.send_message(chat_id, "🤖 Неизвестная команда. Используйте /help для справки.")
-                return
+            # Получаем информацию об админе  
+            admin_username = "admin"  # Заглушка, можно доработать
+            
+            success, message = await subscription_manager.activate_subscription_by_username(
+                username, duration_months, user_id, admin_username, comment
+            )
             
-            # Парсим команду: /deactivate_sub USERNAME [КОММЕНТАРИЙ]
-            parts = command.split()
-            if len(parts) < 2:
-                await self.send_message(chat_id, """❌ Неправильный формат команды
+            await self.send_message(chat_id, message)
+            
+        except ValueError:
+            await self.send_message(chat_id, "❌ Количество месяцев должно быть числом")
+        except Exception as e:
+            await self.send_message(chat_id, f"❌ Ошибка: {e}")
+    
+    async def _cmd_deactivate_sub(self, chat_id: int, command: str, user_id: int):
+        """Команда /deactivate_sub"""
+        # Деактивация подписки по username (только для админов)  
+        if user_id != self.monitoring_controller.get_admin_user_id():
+            await self.send_message(chat_id, "🤖 Неизвестная команда. Используйте /help для справки.")
+            return
+        
+        # Парсим команду: /deactivate_sub USERNAME [КОММЕНТАРИЙ]
+        parts = command.split()
+        if len(parts) < 2:
+            await self.send_message(chat_id, """❌ Неправильный формат команды
 
 **Правильный формат:**
 /deactivate_sub USERNAME [КОММЕНТАРИЙ]
@@ -674,80 +1187,83 @@ class SimpleTelegramBot:
 • /deactivate_sub spammer
 • /deactivate_sub violator за нарушение правил
 • /deactivate_sub inactive неактивность""")
+            return
+        
+        username = parts[1]
+        comment = " ".join(parts[2:]) if len(parts) > 2 else ""
+        
+        try:
+            # Получаем информацию об админе
+            admin_username = "admin"  # Заглушка, можно доработать
+            
+            success, message = await subscription_manager.deactivate_subscription_by_username(
+                username, user_id, admin_username, comment
+            )
+            
+            await self.send_message(chat_id, message)
+            
+        except Exception as e:
+            await self.send_message(chat_id, f"❌ Ошибка: {e}")
+    
+    async def _cmd_sub_history(self, chat_id: int, command: str, user_id: int):
+        """Команда /sub_history"""
+        # История операций с подписками (только для админов)
+        if user_id != self.monitoring_controller.get_admin_user_id():
+            await self.send_message(chat_id, "🤖 Неизвестная команда. Используйте /help для справки.")
+            return
+        
+        try:
+            history = await db.get_subscription_history(15)
+            
+            if not history:
+                await self.send_message(chat_id, "📄 История операций пуста")
                 return
             
-            username = parts[1]
-            comment = " ".join(parts[2:]) if len(parts) > 2 else ""
+            parts = ["📋 **ИСТОРИЯ ОПЕРАЦИЙ С ПОДПИСКАМИ**\n\n"]
             
-            try:
-                # Получаем информацию об админе
-                admin_username = "admin"  # Заглушка, можно доработать
+            for record in history:
+                action_emoji = "✅" if record['action'] == 'activate' else "❌"
+                duration_text = f" на {record['duration_months']} мес." if record['duration_months'] else ""
+                comment_text = f" ({record['comment']})" if record['comment'] else ""
                 
-                success, message = await subscription_manager.deactivate_subscription_by_username(
-                    username, user_id, admin_username, comment
+                parts.append(
+                    f"{action_emoji} **@{record['username']}**{duration_text}\n"
+                    f"👤 Админ: @{record['admin_username']}\n"
+                    f"📅 {record['created_at'].strftime('%d.%m.%Y %H:%M')}{comment_text}\n\n"
                 )
-                
-                await self.send_message(chat_id, message)
-                
-            except Exception as e:
-                await self.send_message(chat_id, f"❌ Ошибка: {e}")
-
-        elif command.startswith("/sub_history"):
-            # История операций с подписками (только для админов)
-            if user_id != self.monitoring_controller.get_admin_user_id():
-                await self.send_message(chat_id, "🤖 Неизвестная команда. Используйте /help для справки.")
-                return
             
-            try:
-                history = await db.get_subscription_history(15)
-                
-                if not history:
-                    await self.send_message(chat_id, "📄 История операций пуста")
-                    return
-                
-                history_text = "📋 **ИСТОРИЯ ОПЕРАЦИЙ С ПОДПИСКАМИ**\n\n"
-                
-                for record in history:
-                    action_emoji = "✅" if record['action'] == 'activate' else "❌"
-                    duration_text = f" на {record['duration_months']} мес." if record['duration_months'] else ""
-                    comment_text = f" ({record['comment']})" if record['comment'] else ""
-                    
-                    history_text += f"{action_emoji} **@{record['username']}**{duration_text}\n"
-                    history_text += f"👤 Админ: @{record['admin_username']}\n"
-                    history_text += f"📅 {record['created_at'].strftime('%d.%m.%Y %H:%M')}{comment_text}\n\n"
-                
-                await self.send_message(chat_id, history_text)
-                
-            except Exception as e:
-                await self.send_message(chat_id, f"❌ Ошибка получения истории: {e}")
-                
-        elif command.startswith("/subscription_status"):
-            # Проверить статус подписки
-            try:
-                is_active = await subscription_manager.is_subscription_active(user_id)
-                is_trial = await subscription_manager.is_trial_active(user_id)
-                
-                if is_active:
-                    remaining_time = await subscription_manager.get_remaining_subscription_time_formatted(user_id)
-                    status_message = f"💎 **Подписка активна** - осталось {remaining_time}\n\n✅ Безлимитные сигналы арбитража"
-                elif is_trial:
-                    remaining_time = await subscription_manager.get_remaining_trial_time_formatted(user_id)
-                    status_message = f"🆓 **Пробный период активен** - осталось {remaining_time}\n\n💡 Затем потребуется подписка за 10 USDT/месяц"
-                else:
-                    status_message = "⏰ **Пробный период истек**\n\n💎 Оформите подписку для получения сигналов"
-                
-                await self.send_message(chat_id, status_message)
-                
-            except Exception as e:
-                await self.send_message(chat_id, f"❌ Ошибка проверки статуса: {e}")
-                
-        elif command.startswith("/admin"):
-            # АДМИН КОМАНДЫ - только для администратора
-            if user_id != self.monitoring_controller.get_admin_user_id():
-                await self.send_message(chat_id, "🤖 Неизвестная команда. Используйте /help для справки.")
-                return
-                
-            admin_help = """👑 **ПАНЕЛЬ АДМИНИСТРАТОРА**
+            await self.send_message(chat_id, "".join(parts))
+            
+        except Exception as e:
+            await self.send_message(chat_id, f"❌ Ошибка получения истории: {e}")
+    
+    async def _cmd_subscription_status(self, chat_id: int, command: str, user_id: int):
+        """Команда /subscription_status"""
+        # Проверить статус подписки
+        try:
+            is_active = await subscription_manager.is_subscription_active(user_id)
+            is_trial = await subscription_manager.is_trial_active(user_id)
+            
+            remaining_time = ""
+            if is_active:
+                remaining_time = await subscription_manager.get_remaining_subscription_time_formatted(user_id)
+            elif is_trial:
+                remaining_time = await subscription_manager.get_remaining_trial_time_formatted(user_id)
+            status_message = subscription_manager.get_status_message(is_active, is_trial, remaining_time)
+            
+            await self.send_message(chat_id, status_message)
+            
+        except Exception as e:
+            await self.send_message(chat_id, f"❌ Ошибка проверки статуса: {e}")
+    
+    async def _cmd_admin(self, chat_id: int, command: str, user_id: int):
+        """Команда /admin"""
+        # АДМИН КОМАНДЫ - только для администратора
+        if user_id != self.monitoring_controller.get_admin_user_id():
+            await self.send_message(chat_id, "🤖 Неизвестная команда. Используйте /help для справки.")
+            return
+            
+        admin_help = """👑 **ПАНЕЛЬ АДМИНИСТРАТОРА**
 
 🔧 **Управление подписками:**
 • /activate_sub USERNAME МЕСЯЦЫ [КОММЕНТАРИЙ] - активировать подписку
@@ -770,22 +1286,16 @@ class SimpleTelegramBot:
 🎯 **Важно:** Используйте USERNAME без @, например: ildaryakupovv
 
 🔒 **Безопасность:** Только вы можете использовать эти команды."""
-            
-            active_users = self.monitoring_controller.get_active_users_count()
-            subscribers_count = len(self.subscribers)
-            
-            formatted_help = admin_help.format(
-                active_users=active_users,
-                subscribers=subscribers_count
-            )
-            
-            await self.send_message(chat_id, formatted_help)
-        # Обработка сообщений поддержки
-        elif not command.startswith("/") and user_id not in self.subscribers:
-            # Если это сообщение поддержки (не команда и пользователь не подписан)
-            await self.handle_support_message(chat_id, user_id, command)
-        else:
-            await self.send_message(chat_id, "🤖 Неизвестная команда. Используйте /help для справки.")
+        
+        active_users = self.monitoring_controller.get_active_users_count()
+        subscribers_count = len(self.subscribers)
+        
+        formatted_help = admin_help.format(
+            active_users=active_users,
+            subscribers=subscribers_count
+        )
+        
+        await self.send_message(chat_id, formatted_help)
             
     async def handle_callback_query(self, callback_query: Dict):
         """Обработка callback query от inline-клавиатур"""
@@ -794,8 +1304,17 @@ class SimpleTelegramBot:
         chat_id = callback_query["message"]["chat"]["id"]
         callback_query_id = callback_query["id"]
         
+        # Кнопки-команды находим одним поиском в таблице, не проходя цепочку условий
+        proxied = CALLBACK_COMMANDS.get(callback_data)
+        if proxied:
+            command, answer_text = proxied
+            await self.handle_command(chat_id, command, user_id)
+            await self.answer_callback_query(callback_query_id, answer_text)
+            return
+        
         if callback_data == "start_when_open":
             self.monitoring_controller.add_pending_market_open_user(user_id)
+            self._monitoring_wakeup.set()
             await self.answer_callback_query(callback_query_id, "Мониторинг запустится при открытии биржи")
             await self.send_message(chat_id, "✅ Отлично! Мониторинг автоматически запустится когда откроется биржа")
             
@@ -833,32 +1352,7 @@ class SimpleTelegramBot:
         # Обработка настроек пользователя
         elif callback_data == "settings_back":
             # Возвращаемся к главному меню
-            welcome_text = """🤖 *MOEX Arbitrage Bot - Главное меню*
-
-🎯 *Быстрое управление ботом:*"""
-            
-            main_menu_keyboard = {
-                "inline_keyboard": [
-                    [
-                        {"text": "🟢 Запустить мониторинг", "callback_data": "cmd_start_monitoring"},
-                        {"text": "🔴 Остановить мониторинг", "callback_data": "cmd_stop_monitoring"}
-                    ],
-                    [
-                        {"text": "⚙️ Настройки", "callback_data": "cmd_settings"},
-                        {"text": "📊 Статус", "callback_data": "cmd_status"}
-                    ],
-                    [
-                        {"text": "📈 История", "callback_data": "cmd_history"},
-                        {"text": "🕒 Расписание", "callback_data": "cmd_schedule"}
-                    ],
-                    [
-                        {"text": "🎯 Демо", "callback_data": "cmd_demo"},
-                        {"text": "🆘 Поддержка", "callback_data": "cmd_support"}
-                    ]
-                ]
-            }
-            
-            await self.edit_message_text(chat_id, callback_query["message"]["message_id"], welcome_text, main_menu_keyboard)
+            await self.edit_message_text(chat_id, callback_query["message"]["message_id"], MENU_TEXT, MENU_KEYBOARD)
             await self.answer_callback_query(callback_query_id, "Главное меню")
             
         elif callback_data == "settings_interval":
@@ -927,6 +1421,8 @@ class SimpleTelegramBot:
         elif callback_data.startswith("spread_"):
             spread = float(callback_data.replace("spread_", ""))
             if self.user_settings.update_spread_threshold(user_id, spread):
+                if self._threshold_cache is not None and user_id in self._threshold_cache:
+                    self._threshold_cache[user_id] = spread
                 settings = self.user_settings.get_user_settings(user_id)
                 await self.answer_callback_query(callback_query_id, f"Спред: {settings.get_spread_display()}")
                 
@@ -1109,35 +1605,7 @@ class SimpleTelegramBot:
                 
         # Обработка команд через кнопки
         elif callback_data == "show_main_menu":
-            welcome_text = """🤖 *MOEX Arbitrage Bot - Главное меню*
-
-🎯 *Быстрое управление ботом:*"""
-            
-            main_menu_keyboard = {
-                "inline_keyboard": [
-                    [
-                        {"text": "🟢 Запустить мониторинг", "callback_data": "cmd_start_monitoring"},
-                        {"text": "🔴 Остановить мониторинг", "callback_data": "cmd_stop_monitoring"}
-                    ],
-                    [
-                        {"text": "⚙️ Настройки", "callback_data": "cmd_settings"},
-                        {"text": "📊 Статус", "callback_data": "cmd_status"}
-                    ],
-                    [
-                        {"text": "📈 История", "callback_data": "cmd_history"},
-                        {"text": "🕒 Расписание", "callback_data": "cmd_schedule"}
-                    ],
-                    [
-                        {"text": "🎯 Демо", "callback_data": "cmd_demo"},
-                        {"text": "🆘 Поддержка", "callback_data": "cmd_support"}
-                    ],
-                    [
-                        {"text": "💎 Подписка", "callback_data": "cmd_subscription"}
-                    ]
-                ]
-            }
-            
-            await self.send_message_with_keyboard(chat_id, welcome_text, main_menu_keyboard)
+            await self.send_message_with_keyboard(chat_id, MENU_TEXT, MENU_WITH_SUBSCRIPTION_KEYBOARD)
             await self.answer_callback_query(callback_query_id, "Главное меню")
             
         elif callback_data == "cmd_settings":
@@ -1146,77 +1614,18 @@ class SimpleTelegramBot:
             await self.send_message_with_keyboard(chat_id, settings_summary, keyboard)
             await self.answer_callback_query(callback_query_id, "Настройки")
             
-        elif callback_data == "cmd_start_monitoring":
-            await self.handle_command(chat_id, "/start_monitoring", user_id)
-            await self.answer_callback_query(callback_query_id, "Запуск мониторинга")
-            
-        elif callback_data == "cmd_stop_monitoring":
-            await self.handle_command(chat_id, "/stop_monitoring", user_id)
-            await self.answer_callback_query(callback_query_id, "Остановка мониторинга")
-            
-        elif callback_data == "cmd_status":
-            await self.handle_command(chat_id, "/status", user_id)
-            await self.answer_callback_query(callback_query_id, "Статус")
-            
-        elif callback_data == "cmd_history":
-            await self.handle_command(chat_id, "/history", user_id)
-            await self.answer_callback_query(callback_query_id, "История")
-            
-        elif callback_data == "cmd_schedule":
-            await self.handle_command(chat_id, "/schedule", user_id)
-            await self.answer_callback_query(callback_query_id, "Расписание")
-            
-        elif callback_data == "cmd_demo":
-            await self.handle_command(chat_id, "/demo", user_id)
-            await self.answer_callback_query(callback_query_id, "Демо")
-            
-        elif callback_data == "cmd_support":
-            await self.handle_command(chat_id, "/support", user_id)
-            await self.answer_callback_query(callback_query_id, "Поддержка")
-            
         elif callback_data == "cmd_subscription":
             try:
                 is_active = await subscription_manager.is_subscription_active(user_id)
                 is_trial = await subscription_manager.is_trial_active(user_id)
                 
                 if is_active:
-                    subscription_text = """💎 **Премиум подписка**
-
-✅ **Статус:** Активна
-🚀 **Сигналы:** Безлимитно
-⭐ **Приоритет:** Высокий
-🎯 **Поддержка:** Персональная
-
-Вы получаете максимум возможностей бота!"""
+                    subscription_text = subscription_manager.SUBSCRIPTION_ACTIVE_TEXT
                 elif is_trial:
                     remaining_days = await subscription_manager.get_remaining_trial_days(user_id)
-                    subscription_text = f"""🆓 **Пробный период активен**
-
-📅 **Осталось дней:** {remaining_days}/7
-🚀 **Сигналы:** Безлимитно до окончания
-⚠️ **После окончания:** Потребуется подписка
-
-💎 **Премиум подписка:**
-• Безлимитные сигналы навсегда
-• Приоритетная поддержка
-• Расширенная аналитика
-• Персональные настройки
-
-💰 **Стоимость:** 10 USDT/месяц"""
+                    subscription_text = subscription_manager.get_trial_info_message(remaining_days)
                 else:
-                    subscription_text = """⏰ **Пробный период истек**
-
-❌ **Статус:** Доступ ограничен
-🚫 **Сигналы:** Недоступны
-💡 **Решение:** Оформить подписку
-
-💎 **Премиум подписка:**
-• Безлимитные сигналы арбитража
-• Приоритетный доступ к новым возможностям
-• Расширенная аналитика и статистика
-• Персональная поддержка 24/7
-
-💰 **Стоимость:** 10 USDT/месяц"""
+                    subscription_text = subscription_manager.SUBSCRIPTION_EXPIRED_TEXT
 
                 keyboard = {
                     "inline_keyboard": []
@@ -1578,7 +1987,7 @@ class SimpleTelegramBot:
             await self.send_message(admin_id, support_notification)
             
         # Подтверждаем получение пользователю
-        await self.send_message(chat_id, "📩 Ваше сообщение отправлено в техподдержку. Мы ответим в ближайшее время!")
+        await self.send_message(chat_id, "📩 Ваше сообщение отправлено в техподдержку. Мы ответим в ближайшее время!", plain=True)
         
     async def notify_admin_error(self, error_message: str):
         """Уведомление администратора об ошибке"""
@@ -1588,68 +1997,193 @@ class SimpleTelegramBot:
 
 ⚠️ {error_message}
 
-⏰ Время: {datetime.now().strftime('%H:%M:%S %d.%m.%Y')}"""
+⏰ Время: {_now_str()}"""
             await self.send_message(admin_id, error_notification)
     
-    async def send_arbitrage_signal(self, signal, target_users=None):
-        """Отправка арбитражного сигнала подписчикам"""
+    async def broadcast(self, text: str, user_ids=None, parse_mode: Optional[str] = None) -> int:
+        """Параллельная рассылка сообщения (по умолчанию - всем подписчикам), возвращает число доставленных
+        
+        Одновременных отправок не больше 25, лимиты Telegram соблюдает _throttle.
+        """
+        if user_ids is None:
+            user_ids = self._subs_snapshot
+        
+        async def send_one(user_id: int) -> bool:
+            async with self._broadcast_semaphore:
+                return await self.send_message(user_id, text, parse_mode)
+        
+        results = await asyncio.gather(*(send_one(user_id) for user_id in user_ids), return_exceptions=True)
+        return sum(1 for result in results if result is True)
+    
+    def _format_signal(self, signal) -> str:
+        """Текст арбитражного сигнала (Markdown)"""
+        # Тикеры приходят из внешних источников - экранируем их для Markdown,
+        # иначе "_" или "*" в тикере приведет к отказу Telegram разобрать сообщение
+        stock_ticker = signal.stock_ticker.translate(_MD_ESCAPE)
+        futures_ticker = signal.futures_ticker.translate(_MD_ESCAPE)
+        
         if signal.action == "OPEN":
-            emoji = "🟢🟢" if signal.urgency_level == 3 else "🟢" if signal.urgency_level == 2 else "📈"
-            
-            message = f"{emoji} *АРБИТРАЖ СИГНАЛ*\n\n"
-            message += f"🎯 *{signal.stock_ticker}/{signal.futures_ticker}*\n"
-            message += f"📊 Спред: *{signal.spread_percent:.2f}%*\n\n"
-            message += f"💼 *Позиции:*\n"
+            emoji = URGENCY_EMOJI.get(signal.urgency_level, "📈")
             # Эмодзи для позиций
             stock_emoji = "🟢⬆️" if signal.stock_position == "BUY" else "🔴⬇️"
             futures_emoji = "🟢⬆️" if signal.futures_position == "BUY" else "🔴⬇️"
             
-            message += f"📈 Акции {signal.stock_ticker}: *{signal.stock_position}* {stock_emoji}\n"
-            message += f"📊 Фьючерс {signal.futures_ticker}: *{signal.futures_position}* {futures_emoji}\n\n"
-            message += f"💰 *Цены:*\n"
-            message += f"📈 {signal.stock_ticker}: {signal.stock_price:.2f} ₽\n"
-            message += f"📊 {signal.futures_ticker}: {signal.futures_price:.2f} ₽\n\n"
-            
-
-            
-            message += f"⏰ Время: {signal.timestamp}"
+            message = "\n".join((
+                f"{emoji} *АРБИТРАЖ СИГНАЛ*",
+                "",
+                f"🎯 *{stock_ticker}/{futures_ticker}*",
+                f"📊 Спред: *{signal.spread_percent:.2f}%*",
+                "",
+                "💼 *Позиции:*",
+                f"📈 Акции {stock_ticker}: *{signal.stock_position}* {stock_emoji}",
+                f"📊 Фьючерс {futures_ticker}: *{signal.futures_position}* {futures_emoji}",
+                "",
+                "💰 *Цены:*",
+                f"📈 {stock_ticker}: {signal.stock_price:.2f} ₽",
+                f"📊 {futures_ticker}: {signal.futures_price:.2f} ₽",
+                "",
+                f"⏰ Время: {signal.timestamp}",
+            ))
             
         else:  # CLOSE
-            message = "🔄 *СИГНАЛ НА ЗАКРЫТИЕ*\n\n"
-            message += f"👋 Дружище, пора закрывать позицию по *{signal.stock_ticker}/{signal.futures_ticker}*!\n\n"
-            message += f"📉 Спред снизился до: *{signal.spread_percent:.2f}%*\n\n"
-            message += f"⏰ Время: {signal.timestamp}"
+            message = "\n".join((
+                "🔄 *СИГНАЛ НА ЗАКРЫТИЕ*",
+                "",
+                f"👋 Дружище, пора закрывать позицию по *{stock_ticker}/{futures_ticker}*!",
+                "",
+                f"📉 Спред снизился до: *{signal.spread_percent:.2f}%*",
+                "",
+                f"⏰ Время: {signal.timestamp}",
+            ))
+        return message
+    
+    async def send_arbitrage_signal(self, signal, target_users=None):
+        """Отправка арбитражного сигнала подписчикам"""
+        message = self._format_signal(signal)
         
-        # Если target_users не указан, используем всех подписчиков с фильтрацией
+        # Если target_users не указан, используем всех подписчиков с фильтрацией по их порогу спреда
         if target_users is None:
-            target_users = []
-            for subscriber_id in self.subscribers.copy():
-                user_settings = self.user_settings.get_user_settings(subscriber_id)
-                # Проверяем порог спреда пользователя
-                if signal.spread_percent >= user_settings.spread_threshold:
-                    target_users.append(subscriber_id)
-        
-        # Отправляем указанным пользователям с проверкой лимитов
+            spread = signal.spread_percent
+            target_users = [
+                subscriber_id for subscriber_id, threshold in self._subscriber_thresholds().items()
+                if spread >= threshold
+            ]
+        
+        await self._broadcast_signal(list(target_users), json_dumps(message))
+    
+    async def send_signal_digest(self, filtered_signals: List[tuple]):
+        """Отправка сигналов цикла сводкой: одно сообщение на подписчика вместо сообщения на сигнал"""
+        # Подписчики с одинаковым набором сигналов получают одно и то же сообщение
+        per_user: Dict[int, List[int]] = {}
+        for index, (signal, users) in enumerate(filtered_signals):
+            for user_id in users:
+                per_user.setdefault(user_id, []).append(index)
+        digests: Dict[tuple, List[int]] = {}
+        for user_id, indexes in per_user.items():
+            digests.setdefault(tuple(indexes), []).append(user_id)
+        
+        texts = [self._format_signal(signal) for signal, _ in filtered_signals]
+        await asyncio.gather(*(
+            self._broadcast_signal(
+                users,
+                json_dumps(SIGNAL_DIGEST_SEPARATOR.join(texts[index] for index in indexes)),
+                len(indexes)
+            )
+            for indexes, users in digests.items()
+        ))
+    
+    async def _broadcast_signal(self, target_users: List[int], message_json: bytes, signal_count: int = 1):
+        """Параллельная отправка готового сообщения с проверкой лимитов и удалением неактивных подписчиков"""
+        results = await asyncio.gather(
+            *(self._deliver_signal(subscriber_id, message_json, signal_count) for subscriber_id in target_users),
+            return_exceptions=True
+        )
+        
+        # Удаляем неактивных подписчиков (снимок перестраивается один раз)
         failed_subscribers = []
-        for subscriber_id in target_users:
-            # Проверяем лимит сигналов перед отправкой
-            can_send = await subscription_manager.check_signal_limit(subscriber_id)
-            
+        for subscriber_id, result in zip(target_users, results):
+            if isinstance(result, Exception):
+                logger.error(f"Ошибка отправки сигнала пользователю {subscriber_id}: {result}")
+                failed_subscribers.append(subscriber_id)
+            elif result is False:
+                failed_subscribers.append(subscriber_id)
+        if failed_subscribers:
+            await self._remove_subscribers(failed_subscribers)
+    
+    def _subscriber_thresholds(self) -> Dict[int, float]:
+        """Пороги спреда всех подписчиков (кешируются до изменения подписок или порогов)"""
+        if self._threshold_cache is None:
+            get_settings = self.user_settings.get_user_settings
+            self._threshold_cache = {
+                subscriber_id: get_settings(subscriber_id).spread_threshold
+                for subscriber_id in self._subs_snapshot
+            }
+        return self._threshold_cache
+    
+    async def _add_subscriber(self, user_id: int):
+        """Подписать пользователя на уведомления"""
+        async with self._subscribers_lock:
+            self.subscribers.add(user_id)
+            self._subs_snapshot = tuple(self.subscribers)
+            self._threshold_cache = None
+            self._pending_subscriptions[user_id] = True
+            self._ensure_subscribers_flush_task()
+    
+    async def _remove_subscribers(self, user_ids: List[int]):
+        """Отписать пользователей от уведомлений"""
+        async with self._subscribers_lock:
+            self.subscribers.difference_update(user_ids)
+            self._subs_snapshot = tuple(self.subscribers)
+            self._threshold_cache = None
+            for user_id in user_ids:
+                self._pending_subscriptions[user_id] = False
+            self._ensure_subscribers_flush_task()
+    
+    async def _flush_subscribers(self):
+        """Записать накопленные изменения подписок в базу (не больше двух запросов)"""
+        if not self._pending_subscriptions:
+            return
+        pending, self._pending_subscriptions = self._pending_subscriptions, {}
+        for subscribed in (True, False):
+            user_ids = [user_id for user_id, value in pending.items() if value is subscribed]
+            if user_ids and not await db.set_subscribed(user_ids, subscribed):
+                # Запись не удалась - возвращаем изменения в журнал, если их не перекрыли новые
+                for user_id in user_ids:
+                    self._pending_subscriptions.setdefault(user_id, subscribed)
+    
+    def _ensure_subscribers_flush_task(self):
+        """Запустить фоновую запись журнала подписок, если она еще не запущена"""
+        if self._subscribers_flush_task is None or self._subscribers_flush_task.done():
+            self._subscribers_flush_task = asyncio.create_task(self._subscribers_flush_loop())
+    
+    async def _subscribers_flush_loop(self):
+        """Фоновая запись журнала подписок раз в SUBSCRIBERS_FLUSH_INTERVAL секунд, пока он не опустеет"""
+        while True:
+            await asyncio.sleep(SUBSCRIBERS_FLUSH_INTERVAL)
+            try:
+                await self._flush_subscribers()
+            except Exception as e:
+                logger.error(f"Ошибка записи подписок на уведомления: {e}")
+            if not self._pending_subscriptions:
+                return
+    
+    async def _deliver_signal(self, subscriber_id: int, message_json: bytes, signal_count: int = 1) -> Optional[bool]:
+        """Отправка сигнала одному подписчику (None - вместо сигнала отправлено предложение подписки)"""
+        # Проверяем лимит сигналов перед отправкой
+        can_send = await subscription_manager.check_signal_limit(subscriber_id)
+        
+        async with self._broadcast_semaphore:
             if not can_send:
                 # Лимит исчерпан - отправляем предложение подписки
                 await self._send_subscription_offer(subscriber_id)
-                continue
+                return None
             
-            success = await self.send_message(subscriber_id, message)
-            if success:
-                # Увеличиваем счетчик отправленных сигналов
+            success = await self.send_prepared_message(subscriber_id, message_json)
+        if success:
+            # Увеличиваем счетчик отправленных сигналов (сводка засчитывается за каждый сигнал в ней)
+            for _ in range(signal_count):
                 await subscription_manager.increment_signal_count(subscriber_id)
-            else:
-                failed_subscribers.append(subscriber_id)
-        
-        # Удаляем неактивных подписчиков
-        for failed_id in failed_subscribers:
-            self.subscribers.discard(failed_id)
+        return success
     
     async def monitoring_cycle_for_interval(self, interval_seconds: int, target_users: List[int]):
         """Цикл мониторинга для конкретного интервала"""
@@ -1671,17 +2205,22 @@ class SimpleTelegramBot:
                         await asyncio.sleep(pause_seconds)
                         return  # Выходим из этого цикла мониторинга
             
-            # Получаем персональные инструменты всех пользователей для этого интервала
+            # Получаем персональные инструменты и пороги всех пользователей для этого интервала (один раз за цикл)
             all_user_instruments = {}
+            user_filters = []
             for user_id in target_users:
                 user_instruments = self.user_settings.get_user_instruments_dict(user_id, self.config.MONITORED_INSTRUMENTS)
                 all_user_instruments.update(user_instruments)
+                user_filters.append((
+                    user_id,
+                    user_instruments,
+                    self.user_settings.get_user_settings(user_id).spread_threshold
+                ))
             
             # Получаем котировки только для инструментов, выбранных пользователями
             instruments_to_monitor = all_user_instruments if all_user_instruments else self.config.MONITORED_INSTRUMENTS
             
-            async with MOEXAPIClient() as moex_client:
-                quotes = await moex_client.get_multiple_quotes(instruments_to_monitor)
+            quotes = await self.moex_client.get_multiple_quotes(instruments_to_monitor)
             
             if not quotes:
                 logger.warning("Не удалось получить котировки")
@@ -1694,15 +2233,25 @@ class SimpleTelegramBot:
             current_time = moscow_time.strftime("%H:%M:%S")
             signals = []
             
+            # Минимальный порог спреда от всех активных пользователей не зависит от котировки
+            min_threshold = self._get_minimum_spread_threshold(target_users)
+            analyze = self.calculator.analyze_arbitrage_opportunity
+            below_threshold = self.calculator.below_threshold
+            get_futures_ticker = instruments_to_monitor.get
+            
             for stock_ticker, (stock_price, futures_price) in quotes.items():
                 if stock_price is None or futures_price is None:
                     continue
                 
-                futures_ticker = instruments_to_monitor[stock_ticker]
-                # Получаем минимальный порог спреда от всех активных пользователей
-                min_threshold = self._get_minimum_spread_threshold(target_users)
+                futures_ticker = get_futures_ticker(stock_ticker)
+                if futures_ticker is None:
+                    continue
+                
+                # Быстрый отсев: спред ниже порога - анализатор все равно вернет None
+                if below_threshold(stock_ticker, futures_ticker, stock_price, futures_price, min_threshold):
+                    continue
                 
-                signal = self.calculator.analyze_arbitrage_opportunity(
+                signal = analyze(
                     stock_ticker=stock_ticker,
                     futures_ticker=futures_ticker,
                     stock_price=stock_price,
@@ -1732,31 +2281,48 @@ class SimpleTelegramBot:
                 # Фильтруем пользователей по их персональным настройкам спреда
                 filtered_signals = []
                 for signal in signals:
-                    filtered_users = []
-                    for user_id in target_users:
-                        user_settings = self.user_settings.get_user_settings(user_id)
-                        user_instruments = self.user_settings.get_user_instruments_dict(user_id, self.config.MONITORED_INSTRUMENTS)
-                        
-                        # Проверяем что пользователь выбрал этот инструмент и спред превышает его порог
-                        if (signal.stock_ticker in user_instruments and 
-                            signal.spread_percent >= user_settings.spread_threshold):
-                            filtered_users.append(user_id)
+                    # Проверяем что пользователь выбрал этот инструмент и спред превышает его порог
+                    filtered_users = [
+                        user_id for user_id, user_instruments, spread_threshold in user_filters
+                        if signal.stock_ticker in user_instruments and signal.spread_percent >= spread_threshold
+                    ]
                     
                     if filtered_users:
                         filtered_signals.append((signal, filtered_users))
                 
-                # Добавляем отфильтрованные сигналы в очередь
+                # Рассылаем отфильтрованные сигналы в фоне: цикл не ждет окончания отправки
                 if filtered_signals:
-                    for signal, users in filtered_signals[:5]:  # Максимум 5 сигналов
-                        await self.send_arbitrage_signal(signal, users)
-                        if len(filtered_signals) > 1:
-                            await asyncio.sleep(3)  # 3 секунды между сигналами
+                    self._dispatch_signals_in_background(filtered_signals[:5])  # Максимум 5 сигналов
             
             logger.info(f"Мониторинг {interval_seconds}с завершен. Найдено сигналов: {len(signals)}")
             
         except Exception as e:
             logger.error(f"Ошибка в мониторинге {interval_seconds}с: {e}")
     
+    def _dispatch_signals_in_background(self, filtered_signals: List[tuple]):
+        """Запустить рассылку сигналов цикла фоновой задачей"""
+        task = asyncio.create_task(self._dispatch_signals(filtered_signals))
+        self._signal_dispatch_tasks.add(task)
+        task.add_done_callback(self._on_signal_dispatch_done)
+    
+    async def _dispatch_signals(self, filtered_signals: List[tuple]):
+        """Рассылка сигналов цикла: один сигнал - отдельным сообщением, несколько - сводкой"""
+        async with self._signal_dispatch_lock:
+            if len(filtered_signals) == 1:
+                signal, users = filtered_signals[0]
+                await self.send_arbitrage_signal(signal, users)
+            else:
+                await self.send_signal_digest(filtered_signals)
+    
+    def _on_signal_dispatch_done(self, task: asyncio.Task):
+        """Обработка завершения фоновой рассылки сигналов"""
+        self._signal_dispatch_tasks.discard(task)
+        if task.cancelled():
+            return
+        exc = task.exception()
+        if exc:
+            logger.error(f"Ошибка рассылки сигналов: {exc}")
+    
     def _get_minimum_spread_threshold(self, target_users: List[int]) -> float:
         """Получает минимальный порог спреда среди целевых пользователей"""
         min_threshold = float('inf')
@@ -1820,8 +2386,7 @@ class SimpleTelegramBot:
                 instruments_to_test = user_instruments if user_instruments else self.config.MONITORED_INSTRUMENTS
                 
                 # Получаем текущие котировки через MOEX API (с правильной конвертацией)
-                async with MOEXAPIClient() as moex_client:
-                    quotes = await moex_client.get_multiple_quotes(instruments_to_test)
+                quotes = await self.moex_client.get_multiple_quotes(instruments_to_test)
                 
                 logger.info(f"Получено котировок: {len(quotes) if quotes else 0}")
                 
@@ -1832,7 +2397,7 @@ class SimpleTelegramBot:
                 
                 # Формируем сообщение с текущими спредами
                 test_message = "🧪 **ТЕСТОВЫЙ МОНИТОРИНГ СПРЕДОВ**\n\n"
-                test_message += f"⏰ Время: {datetime.now().strftime('%H:%M:%S %d.%m.%Y')}\n"
+                test_message += f"⏰ Время: {_now_str()}\n"
                 test_message += f"📊 API ответ: {len(quotes)} инструментов\n"
                 test_message += f"🔄 Итерация: {iteration}\n\n"
                 
@@ -1857,12 +2422,12 @@ class SimpleTelegramBot:
                         continue
                     
                     if stock_price is None or futures_price is None or stock_price <= 0 or futures_price <= 0:
-                        logger.debug(f"Нет данных для {stock_ticker}: спот={stock_price}, фьючерс={futures_price}")
+                        logger.debug("Нет данных для %s: спот=%s, фьючерс=%s", stock_ticker, stock_price, futures_price)
                         continue
                     
                     futures_ticker = instruments_to_test.get(stock_ticker)
                     if not futures_ticker:
-                        logger.debug(f"Нет фьючерса для {stock_ticker}")
+                        logger.debug("Нет фьючерса для %s", stock_ticker)
                         continue
                     
                     # Используем правильный расчет спреда через ArbitrageCalculator
@@ -1889,7 +2454,7 @@ class SimpleTelegramBot:
                             display_stock_price = stock_price
                             display_futures_price = futures_price
                         
-                        logger.debug(f"Спред для {stock_ticker}/{futures_ticker}: {spread:.4f}%")
+                        logger.debug("Спред для %s/%s: %.4f%%", stock_ticker, futures_ticker, spread)
                         
                         spread_found = True
                         pair_count += 1
@@ -1964,97 +2529,246 @@ class SimpleTelegramBot:
         logger.info(f"Активных источников: {len(working_sources)}/{len(sources_status)}")
         
         # Планируем мониторинг
+        async def monitoring_step() -> bool:
+            """Одна итерация мониторинга (True - выполнен цикл умного мониторинга)"""
+            # Проверяем, нужно ли запускать мониторинг (или запустить его ожидающим открытия биржи)
+            if (not self.monitoring_controller.should_run_global_monitoring()
+                    and not self.monitoring_controller.get_pending_market_open_users()):
+                # Нет активных пользователей - ждем запуска мониторинга (проверка не реже раза в 10 сек)
+                await self._wait_monitoring_wakeup(10)
+                return False
+            
+            # Проверяем, открыта ли биржа
+            if not self.config.is_trading_hours():
+                # Проверяем пользователей, ожидающих открытия
+                pending_users = self.monitoring_controller.get_pending_market_open_users()
+                if pending_users:
+                    logger.info(f"Биржа закрыта. {len(pending_users)} пользователей ожидают открытия...")
+                
+                # Спим до открытия биржи (но не дольше 5 минут), а не фиксированные 5 минут:
+                # ожидающие пользователи получают мониторинг сразу в 09:00
+                await asyncio.sleep(min(300, self.config.seconds_until_market_open() + 0.5))
+                return False
+            
+            # Биржа открылась - уведомляем ожидающих пользователей
+            pending_users = self.monitoring_controller.get_pending_market_open_users()
+            open_notifications: Dict[str, List[int]] = {}
+            for user_id in pending_users:
+                self.monitoring_controller.start_monitoring_for_user(user_id)
+                
+                # Добавляем в планировщик
+                user_settings = self.user_settings.get_user_settings(user_id)
+                self.monitoring_scheduler.add_user_to_group(user_id, user_settings.monitoring_interval)
+                
+                self.monitoring_controller.remove_pending_market_open_user(user_id)
+                open_notifications.setdefault(user_settings.get_interval_display(), []).append(user_id)
+            
+            # Уведомления рассылаем параллельно, а не по одному
+            if open_notifications:
+                await asyncio.gather(*(
+                    self.broadcast(f"🟢 Биржа открылась! Мониторинг запущен с интервалом {interval_display}", user_ids)
+                    for interval_display, user_ids in open_notifications.items()
+                ))
+            
+            # Очищаем уведомления о закрытой бирже
+            self.monitoring_controller.clear_market_closed_notifications()
+            
+            # ПРОВЕРЯЕМ ЕЩЕ РАЗ перед запуском мониторинга
+            if not self.monitoring_controller.should_run_global_monitoring():
+                return False
+                
+            await self.smart_monitoring_cycle()
+            return True
+        
         async def monitoring_task():
+            consecutive_failures = 0
             while True:
-                # Проверяем, нужно ли запускать мониторинг
-                if not self.monitoring_controller.should_run_global_monitoring():
-                    # ИСПРАВЛЕНИЕ: Останавливаем цикл мониторинга если нет активных пользователей
-                    # вместо бесконечного ожидания в цикле
-                    await asyncio.sleep(10)  # Короткая проверка каждые 10 сек
-                    continue
-                
-                # Проверяем, открыта ли биржа
-                if not self.config.is_trading_hours():
-                    # Проверяем пользователей, ожидающих открытия
-                    pending_users = self.monitoring_controller.get_pending_market_open_users()
-                    if pending_users:
-                        logger.info(f"Биржа закрыта. {len(pending_users)} пользователей ожидают открытия...")
-                    
-                    await asyncio.sleep(300)  # Проверяем каждые 5 минут
-                    continue
-                
-                # Биржа открылась - уведомляем ожидающих пользователей
-                pending_users = self.monitoring_controller.get_pending_market_open_users()
-                for user_id in pending_users:
-                    self.monitoring_controller.start_monitoring_for_user(user_id)
-                    
-                    # Добавляем в планировщик
-                    user_settings = self.user_settings.get_user_settings(user_id)
-                    self.monitoring_scheduler.add_user_to_group(user_id, user_settings.monitoring_interval)
-                    
-                    self.monitoring_controller.remove_pending_market_open_user(user_id)
-                    await self.send_message(user_id, f"🟢 Биржа открылась! Мониторинг запущен с интервалом {user_settings.get_interval_display()}")
-                
-                # Очищаем уведомления о закрытой бирже
-                self.monitoring_controller.clear_market_closed_notifications()
-                
-                # ПРОВЕРЯЕМ ЕЩЕ РАЗ перед запуском мониторинга
-                if not self.monitoring_controller.should_run_global_monitoring():
-                    continue
-                    
+                # Под обработчиком вся итерация: случайная ошибка (активация ожидающих,
+                # настройки, планировщик) не должна через TaskGroup остановить прием обновлений
                 try:
-                    await self.smart_monitoring_cycle()
+                    if not await monitoring_step():
+                        continue
+                    consecutive_failures = 0
                 except Exception as e:
+                    consecutive_failures += 1
                     error_msg = f"Ошибка в умном мониторинге: {e}"
                     logger.error(error_msg)
-                    await self.notify_admin_error(error_msg)
+                    # При затяжном сбое не засыпаем администратора уведомлениями каждую секунду
+                    if consecutive_failures <= MONITORING_ERROR_NOTIFY_LIMIT:
+                        await self.notify_admin_error(error_msg)
+                    delay = min(
+                        MONITORING_ERROR_BACKOFF_BASE * 2 ** (consecutive_failures - 1),
+                        MONITORING_ERROR_BACKOFF_MAX
+                    ) + random.uniform(0, MONITORING_ERROR_BACKOFF_BASE)
+                    logger.warning(f"Ошибок мониторинга подряд: {consecutive_failures}, пауза {delay:.0f}с")
+                    await asyncio.sleep(delay)
+                    continue
                     
                 # Умная система мониторинга проверяет каждую секунду
                 await asyncio.sleep(1)
         
-        # Запускаем мониторинг в фоне
-        monitor_task = asyncio.create_task(monitoring_task())
+        # Прием обновлений отделен от их обработки: главный цикл только опрашивает
+        # Telegram и кладет обновления в очередь, а разбирают ее фоновые обработчики.
+        # Медленная команда больше не задерживает следующий getUpdates
+        update_queue: asyncio.Queue = asyncio.Queue(maxsize=UPDATE_QUEUE_SIZE)
         
-        # Основной цикл обработки сообщений
+        # Фоновые задачи живут в TaskGroup: ни одна не переживет run(), а падение любой
+        # из них останавливает остальные и доходит до администратора
         try:
-            while True:
-                updates = await self.get_updates()
-                
-                for update in updates:
-                    if update.message:
-                        chat_id = update.message["chat"]["id"]
-                        user_id = update.message["from"]["id"]
-                        text = update.message.get("text", "")
-                        
-                        # Устанавливаем админа при первом сообщении от него
-                        username = update.message["from"].get("username", "")
-                        if username == "Ildaryakupovv" and not self.monitoring_controller.get_admin_user_id():
-                            self.monitoring_controller.set_admin_user_id(user_id)
-                            logger.info(f"Администратор установлен: {user_id}")
-                        
-                        if text.startswith("/"):
-                            await self.handle_command(chat_id, text, user_id)
-                        else:
-                            # Обработка обычных сообщений
-                            await self.send_message(chat_id, "🤖 Я понимаю только команды. Используйте /help для получения списка доступных команд.")
-                            
-                    elif update.callback_query:
-                        await self.handle_callback_query(update.callback_query)
-                
-                await asyncio.sleep(1)  # Небольшая пауза между запросами
-                
-        except Exception as e:
-            logger.error(f"Ошибка в главном цикле бота: {e}")
-            await self.notify_admin_error(f"Критическая ошибка в главном цикле бота: {e}")
-        except KeyboardInterrupt:
-            logger.info("Остановка бота...")
+            async with asyncio.TaskGroup() as task_group:
+                background_tasks = [
+                    task_group.create_task(monitoring_task()),
+                    *(task_group.create_task(self._update_worker(update_queue)) for _ in range(UPDATE_WORKERS)),
+                ]
+                try:
+                    if self.config.WEBHOOK_URL:
+                        await self._serve_webhook(update_queue)
+                    else:
+                        await self._poll_updates(update_queue)
+                finally:
+                    # Фоновые циклы бесконечны - отменяем их, группа дождется завершения
+                    for task in background_tasks:
+                        task.cancel()
+        except* Exception as error_group:
+            for e in error_group.exceptions:
+                logger.error(f"Ошибка в главном цикле бота: {e}")
+                await self.notify_admin_error(f"Критическая ошибка в главном цикле бота: {e}")
         finally:
-            monitor_task.cancel()
-            try:
-                await monitor_task
-            except asyncio.CancelledError:
-                pass
+            # Рассылки сигналов запускаются из цикла мониторинга и в группу не входят
+            dispatch_tasks = list(self._signal_dispatch_tasks)
+            for task in dispatch_tasks:
+                task.cancel()
+            await asyncio.gather(*dispatch_tasks, return_exceptions=True)
+    
+    async def _poll_updates(self, update_queue: asyncio.Queue):
+        """Основной цикл: опрос Telegram и передача обновлений обработчикам"""
+        polling_interval = self.config.POLLING_INTERVAL
+        # Пока установлен webhook (например, оставшийся от прошлого запуска), getUpdates отвечает 409
+        await self._delete_webhook()
+        while True:
+            updates = await self.get_updates()
+            
+            for update in updates:
+                await update_queue.put(update)
             
+            # При long polling пауза между запросами не нужна (по умолчанию 0)
+            if polling_interval:
+                await asyncio.sleep(polling_interval)
+    
+    async def _serve_webhook(self, update_queue: asyncio.Queue):
+        """Прием обновлений через webhook: Telegram присылает их сам, без опроса getUpdates"""
+        # Случайный путь и секретный токен: чужие запросы на адрес бота отклоняются
+        secret_token = secrets.token_hex(32)
+        path = f"/webhook/{secrets.token_hex(16)}"
+        
+        async def handle_webhook(request: web.Request) -> web.Response:
+            if request.headers.get("X-Telegram-Bot-Api-Secret-Token") != secret_token:
+                return web.Response(status=403)
+            try:
+                update_data = json_loads(await request.read())
+            except Exception:
+                return web.Response(status=400)
+            
+            # Очередь заполнена - Telegram повторит доставку позже. Проверяем до разбора
+            # (и без await до put_nowait), чтобы отклоненное обновление не попало
+            # в журнал уже обработанных
+            if update_queue.full():
+                return web.Response(status=503)
+            
+            # Отвечаем сразу, обработку выполняют обработчики очереди
+            for update in self._parse_updates([update_data]):
+                update_queue.put_nowait(update)
+            return web.Response(status=200)
+        
+        app = web.Application()
+        app.router.add_post(path, handle_webhook)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, self.config.WEBHOOK_HOST, self.config.WEBHOOK_PORT)
+        await site.start()
+        
+        try:
+            webhook_data = {
+                "url": self.config.WEBHOOK_URL.rstrip("/") + path,
+                "secret_token": secret_token,
+                "allowed_updates": ["message", "callback_query"],
+                "max_connections": 40
+            }
+            self._ensure_session()
+            async with self.session.post(f"{self.base_url}/setWebhook", data=json_dumps(webhook_data), headers=JSON_HEADERS) as response:
+                if response.status != 200:
+                    raise RuntimeError(f"setWebhook: {response.status} - {await response.text()}")
+            logger.info(f"🌐 Webhook установлен, прием обновлений на порту {self.config.WEBHOOK_PORT}")
+            
+            # Обновления приходят в handle_webhook - здесь только держим сервер до остановки
+            await asyncio.Event().wait()
+        finally:
+            # Снимаем webhook, чтобы следующий запуск мог работать и через getUpdates
+            await self._delete_webhook()
+            await runner.cleanup()
+    
+    async def _delete_webhook(self):
+        """Снять webhook в Telegram (ошибка только логируется)"""
+        if not self._ensure_session():
+            return
+        try:
+            async with self.session.post(f"{self.base_url}/deleteWebhook") as response:
+                if response.status != 200:
+                    logger.warning(f"deleteWebhook: {response.status}")
+        except Exception as e:
+            logger.warning(f"Не удалось снять webhook: {e}")
+    
+    async def _wait_monitoring_wakeup(self, timeout: float):
+        """Ждать сигнала о запуске мониторинга не дольше timeout секунд"""
+        try:
+            await asyncio.wait_for(self._monitoring_wakeup.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._monitoring_wakeup.clear()
+    
+    async def _update_worker(self, update_queue: asyncio.Queue):
+        """Обработчик очереди обновлений: ошибка одного обновления не останавливает остальные"""
+        while True:
+            update = await update_queue.get()
+            try:
+                await self._dispatch_update(update)
+            except Exception as e:
+                error_msg = f"Ошибка обработки обновления {update.update_id}: {e}"
+                logger.error(error_msg)
+                try:
+                    await self.notify_admin_error(error_msg)
+                except Exception as notify_error:
+                    logger.error(f"Не удалось уведомить администратора: {notify_error}")
+            finally:
+                update_queue.task_done()
+            
+    async def _dispatch_update(self, update: TelegramUpdate):
+        """Обработка одного обновления Telegram"""
+        message = update.message
+        if message:
+            sender = message["from"]
+            chat_id = message["chat"]["id"]
+            user_id = sender["id"]
+            text = message.get("text")
+            
+            # Устанавливаем админа при первом сообщении от него (после этого проверка не выполняется)
+            if not self._admin_set and sender.get("username", "") in self._admin_usernames:
+                self.monitoring_controller.set_admin_user_id(user_id)
+                self._admin_set = True
+                logger.info(f"Администратор установлен: {user_id}")
+            
+            if text is None:
+                # Фото, стикеры, голосовые и прочие сообщения без текста не обрабатываем
+                return
+            if text.startswith("/"):
+                await self.handle_command(chat_id, text, user_id)
+            else:
+                # Обработка обычных сообщений
+                await self.send_prebuilt(chat_id, ONLY_COMMANDS_RESPONSE)
+                
+        elif update.callback_query:
+            await self.handle_callback_query(update.callback_query)
+    
     async def daily_validation_task(self):
         """ФОНОВАЯ задача валидации - НЕ блокирует запуск бота"""
         # ЗАДЕРЖКА 30 секунд для инициализации бота
@@ -2084,26 +2798,7 @@ class SimpleTelegramBot:
 
     def get_tradingview_link(self, ticker: str) -> str:
         """Получение ссылки на TradingView для инструмента"""
-        # Маппинг российских тикеров для TradingView
-        tv_mapping = {
-            "SBER": "MOEX:SBER",
-            "GAZP": "MOEX:GAZP", 
-            "LKOH": "MOEX:LKOH",
-            "VTBR": "MOEX:VTBR",
-            "YNDX": "NASDAQ:YNDX",
-            "TCSG": "MOEX:TCSG",
-            "ROSN": "MOEX:ROSN",
-            "GMKN": "MOEX:GMKN",
-            "PLZL": "MOEX:PLZL",
-            "MGNT": "MOEX:MGNT",
-            "SNGS": "MOEX:SNGS",
-            "ALRS": "MOEX:ALRS",
-            "TATN": "MOEX:TATN",
-            "MTSS": "MOEX:MTSS"
-        }
-        
-        tv_symbol = tv_mapping.get(ticker, f"MOEX:{ticker}")
-        return f"https://www.tradingview.com/chart/?symbol={tv_symbol}"
+        return _TV_URLS.get(ticker) or _tv_fallback_url(ticker)
 
     async def _send_subscription_offer(self, user_id: int):
         """Отправить предложение подписки пользователю"""
@@ -2224,4 +2919,4 @@ async def main():
         await bot.run()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    run_async(main())
\ No newline at end of file
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Тесты статуса торгов: кешированный is_trading_hours() должен совпадать с расчетом
+по явному времени, в том числе на границах торговой сессии
+"""
+
+from datetime import datetime, timedelta
+from unittest import mock
+
+import pytest
+
+import config
+from config import Config, MOSCOW_TZ
+
+# Пятница и следующая за ней суббота
+FRIDAY = datetime(2025, 8, 15, tzinfo=MOSCOW_TZ)
+SATURDAY = datetime(2025, 8, 16, tzinfo=MOSCOW_TZ)
+
+BOUNDARY_CASES = [
+    (FRIDAY.replace(hour=8, minute=59, second=59), False),
+    (FRIDAY.replace(hour=9, minute=0, second=0), True),
+    (FRIDAY.replace(hour=18, minute=44, second=59), True),
+    (FRIDAY.replace(hour=18, minute=45, second=0), False),
+    (FRIDAY.replace(hour=18, minute=45, second=29), False),
+    (SATURDAY.replace(hour=12, minute=0, second=0), False),
+]
+
+
+def _frozen_now(moment: datetime):
+    """datetime.now() модуля config, возвращающий заданный момент"""
+    class FrozenDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return moment.astimezone(tz) if tz else moment.replace(tzinfo=None)
+    return mock.patch.object(config, "datetime", FrozenDatetime)
+
+
+@pytest.mark.parametrize("moment, expected", BOUNDARY_CASES)
+def test_cached_matches_explicit_time(moment, expected):
+    """Кешированный ответ совпадает с ответом по явному времени"""
+    trading_config = Config()
+    assert trading_config.is_trading_hours(moment) is expected
+    with mock.patch.object(config._time, "time", return_value=moment.timestamp()):
+        assert trading_config.is_trading_hours() is expected
+
+
+@pytest.mark.parametrize("start", [
+    FRIDAY.replace(hour=8, minute=58),
+    FRIDAY.replace(hour=18, minute=43),
+])
+def test_cached_follows_clock_across_boundary(start):
+    """Один экземпляр (общий кеш) посекундно проходит через границу сессии"""
+    trading_config = Config()
+    for second in range(240):
+        moment = start + timedelta(seconds=second)
+        with mock.patch.object(config._time, "time", return_value=moment.timestamp()):
+            assert trading_config.is_trading_hours() is trading_config.is_trading_hours(moment), moment
+
+
+@pytest.mark.parametrize("moment, expected", [
+    (FRIDAY.replace(hour=8, minute=59, second=59), 1.0),
+    (FRIDAY.replace(hour=9, minute=0, second=0), 0.0),
+    (FRIDAY.replace(hour=18, minute=44, second=59), 0.0),
+    # Пятница после закрытия и выходные - до открытия в понедельник
+    (FRIDAY.replace(hour=18, minute=45, second=0), timedelta(days=2, hours=14, minutes=15).total_seconds()),
+    (FRIDAY.replace(hour=18, minute=45, second=29), timedelta(days=2, hours=14, minutes=14, seconds=31).total_seconds()),
+    (SATURDAY.replace(hour=12, minute=0, second=0), timedelta(days=1, hours=21).total_seconds()),
+])
+def test_seconds_until_market_open(moment, expected):
+    """Время до открытия по явному и по текущему времени"""
+    trading_config = Config()
+    assert trading_config.seconds_until_market_open(moment) == expected
+    with _frozen_now(moment):
+        assert trading_config.seconds_until_market_open() == expected
@@ -87,6 +87,37 @@ class UserSettings:
         """Получить количество выбранных инструментов"""
         return len(self.selected_instruments)
 
+def _choice_keyboard(options: Dict, prefix: str, per_row: int) -> Dict:
+    """Клавиатура выбора значения: кнопки по per_row в ряд и кнопка «Назад»"""
+    items = list(options.items())
+    keyboard_rows = [
+        [{"text": display, "callback_data": f"{prefix}_{value}"} for value, display in items[i:i + per_row]]
+        for i in range(0, len(items), per_row)
+    ]
+    keyboard_rows.append([{"text": "🔙 Назад", "callback_data": "settings_back"}])
+    return {"inline_keyboard": keyboard_rows}
+
+# Клавиатуры выбора не зависят от пользователя - собираем их один раз при импорте
+INTERVAL_KEYBOARD = _choice_keyboard(UserSettings.AVAILABLE_INTERVALS, "interval", 2)
+SPREAD_KEYBOARD = _choice_keyboard(UserSettings.AVAILABLE_SPREADS, "spread", 3)
+SIGNALS_KEYBOARD = {
+    "inline_keyboard": [
+        [
+            {"text": "1 сигнал", "callback_data": "signals_1"},
+            {"text": "2 сигнала", "callback_data": "signals_2"},
+            {"text": "3 сигнала", "callback_data": "signals_3"}
+        ],
+        [
+            {"text": "4 сигнала", "callback_data": "signals_4"},
+            {"text": "5 сигналов", "callback_data": "signals_5"},
+            {"text": "10 сигналов", "callback_data": "signals_10"}
+        ],
+        [
+            {"text": "🔙 Назад", "callback_data": "settings_back"}
+        ]
+    ]
+}
+
 class UserSettingsManager:
     """Менеджер персональных настроек пользователей"""
     
@@ -144,7 +175,7 @@ class UserSettingsManager:
             # Для быстрого мониторинга используем ротацию источников
             source_index = settings.get_next_source_index(len(self.data_sources))
             source = self.data_sources[source_index]
-            logger.debug(f"Пользователь {user_id}: ротация источника -> {source}")
+            logger.debug("Пользователь %s: ротация источника -> %s", user_id, source)
             return source
         else:
             # Для обычного мониторинга используем MOEX
@@ -172,60 +203,16 @@ class UserSettingsManager:
         return keyboard
     
     def get_interval_keyboard(self) -> Dict:
-        """Создать клавиатуру выбора интервала"""
-        keyboard_rows = []
-        
-        # Создаем кнопки по 2 в ряд
-        intervals = list(UserSettings.AVAILABLE_INTERVALS.items())
-        for i in range(0, len(intervals), 2):
-            row = []
-            for j in range(2):
-                if i + j < len(intervals):
-                    interval, display = intervals[i + j]
-                    row.append({"text": display, "callback_data": f"interval_{interval}"})
-            keyboard_rows.append(row)
-        
-        keyboard_rows.append([{"text": "🔙 Назад", "callback_data": "settings_back"}])
-        
-        return {"inline_keyboard": keyboard_rows}
+        """Клавиатура выбора интервала (общая для всех, не изменять)"""
+        return INTERVAL_KEYBOARD
     
     def get_spread_keyboard(self) -> Dict:
-        """Создать клавиатуру выбора порога спреда"""
-        keyboard_rows = []
-        
-        # Создаем кнопки по 3 в ряд
-        spreads = list(UserSettings.AVAILABLE_SPREADS.items())
-        for i in range(0, len(spreads), 3):
-            row = []
-            for j in range(3):
-                if i + j < len(spreads):
-                    spread, display = spreads[i + j]
-                    row.append({"text": display, "callback_data": f"spread_{spread}"})
-            keyboard_rows.append(row)
-        
-        keyboard_rows.append([{"text": "🔙 Назад", "callback_data": "settings_back"}])
-        
-        return {"inline_keyboard": keyboard_rows}
+        """Клавиатура выбора порога спреда (общая для всех, не изменять)"""
+        return SPREAD_KEYBOARD
     
     def get_signals_keyboard(self) -> Dict:
-        """Создать клавиатуру выбора количества сигналов"""
-        return {
-            "inline_keyboard": [
-                [
-                    {"text": "1 сигнал", "callback_data": "signals_1"},
-                    {"text": "2 сигнала", "callback_data": "signals_2"},
-                    {"text": "3 сигнала", "callback_data": "signals_3"}
-                ],
-                [
-                    {"text": "4 сигнала", "callback_data": "signals_4"},
-                    {"text": "5 сигналов", "callback_data": "signals_5"},
-                    {"text": "10 сигналов", "callback_data": "signals_10"}
-                ],
-                [
-                    {"text": "🔙 Назад", "callback_data": "settings_back"}
-                ]
-            ]
-        }
+        """Клавиатура выбора количества сигналов (общая для всех, не изменять)"""
+        return SIGNALS_KEYBOARD
     
     def get_settings_summary(self, user_id: int) -> str:
         """Получить сводку настроек пользователя"""
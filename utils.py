@@ -1,7 +1,7 @@
 import logging
 import asyncio
 from datetime import datetime, timezone
-from typing import Any, Callable, Optional
+from typing import Any, Callable, Coroutine, Optional
 import functools
 
 logger = logging.getLogger(__name__)
@@ -120,7 +120,7 @@ class RateLimiter:
             wait_time = self.time_window - (now - oldest_call)
             
             if wait_time > 0:
-                logger.debug(f"Rate limit достигнут. Ожидание {wait_time:.2f} секунд")
+                logger.debug("Rate limit достигнут. Ожидание %.2f секунд", wait_time)
                 await asyncio.sleep(wait_time)
         
         # Записываем текущий вызов
@@ -263,13 +263,13 @@ def log_function_call(func: Callable):
     """Декоратор для логирования вызовов функций"""
     @functools.wraps(func)
     async def async_wrapper(*args, **kwargs):
-        logger.debug(f"Вызов {func.__name__} с args={args}, kwargs={kwargs}")
+        logger.debug("Вызов %s с args=%s, kwargs=%s", func.__name__, args, kwargs)
         start_time = asyncio.get_event_loop().time()
         
         try:
             result = await func(*args, **kwargs)
             execution_time = asyncio.get_event_loop().time() - start_time
-            logger.debug(f"{func.__name__} выполнен за {execution_time:.3f}s")
+            logger.debug("%s выполнен за %.3fs", func.__name__, execution_time)
             return result
         except Exception as e:
             execution_time = asyncio.get_event_loop().time() - start_time
@@ -278,14 +278,26 @@ def log_function_call(func: Callable):
     
     @functools.wraps(func)
     def sync_wrapper(*args, **kwargs):
-        logger.debug(f"Вызов {func.__name__} с args={args}, kwargs={kwargs}")
+        logger.debug("Вызов %s с args=%s, kwargs=%s", func.__name__, args, kwargs)
         
         try:
             result = func(*args, **kwargs)
-            logger.debug(f"{func.__name__} выполнен успешно")
+            logger.debug("%s выполнен успешно", func.__name__)
             return result
         except Exception as e:
             logger.error(f"{func.__name__} завершен с ошибкой: {e}")
             raise
     
     return async_wrapper if asyncio.iscoroutinefunction(func) else sync_wrapper
+
+def run_async(main: Coroutine) -> Any:
+    """Запуск корневой корутины приложения (точки входа бота)"""
+    # uvloop (если установлен) заметно быстрее стандартного цикла событий на сетевом I/O
+    try:
+        import uvloop
+        loop_factory = uvloop.new_event_loop
+    except ImportError:
+        loop_factory = None
+    
+    with asyncio.Runner(loop_factory=loop_factory) as runner:
+        return runner.run(main)